@@ -0,0 +1,74 @@
+from typing import Callable, Dict, List, Sequence
+
+import numpy as np
+import pandas as pd
+
+# Length-bucketed dynamic batching for the neural metrics.
+#
+# A fixed batch size mixes short and long segments, so on CPU most of the work
+# goes into padding. Here segments are grouped by estimated token length and
+# each group is scored with the batch size that keeps a batch under a token
+# budget: a segment of length L goes to the bucket whose batch size is the
+# largest power of two with batch_size * L <= max_batch_tokens. Each bucket is
+# one predict() call (the models sort by length inside a call), so there are
+# only a handful of calls per column, and scores are put back in row order.
+
+DEFAULT_MAX_BATCH_TOKENS = {
+    "comet": 4096,
+    "transquest": 4096,
+    "bertscore": 8192,
+}
+DEFAULT_MAX_BATCH_SIZE = 64
+
+# Hiragana/Katakana, CJK ideographs and Hangul. Not a raw string: Python turns the \u
+# escapes into the characters themselves, since the pyarrow string engine's regex
+# syntax has no \u escapes
+_CJK = '[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af]'
+
+
+def estimate_tokens(texts: Sequence[str]) -> np.ndarray:
+    """Approximate subword token counts: one per CJK character, one per four other characters."""
+    s = pd.Series(texts, dtype=object).astype(str)
+    n_cjk = s.str.count(_CJK).to_numpy()
+    n_other = s.str.len().to_numpy() - n_cjk
+    # +2 for the special tokens added around every segment
+    return n_cjk + np.ceil(n_other / 4).astype(np.int64) + 2
+
+
+def batch_limits(config: Dict):
+    max_tokens = int(config.get("max_batch_tokens", DEFAULT_MAX_BATCH_TOKENS.get(config.get("type"), 4096)))
+    max_batch = int(config.get("max_batch_size", DEFAULT_MAX_BATCH_SIZE))
+    return max_tokens, max_batch
+
+
+def length_buckets(lengths: np.ndarray, max_tokens: int, max_batch: int) -> List[tuple]:
+    """Split positions into (positions sorted by length, batch_size) buckets."""
+    lengths = np.maximum(np.asarray(lengths, dtype=np.int64), 1)
+    order = np.argsort(lengths, kind="stable")
+    # Largest power of two batch size that keeps batch_size * length within the budget
+    sizes = np.maximum(max_tokens // lengths[order], 1)
+    sizes = np.minimum(2 ** np.floor(np.log2(sizes)).astype(np.int64), max_batch)
+
+    buckets = []
+    for size in np.unique(sizes)[::-1]:
+        members = order[sizes == size]
+        buckets.append((members, int(size)))
+    return buckets
+
+
+def bucketed_predict(rows: List[int], lengths: np.ndarray, config: Dict,
+                     predict_bucket: Callable[[List[int], int], Sequence[float]]) -> List[float]:
+    """Score `rows` with one predict_bucket(bucket_rows, batch_size) call per length bucket.
+
+    `lengths` holds the estimated token length of every row of the job;
+    the returned scores follow the order of `rows`.
+    """
+    if not rows:
+        return []
+    max_tokens, max_batch = batch_limits(config)
+    rows = np.asarray(rows)
+    scores = np.zeros(len(rows), dtype=np.float64)
+    for positions, batch_size in length_buckets(lengths[rows], max_tokens, max_batch):
+        bucket_scores = predict_bucket(rows[positions].tolist(), batch_size)
+        scores[positions] = np.asarray(bucket_scores, dtype=np.float64).reshape(-1)
+    return scores.tolist()
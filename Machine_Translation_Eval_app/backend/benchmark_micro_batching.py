@@ -0,0 +1,94 @@
+import argparse
+import contextlib
+import io
+import threading
+import time
+
+import pandas as pd
+
+import instrumentation
+from calibration import synthetic_segments
+from evaluator import evaluator
+
+# Throughput of a neural metric under concurrent small jobs, with and without
+# micro-batching (see micro_batching.py).
+#
+#   python benchmark_micro_batching.py --model wmt22-cometkiwi-da --jobs 10 --rows 8
+#
+# Every job is a separate evaluate() call on its own thread, as GPU_JOB_WORKERS
+# job workers would run them, with its own segments so nothing is shared
+# through deduplication; the score cache is off. Each run uses new segments.
+# The micro-batched run turns the batcher on itself (MICRO_BATCH_WAIT_MS, or
+# 5 ms when that is 0), whatever GPU_JOB_WORKERS is set to: with the default
+# of one job worker the app never uses it.
+
+
+def run_jobs(model_key: str, n_jobs: int, rows: int, tokens: int, seed: int) -> float:
+    frames = []
+    for job in range(n_jobs):
+        srcs, mts, refs = (synthetic_segments(rows, tokens, seed=seed * 1000 + job * 3 + k) for k in range(3))
+        frames.append(pd.DataFrame({"src": srcs, "mt": mts, "ref": refs}))
+    errors = []
+
+    def run(df):
+        try:
+            evaluator.evaluate(df, "src", ["mt"], [model_key], "ref", progress_callback=lambda message: None)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=run, args=(df,)) for df in frames]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+    return time.perf_counter() - start
+
+
+def model_calls(model_key: str) -> tuple:
+    # Model calls made by the micro-batcher and the job batches they merged
+    return (instrumentation.registry.value("mteval_model_batches_total", model=model_key),
+            instrumentation.registry.value("mteval_model_batch_requests_total", model=model_key))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Throughput of a neural metric under concurrent small jobs")
+    parser.add_argument("--model", default="wmt22-cometkiwi-da", help="model key from the model configuration")
+    parser.add_argument("--jobs", type=int, default=10, help="concurrent jobs")
+    parser.add_argument("--rows", type=int, default=8, help="rows per job")
+    parser.add_argument("--tokens", type=int, default=24, help="approximate tokens per segment")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--wait-ms", type=float, default=None, help="micro-batching wait (default MICRO_BATCH_WAIT_MS)")
+    args = parser.parse_args()
+
+    evaluator.score_cache = None
+    wait = args.wait_ms / 1000 if args.wait_ms is not None else evaluator.micro_batch_wait or 0.005
+    print(f"Loading {args.model}...")
+    evaluator.load_model(args.model)
+
+    segments = args.jobs * args.rows
+    seed = 0
+    for label, micro_batch_wait in (("separate calls", 0.0), (f"micro-batched ({wait * 1000:g} ms)", wait)):
+        evaluator.micro_batch_wait = micro_batch_wait
+        # Warm-up run, not timed
+        seed += 1
+        with contextlib.redirect_stdout(io.StringIO()):
+            run_jobs(args.model, args.jobs, args.rows, args.tokens, seed)
+        calls_before = model_calls(args.model)
+        times = []
+        for _ in range(args.repeats):
+            seed += 1
+            with contextlib.redirect_stdout(io.StringIO()):
+                times.append(run_jobs(args.model, args.jobs, args.rows, args.tokens, seed))
+        best = min(times)
+        line = f"{label:>28}: {best:.3f}s for {args.jobs} jobs x {args.rows} rows, {segments / best:.1f} segments/s"
+        calls, requests = (after - before for after, before in zip(model_calls(args.model), calls_before))
+        if calls:
+            line += f", {requests / calls:.1f} job batches per model call"
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+import json
+import os
+import random
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+# Measured throughput of every metric type on this machine, for /estimate_time.
+#
+# Each metric type is timed on synthetic segments of a few lengths and the
+# seconds per segment are stored per hardware, so the estimate follows the
+# actual CPU/GPU and the segment length of the uploaded file instead of a flat
+# rows-per-second guess. The string metrics are benchmarked in the background
+# at startup; the neural metrics in the background right after their model is
+# first loaded (their weights are several GB, so startup does not download or
+# load them just to time them, and the job that loaded the model does not wait
+# for the benchmark). Until a type is calibrated, the old heuristic is used for it.
+
+# Estimated tokens per benchmark segment (see batching.estimate_tokens)
+BENCHMARK_TOKENS = (16, 48, 128)
+BENCHMARK_SEGMENTS = {
+    "comet": 16,
+    "transquest": 16,
+    "bertscore": 32,
+    "sacrebleu": 256,
+    "ter": 64,
+    "chrf": 256,
+}
+STRING_TYPES = ("sacrebleu", "ter", "chrf")
+NEURAL_TYPES = ("comet", "transquest", "bertscore")
+
+
+def synthetic_segments(n: int, tokens: int, seed: int = 0) -> List[str]:
+    # Random lowercase words; about four characters per token
+    rng = random.Random(seed * 1000 + tokens)
+    segments = []
+    for _ in range(n):
+        words, length = [], 0
+        while length < max(tokens - 2, 1) * 4:
+            word = "".join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rng.randint(2, 8)))
+            words.append(word)
+            length += len(word) + 1
+        segments.append(" ".join(words))
+    return segments
+
+
+def benchmark(metric_type: str, run: Callable[[List[str], List[str], List[str]], None]) -> Dict:
+    """Time run(srcs, mts, refs) at every BENCHMARK_TOKENS length."""
+    n = BENCHMARK_SEGMENTS.get(metric_type, 16)
+    # Warm-up: first calls pay for lazy initialization (CUDA context, tokenizer caches)
+    warm = synthetic_segments(2, BENCHMARK_TOKENS[0], seed=3)
+    run(warm, warm, warm)
+    seconds = []
+    for tokens in BENCHMARK_TOKENS:
+        srcs, mts, refs = (synthetic_segments(n, tokens, seed) for seed in range(3))
+        start = time.perf_counter()
+        run(srcs, mts, refs)
+        seconds.append((time.perf_counter() - start) / n)
+    return {"tokens": list(BENCHMARK_TOKENS), "seconds_per_segment": seconds}
+
+
+def _run_string_metric(metric_type: str):
+    from string_metrics import StringMetricScorer
+
+    def run(srcs, mts, refs):
+        scorer = StringMetricScorer(metric_type)
+        scorer.set_references(refs)
+        scorer.compute_stats(mts)
+    return run
+
+
+class Calibration:
+    def __init__(self, path: str, hardware: Callable[[], Dict]):
+        # `hardware` is called on first use (detecting the GPU imports torch)
+        self.path = path
+        self._hardware = hardware
+        self.hardware = None
+        self._lock = threading.Lock()
+        self._types: Optional[Dict[str, Dict]] = None
+        self._mtime = None
+        # Types being benchmarked by a background thread
+        self._running = set()
+
+    def _loaded(self) -> Dict[str, Dict]:
+        # Read again when another process (the model server of a split deployment) recorded measurements
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            mtime = None
+        with self._lock:
+            if self._types is None or mtime != self._mtime:
+                if self.hardware is None:
+                    self.hardware = self._hardware()
+                self._types = {}
+                self._mtime = mtime
+                try:
+                    with open(self.path, encoding="utf-8") as f:
+                        stored = json.load(f)
+                    # Measurements from other hardware do not apply
+                    if stored.get("hardware") == self.hardware:
+                        self._types = stored.get("types", {})
+                except (OSError, ValueError):
+                    pass
+            return self._types
+
+    def has(self, metric_type: str) -> bool:
+        return metric_type in self._loaded()
+
+    def results(self) -> Dict:
+        types = self._loaded()
+        return {"hardware": self.hardware, "types": dict(types)}
+
+    def record(self, metric_type: str, result: Dict):
+        types = self._loaded()
+        with self._lock:
+            types[metric_type] = result
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            tmp = self.path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({"hardware": self.hardware, "types": types}, f, indent=2)
+            os.replace(tmp, self.path)
+            self._mtime = os.path.getmtime(self.path)
+
+    def calibrate(self, metric_type: str, run: Callable[[List[str], List[str], List[str]], None]):
+        if self.has(metric_type):
+            return
+        try:
+            result = benchmark(metric_type, run)
+        except Exception as e:
+            print(f"Calibrating {metric_type} failed: {e}")
+            return
+        self.record(metric_type, result)
+        rates = ", ".join(f"{t} tokens: {1 / s:.0f} seg/s" for t, s in zip(result["tokens"], result["seconds_per_segment"]))
+        print(f"Calibrated {metric_type}: {rates}")
+
+    def start(self):
+        """Benchmark the string metrics in a background thread."""
+        def run():
+            for metric_type in STRING_TYPES:
+                self.calibrate(metric_type, _run_string_metric(metric_type))
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def start_type(self, metric_type: str, run: Callable[[List[str], List[str], List[str]], None]):
+        """Benchmark one metric type in a background thread, unless it is already being benchmarked."""
+        with self._lock:
+            if metric_type in self._running:
+                return
+            self._running.add(metric_type)
+
+        def calibrate():
+            try:
+                self.calibrate(metric_type, run)
+            finally:
+                with self._lock:
+                    self._running.discard(metric_type)
+
+        threading.Thread(target=calibrate, name=f"calibrate-{metric_type}", daemon=True).start()
+
+    def seconds_per_segment(self, metric_type: str, tokens: float) -> Optional[float]:
+        result = self._loaded().get(metric_type)
+        if not result:
+            return None
+        xs = np.asarray(result["tokens"], dtype=float)
+        ys = np.asarray(result["seconds_per_segment"], dtype=float)
+        if tokens > xs[-1]:
+            # Linear beyond the longest benchmark length
+            slope = (ys[-1] - ys[-2]) / (xs[-1] - xs[-2])
+            return float(ys[-1] + max(slope, 0.0) * (tokens - xs[-1]))
+        return float(np.interp(tokens, xs, ys))
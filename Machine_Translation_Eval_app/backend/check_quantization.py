@@ -0,0 +1,58 @@
+import argparse
+import sys
+
+import numpy as np
+
+import quantization
+from config import QUANTIZATION_CHECK_PATH
+from evaluator import evaluator
+
+# Regression check of the int8 CPU backend (see quantization.py) on real
+# segments: every row of a sheet is scored with the float model and with its
+# int8 copy, and the differences are reported.
+#
+#   python check_quantization.py --model wmt22-cometkiwi-da
+#
+# The sheet is read like the load-time check: the first column is the source,
+# the second the reference and every further column a translation (default:
+# the bundled Goodall sample). Exits with status 1 if a score moves by more
+# than the model's quantization tolerance.
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Float vs int8 scores of a COMET or TransQuest model on a sheet")
+    parser.add_argument("--model", default="wmt22-cometkiwi-da", help="model key from the model configuration")
+    parser.add_argument("--file", default=QUANTIZATION_CHECK_PATH, help="sheet: source, reference, translations")
+    args = parser.parse_args()
+
+    metric = evaluator.metric(args.model)
+    if metric.type not in ("comet", "transquest"):
+        parser.error(f"{args.model} is a {metric.type} model; only COMET and TransQuest are quantized")
+    segments = quantization.check_segments(args.file, n=None)
+    if segments is None:
+        parser.error(f"{args.file} not found or has fewer than three columns")
+    srcs, mts, refs = segments
+
+    model = metric.load()
+    float_scores = np.asarray(evaluator._check_scores(args.model, model, srcs, mts, refs))
+    float_module = quantization.module_of(model, metric.type)
+    int8_module = quantization.quantize(float_module)
+    if metric.type == "transquest":
+        model.model = int8_module
+    else:
+        model = int8_module
+    int8_scores = np.asarray(evaluator._check_scores(args.model, model, srcs, mts, refs))
+
+    diff = np.abs(float_scores - int8_scores)
+    print(f"{len(mts)} segments of {args.file}")
+    print(f"max |float - int8|: {diff.max():.4f}   mean: {diff.mean():.4f}   "
+          f"Pearson r: {np.corrcoef(float_scores, int8_scores)[0, 1]:.4f}")
+    # The corpus-level mean is what a comparison of MT systems reads
+    print(f"mean score: float {float_scores.mean():.4f}, int8 {int8_scores.mean():.4f}")
+    tolerance = quantization.tolerance(metric.config)
+    print(f"tolerance: {tolerance}")
+    return 1 if diff.max() > tolerance else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,123 @@
+import hashlib
+import json
+import os
+import shutil
+from typing import Dict, List, Optional, Sequence
+from urllib.parse import quote
+
+import numpy as np
+import pandas as pd
+
+# Checkpoints of running evaluation jobs.
+#
+# Every metric scores a job in chunks of `chunk_rows` rows (see
+# job_inputs.JobRows). A neural metric's chunk is written to
+# <directory>/<model>/chunk-<k>.parquet with one score column per target
+# column; a string metric's chunk to <model>/stats-<k>.parquet, the per-row
+# sufficient statistics its sentence and corpus scores are computed from.
+# Metrics that can only score a whole job at once save their result as
+# <model>/result.parquet plus the corpus scores. When a job that was
+# interrupted runs again (the job queue requeues unfinished jobs on startup),
+# the saved chunks and results are read back and only the rest is scored.
+#
+# manifest.json holds a fingerprint of the job's input columns and model
+# configurations; a checkpoint of different inputs is discarded. A job's
+# checkpoint is deleted once the job is done, failed or cancelled.
+
+
+def fingerprint(df: pd.DataFrame, columns: List[str], configs: Dict[str, Dict], chunk_rows: int = 10000) -> str:
+    digest = hashlib.sha256()
+    digest.update(json.dumps([columns, configs], sort_keys=True, default=str).encode("utf-8"))
+    # Hashed a chunk of rows at a time, so the columns are never all converted at once
+    for start in range(0, len(df), chunk_rows):
+        part = df[columns].iloc[start:start + chunk_rows]
+        digest.update(pd.util.hash_pandas_object(part.astype(str), index=False).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+def _write_atomic(path: str, write):
+    write(path + ".tmp")
+    os.replace(path + ".tmp", path)
+
+
+class Checkpoint:
+    def __init__(self, directory: str, fingerprint: str, chunk_rows: int):
+        self.directory = directory
+        self.chunk_rows = chunk_rows
+        manifest = {"fingerprint": fingerprint, "chunk_rows": chunk_rows}
+        path = os.path.join(directory, "manifest.json")
+        try:
+            with open(path, encoding="utf-8") as f:
+                found = json.load(f)
+        except (OSError, ValueError):
+            found = None
+        if found != manifest:
+            if found is not None:
+                print(f"Discarding checkpoint {directory}: the job's inputs changed")
+            shutil.rmtree(directory, ignore_errors=True)
+            os.makedirs(directory, exist_ok=True)
+            _write_atomic(path, lambda p: _write_json(p, manifest))
+
+    def _model_dir(self, model_key: str) -> str:
+        path = os.path.join(self.directory, quote(model_key, safe=""))
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def save_chunk(self, model_key: str, k: int, scores: Dict[str, Sequence[float]]):
+        """Scores of rows [k * chunk_rows, (k + 1) * chunk_rows) of every target column."""
+        frame = pd.DataFrame({col: list(values) for col, values in scores.items()})
+        _write_atomic(os.path.join(self._model_dir(model_key), f"chunk-{k:06d}.parquet"),
+                      lambda p: frame.to_parquet(p, index=False))
+
+    def chunk_indices(self, model_key: str, prefix: str = "chunk-") -> List[int]:
+        names = os.listdir(self._model_dir(model_key))
+        return sorted(int(name[len(prefix):-len(".parquet")]) for name in names
+                      if name.startswith(prefix) and name.endswith(".parquet"))
+
+    def chunk(self, model_key: str, k: int) -> pd.DataFrame:
+        """A saved chunk of scores, one column per target column."""
+        return pd.read_parquet(os.path.join(self._model_dir(model_key), f"chunk-{k:06d}.parquet"))
+
+    def save_stats(self, model_key: str, k: int, stats: Dict[str, np.ndarray]):
+        """A string metric's per-row statistics of chunk k (Metric.chunk_stats), one list column per target column."""
+        frame = pd.DataFrame({col: list(values) for col, values in stats.items()})
+        _write_atomic(os.path.join(self._model_dir(model_key), f"stats-{k:06d}.parquet"),
+                      lambda p: frame.to_parquet(p, index=False))
+
+    def stats(self, model_key: str) -> Dict[int, Dict[str, np.ndarray]]:
+        """The saved statistics of a string metric by chunk index."""
+        directory = self._model_dir(model_key)
+        saved = {}
+        for k in self.chunk_indices(model_key, "stats-"):
+            frame = pd.read_parquet(os.path.join(directory, f"stats-{k:06d}.parquet"))
+            saved[k] = {col: np.stack(frame[col].to_numpy()) for col in frame.columns}
+        return saved
+
+    def save_result(self, model_key: str, results: Dict[str, Dict]):
+        """The Metric.score_columns result of a metric scored in one pass."""
+        directory = self._model_dir(model_key)
+        corpus = {col: {"corpus": r["corpus"], "ci": r["ci"]} for col, r in results.items()}
+        _write_atomic(os.path.join(directory, "corpus.json"), lambda p: _write_json(p, corpus))
+        # Written last: the result counts as saved once this file exists
+        frame = pd.DataFrame({col: list(r["scores"]) for col, r in results.items()})
+        _write_atomic(os.path.join(directory, "result.parquet"), lambda p: frame.to_parquet(p, index=False))
+
+    def result(self, model_key: str) -> Optional[Dict[str, Dict]]:
+        directory = self._model_dir(model_key)
+        path = os.path.join(directory, "result.parquet")
+        if not os.path.exists(path):
+            return None
+        frame = pd.read_parquet(path)
+        with open(os.path.join(directory, "corpus.json"), encoding="utf-8") as f:
+            corpus = json.load(f)
+        return {col: {"scores": frame[col].tolist(), "corpus": corpus[col]["corpus"],
+                      "ci": tuple(corpus[col]["ci"]) if corpus[col]["ci"] else None} for col in frame.columns}
+
+
+def remove(directory: str):
+    shutil.rmtree(directory, ignore_errors=True)
+
+
+def _write_json(path: str, data):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
@@ -3,6 +3,55 @@ import os
 
 MODELS_CONFIG_PATH = "models_config.json"
 
+# Worker processes for BLEU/TER/chrF scoring (0 = one per CPU core, 1 = in-process)
+STRING_METRIC_WORKERS = int(os.getenv("STRING_METRIC_WORKERS", "0"))
+# Tokenized strings kept per job (and per pool worker) for BLEU and TER to share, in MB
+TOKEN_CACHE_MB = int(os.getenv("TOKEN_CACHE_MB", "64"))
+
+# On-disk cache of neural metric segment scores (set the size to 0 to disable)
+SCORE_CACHE_PATH = os.path.join("uploads", "score_cache.sqlite3")
+SCORE_CACHE_MAX_BYTES = int(os.getenv("SCORE_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+
+# RAM budget for loaded models in MB (0 = half of the physical memory)
+MODEL_MEMORY_BUDGET_MB = int(os.getenv("MODEL_MEMORY_BUDGET_MB", "0"))
+# Rows per score chunk pushed over the websocket in streaming mode
+STREAM_CHUNK_ROWS = int(os.getenv("STREAM_CHUNK_ROWS", "1000"))
+# Rows per checkpointed chunk of a neural metric; interrupted jobs resume from the last saved chunk
+CHECKPOINT_CHUNK_ROWS = int(os.getenv("CHECKPOINT_CHUNK_ROWS", "1000"))
+CHECKPOINT_DIR = os.path.join("uploads", "checkpoints")
+# Rows of an .xlsx sheet read and written to Parquet at a time while parsing an upload
+XLSX_BATCH_ROWS = int(os.getenv("XLSX_BATCH_ROWS", "10000"))
+# "int8" runs COMET/TransQuest with dynamically quantized weights on CPU (see quantization.py)
+CPU_BACKEND = os.getenv("CPU_BACKEND", "pytorch")
+CPU_INTRA_OP_THREADS = int(os.getenv("CPU_INTRA_OP_THREADS", "0"))
+QUANTIZED_MODEL_DIR = os.path.join("uploads", "quantized")
+# Sheet whose rows are scored with the float and the int8 model before int8 is used (source, reference, translations)
+QUANTIZATION_CHECK_PATH = os.getenv("QUANTIZATION_CHECK_PATH", os.path.join("uploads", "Goodall.en-zh_ref-zh_mtfs-zh_mt0s.xlsx"))
+# Measured per-metric throughput on this machine (see calibration.py)
+CALIBRATION_PATH = os.path.join("uploads", "calibration.json")
+# BERTScore reference embeddings kept per job: in RAM up to this budget, memory-mapped files beyond it
+BERTSCORE_REF_CACHE_MB = int(os.getenv("BERTSCORE_REF_CACHE_MB", "1024"))
+BERTSCORE_REF_CACHE_DIR = os.path.join("uploads", "bertscore_refs")
+JOBS_DB_PATH = os.path.join("uploads", "jobs.sqlite3")
+# Uploads by content hash, each with a memory-mapped Arrow copy of its rows (see upload_store.py)
+UPLOAD_STORE_DIR = os.path.join("uploads", "store")
+# Rows and score summaries of finished jobs (see results_store.py)
+RESULTS_DIR = os.path.join("uploads", "results")
+# Evaluation jobs running at once: neural jobs share the GPU, string-only jobs run beside them
+GPU_JOB_WORKERS = int(os.getenv("GPU_JOB_WORKERS", "1"))
+CPU_JOB_WORKERS = int(os.getenv("CPU_JOB_WORKERS", "2"))
+# Longest wait in ms for batches of concurrent jobs to share a COMET/TransQuest/BERTScore call (0 disables; see micro_batching.py)
+MICRO_BATCH_WAIT_MS = float(os.getenv("MICRO_BATCH_WAIT_MS", "5"))
+# API worker processes; with more than one, jobs and models live in one model server (see model_server.py)
+API_WORKERS = int(os.getenv("API_WORKERS", "1"))
+# Set in the API workers to submit jobs to the model server instead of running them
+MODEL_SERVER = os.getenv("MODEL_SERVER", "0") == "1"
+# Unix socket (named pipe on Windows) or "host:port" the model server listens on
+MODEL_SERVER_ADDRESS = os.getenv(
+    "MODEL_SERVER_ADDRESS",
+    r"\\.\pipe\mteval-model-server" if os.name == "nt" else os.path.join("uploads", "model_server.sock"))
+MODEL_SERVER_KEY_PATH = os.path.join("uploads", "model_server.key")
+
 DEFAULT_MODELS = {
     "wmt22-cometkiwi-da": {
         "type": "comet",
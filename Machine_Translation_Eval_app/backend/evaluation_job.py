@@ -0,0 +1,121 @@
+import os
+import time
+from functools import partial
+from typing import Callable, Dict, List, Optional
+
+import pandas as pd
+
+import checkpoint
+import export
+import ingest
+import instrumentation
+from config import JOBS_DB_PATH, RESULTS_DIR, CHECKPOINT_DIR, GPU_JOB_WORKERS, CPU_JOB_WORKERS, UPLOAD_STORE_DIR
+from job_queue import JobQueue, JobStore
+from upload_store import UploadStore
+
+# Running evaluation jobs: the job queue and what one job does (load the
+# upload, evaluate, keep the selected columns, write the result files).
+#
+# The jobs run in the API process, or in the model server when the API runs
+# as several workers (see model_server.py); both build their queue here.
+
+UPLOAD_DIR = "uploads"
+upload_store = UploadStore(UPLOAD_STORE_DIR)
+
+
+def run_evaluation(evaluator, job_id: str, request: Dict, progress_callback,
+                   send_chunk: Optional[Callable[[str, Dict], None]] = None) -> pd.DataFrame:
+    # Runs on a job queue worker thread. `request` is a submitted EvaluateRequest;
+    # send_chunk(client_id, chunk) pushes a streamed score chunk to the job's client
+    upload_id = request.get("upload_id")
+    if upload_id:
+        if not upload_store.exists(upload_id):
+            raise FileNotFoundError(f"Upload not found: {request['filename']} ({upload_id})")
+    else:
+        # Files placed in uploads/ directly
+        file_path = os.path.join(UPLOAD_DIR, request["filename"])
+        if not os.path.exists(file_path):
+            raise FileNotFoundError(f"File not found: {request['filename']}")
+    src_col, tgt_cols, ref_col = request["src_col"], request["tgt_cols"], request.get("ref_col")
+    extra_ref_cols = request.get("extra_ref_cols") or []
+
+    # Start loading this job's models while the upload is loaded
+    evaluator.preload(request["models"])
+
+    start = time.perf_counter()
+    # A stored upload is memory-mapped, shared with every other job on it
+    df = upload_store.frame(upload_id) if upload_id else ingest.load(file_path)
+    job_load = time.perf_counter() - start
+
+    chunk_callback = None
+    client_id = request.get("client_id")
+    if request.get("stream") and client_id and send_chunk:
+        def chunk_callback(model_key: str, tgt_col: str, start: int, scores: List[float]):
+            send_chunk(client_id, {"type": "chunk", "job_id": job_id, "model": model_key, "column": tgt_col, "start": start, "scores": scores})
+
+    results_df = evaluator.evaluate(
+        df,
+        src_col,
+        tgt_cols,
+        request["models"],
+        ref_col,
+        progress_callback,
+        chunk_callback,
+        extra_ref_cols,
+        # A job requeued after a restart resumes from the chunks it had finished
+        os.path.join(CHECKPOINT_DIR, job_id)
+    )
+
+    # Filter results to keep only selected columns and scores
+    # Order: Source, Reference (if exists), Targets, Scores
+    cols_to_keep = [src_col]
+
+    if ref_col:
+        cols_to_keep.append(ref_col)
+        cols_to_keep.extend(c for c in dict.fromkeys(extra_ref_cols) if c in df.columns and c not in cols_to_keep)
+
+    cols_to_keep.extend(tgt_cols)
+
+    # Add score columns (columns that are in results_df but not in original df)
+    original_cols = df.columns.tolist()
+    new_cols = [c for c in results_df.columns if c not in original_cols]
+    cols_to_keep.extend(new_cols)
+
+    # Create filtered dataframe; the results store summarizes its score columns
+    final_df = results_df[cols_to_keep]
+    final_df.attrs = {**results_df.attrs, "score_columns": new_cols}
+
+    # Save results: Parquet and CSV now, the workbook in the background
+    start = time.perf_counter()
+    export.write_results(final_df, UPLOAD_DIR, export.results_basename(job_id))
+
+    # Stages measured here; the evaluator and the job queue add theirs (see GET /jobs/{job_id})
+    timings = final_df.attrs.setdefault("timings", {})
+    timings["job_load"] = job_load
+    timings["export"] = time.perf_counter() - start
+    return final_df
+
+
+def finish_job(job_id: str, status: str, timings: Optional[Dict]):
+    instrumentation.record_job(status, timings)
+    # Done, failed or cancelled: the job is never resumed, so its checkpoint goes
+    checkpoint.remove(os.path.join(CHECKPOINT_DIR, job_id))
+
+
+def create_job_queue(evaluator, notify: Optional[Callable] = None, send_chunk: Optional[Callable] = None) -> JobQueue:
+    """The process's job queue; `notify(job, message)` as in JobQueue, `send_chunk` as in run_evaluation."""
+    job_queue = JobQueue(
+        JobStore(JOBS_DB_PATH, RESULTS_DIR),
+        partial(run_evaluation, evaluator, send_chunk=send_chunk),
+        {"gpu": GPU_JOB_WORKERS, "cpu": CPU_JOB_WORKERS},
+        notify=notify,
+        on_finish=finish_job,
+        # The next neural job's weights are read while the current one runs
+        prefetch=lambda request: evaluator.preload(request["models"]),
+    )
+    instrumentation.registry.gauge_callback(
+        "mteval_job_queue_depth", lambda: {(("lane", lane),): depth for lane, depth in job_queue.depth().items()})
+    if evaluator.score_cache is not None:
+        instrumentation.registry.gauge_callback("mteval_score_cache_entries", lambda: {(): evaluator.score_cache.stats()["entries"]})
+        instrumentation.registry.gauge_callback("mteval_score_cache_bytes", lambda: {(): evaluator.score_cache.stats()["bytes"]})
+    return job_queue
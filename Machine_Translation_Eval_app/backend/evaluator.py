@@ -1,243 +1,513 @@
 import os
+import threading
+import time
+from functools import partial
+import numpy as np
 import pandas as pd
-import torch
 from typing import List, Dict
-import sacrebleu
-from comet import download_model, load_from_checkpoint
-from bert_score import BERTScorer
-
-# Monkey-patch transformers for TransQuest compatibility
-import transformers.optimization
-import torch.optim
-if not hasattr(transformers.optimization, "AdamW"):
-    transformers.optimization.AdamW = torch.optim.AdamW
-if not hasattr(transformers.optimization, "Adafactor"):
-    class Adafactor(torch.optim.Optimizer):
-        def __init__(self, params, **kwargs):
-            super().__init__(params, {})
-        def step(self): pass
-    transformers.optimization.Adafactor = Adafactor
-
-# Patch ROBERTA_PRETRAINED_MODEL_ARCHIVE_LIST
-try:
-    import transformers.models.roberta.modeling_roberta
-    if not hasattr(transformers.models.roberta.modeling_roberta, "ROBERTA_PRETRAINED_MODEL_ARCHIVE_LIST"):
-        transformers.models.roberta.modeling_roberta.ROBERTA_PRETRAINED_MODEL_ARCHIVE_LIST = [
-            "roberta-base", "roberta-large", "roberta-large-mnli", "distilroberta-base",
-            "roberta-base-openai-detector", "roberta-large-openai-detector",
-        ]
-except ImportError: pass
-
-# Patch SequenceSummary
-try:
-    import transformers.models.xlm.modeling_xlm
-    if not hasattr(transformers.models.xlm.modeling_xlm, "SequenceSummary"):
-        class SequenceSummary(torch.nn.Module):
-            def __init__(self, config):
-                super().__init__()
-                self.summary = torch.nn.Identity()
-            def forward(self, x): return x
-        transformers.models.xlm.modeling_xlm.SequenceSummary = SequenceSummary
-except ImportError: pass
-
-# Patch XLM_ROBERTA_PRETRAINED_MODEL_ARCHIVE_LIST
-try:
-    import transformers.models.xlm_roberta.modeling_xlm_roberta
-    if not hasattr(transformers.models.xlm_roberta.modeling_xlm_roberta, "XLM_ROBERTA_PRETRAINED_MODEL_ARCHIVE_LIST"):
-        transformers.models.xlm_roberta.modeling_xlm_roberta.XLM_ROBERTA_PRETRAINED_MODEL_ARCHIVE_LIST = [
-            "xlm-roberta-base", "xlm-roberta-large",
-        ]
-except ImportError: pass
-
-from transquest.algo.sentence_level.monotransquest.run_model import MonoTransQuestModel
-from config import get_models
+# torch and the model libraries are imported by the metric classes when a model is first loaded
+from config import get_models, STRING_METRIC_WORKERS, STREAM_CHUNK_ROWS, CHECKPOINT_CHUNK_ROWS, SCORE_CACHE_PATH, SCORE_CACHE_MAX_BYTES, MODEL_MEMORY_BUDGET_MB, CALIBRATION_PATH, CPU_BACKEND, CPU_INTRA_OP_THREADS, QUANTIZED_MODEL_DIR, QUANTIZATION_CHECK_PATH, MICRO_BATCH_WAIT_MS, GPU_JOB_WORKERS
+import score_cache
+import checkpoint as checkpoints
+from model_manager import ModelResidencyManager, default_budget_bytes, estimated_nbytes, model_nbytes
+import metrics
+from job_inputs import JobRows
+from batching import bucketed_predict, estimate_tokens
+from micro_batching import MicroBatcher
+from calibration import Calibration, synthetic_segments
+import quantization
+import instrumentation
+from scheduler import Scheduler
+from utils import get_hardware_info
 
 class Evaluator:
     def __init__(self):
-        self.loaded_models = {}
+        self.loaded_models = ModelResidencyManager(MODEL_MEMORY_BUDGET_MB * 1024 * 1024 if MODEL_MEMORY_BUDGET_MB else default_budget_bytes())
         self.model_configs = get_models()
+        self.calibration = Calibration(CALIBRATION_PATH, get_hardware_info)
+        quantization.set_intra_op_threads(CPU_INTRA_OP_THREADS)
+        self.score_cache = score_cache.ScoreCache(SCORE_CACHE_PATH, SCORE_CACHE_MAX_BYTES) if SCORE_CACHE_MAX_BYTES > 0 else None
+        self._metrics = {}
+        # Batches of concurrent jobs share model calls (see micro_batching.py); 0 scores every job on its own
+        # A single GPU job worker never runs two neural jobs at once, so it skips the batcher
+        self.micro_batch_wait = MICRO_BATCH_WAIT_MS / 1000 if GPU_JOB_WORKERS > 1 else 0
+        self._batchers: Dict[str, MicroBatcher] = {}
+        self._batchers_lock = threading.Lock()
+
+    def metric(self, model_key: str) -> metrics.Metric:
+        # The Metric instance of a configured model (third-party classes are imported on first use)
+        metric = self._metrics.get(model_key)
+        if metric is None:
+            config = self.model_configs.get(model_key)
+            if not config:
+                raise ValueError(f"Unknown model: {model_key}")
+            metric = self._metrics[model_key] = metrics.create(model_key, config)
+        return metric
 
     def load_model(self, model_key: str, progress_callback=None):
-        if model_key in self.loaded_models:
-            return self.loaded_models[model_key]
+        model = self.loaded_models.get(model_key)
+        if model is not None:
+            return model
+
+        metric = self.metric(model_key)
+        config = metric.config
+
+        with self.loaded_models.loading(model_key):
+            # Another thread (e.g. a preload) may have finished loading it meanwhile
+            model = self.loaded_models.get(model_key)
+            if model is not None:
+                return model
+
+            msg = f"Loading model: {model_key} ({config['type']})"
+            print(msg)
+            if progress_callback:
+                progress_callback(msg)
+
+            # Make room before loading so old and new weights are never both resident
+            # (an int8 model is first loaded with its float weights)
+            int8 = quantization.use_int8(config, CPU_BACKEND)
+            size = self.loaded_models.known_size(model_key)
+            self.loaded_models.reserve(model_key, size if size is not None and not int8 else estimated_nbytes(config), progress_callback)
+
+            model = metric.load(progress_callback)
+            if int8:
+                model = self._quantize(model_key, model, progress_callback)
+
+            self.loaded_models.put(model_key, model, progress_callback)
+
+        if metric.batchable and not self.calibration.has(metric.type):
+            self._calibrate(model_key, model)
+        return model
+
+    def _quantize(self, model_key: str, model, progress_callback=None):
+        # Swap in int8 Linear layers, keeping the float model if the scores drift too far
+        config = self.model_configs[model_key]
+        metric = self.metric(model_key)
+        artifact = quantization.artifact_path(QUANTIZED_MODEL_DIR, config)
+        saved = quantization.load_artifact(artifact, config)
+        if saved is not None:
+            quantized = self._load_quantized(model_key, model, saved)
+            if quantized is not None:
+                msg = f"Loaded int8 {model_key} from {artifact}"
+                print(msg)
+                if progress_callback:
+                    progress_callback(msg)
+                return quantized
+            # The model was converted in place; start again from the float weights
+            model = metric.load(progress_callback)
+
+        segments = quantization.check_segments(QUANTIZATION_CHECK_PATH)
+        if segments is None:
+            print(f"{QUANTIZATION_CHECK_PATH} not found; checking int8 {model_key} on synthetic segments")
+            segments = tuple(synthetic_segments(quantization.CHECK_SEGMENTS, quantization.CHECK_TOKENS, seed) for seed in range(3))
+        reference = self._check_scores(model_key, model, *segments)
 
-        config = self.model_configs.get(model_key)
-        if not config:
-            raise ValueError(f"Unknown model: {model_key}")
+        # quantize_dynamic copies the module: make room for the copy next to the float weights
+        float_module = quantization.module_of(model, config['type'])
+        self.loaded_models.reserve(model_key, 2 * model_nbytes(float_module), progress_callback)
+        int8_module = quantization.quantize(float_module)
+        if config['type'] == 'transquest':
+            model.model = int8_module
+            quantized = model
+        else:
+            quantized = int8_module
+        diff = quantization.max_difference(reference, self._check_scores(model_key, quantized, *segments))
 
-        msg = f"Loading model: {model_key} ({config['type']})"
+        if diff > quantization.tolerance(config):
+            msg = f"int8 {model_key} changed scores by up to {diff:.4f}; keeping the float model"
+            if config['type'] == 'transquest':
+                model.model = float_module
+        else:
+            msg = f"Quantized {model_key} to int8 (max score difference {diff:.4f})"
+            model = quantized
+            quantization.save_artifact(artifact, int8_module, config, segments, reference)
         print(msg)
         if progress_callback:
             progress_callback(msg)
-        
-        if config['type'] == 'comet':
-            if progress_callback:
-                progress_callback(f"Downloading/Loading Comet model: {config['model_name']}...")
-            model_path = download_model(config['model_name'])
-            model = load_from_checkpoint(model_path)
-            model.eval()
-            if torch.cuda.is_available():
-                model = model.cuda()
-            self.loaded_models[model_key] = model
-            
-        elif config['type'] == 'transquest':
-            if progress_callback:
-                progress_callback(f"Downloading/Loading TransQuest model: {config['model_name']}...")
-            model = MonoTransQuestModel("xlmroberta", config['model_name'], use_cuda=torch.cuda.is_available())
-            self.loaded_models[model_key] = model
+        return model
 
-        elif config['type'] in ['sacrebleu', 'ter', 'chrf']:
-            # SacreBLEU metrics don't need heavy model loading
-            self.loaded_models[model_key] = config['type']
-            
-        elif config['type'] == 'bertscore':
+    def _load_quantized(self, model_key: str, model, saved: Dict):
+        # Converts the float model in place (no second copy of the weights) and loads the
+        # saved int8 weights; None if they do not fit or no longer give the checked scores
+        config = self.model_configs[model_key]
+        check = saved["check"]
+        try:
+            module = quantization.quantize(quantization.module_of(model, config['type']), inplace=True)
+            module.load_state_dict(saved["state_dict"])
+            diff = quantization.max_difference(check["scores"], self._check_scores(model_key, model, check["srcs"], check["mts"], check["refs"]))
+        except Exception as e:
+            print(f"Ignoring quantized model for {model_key}: {e}")
+            return None
+        if diff > quantization.tolerance(config):
+            print(f"Ignoring quantized model for {model_key}: scores differ from the float model by up to {diff:.4f}")
+            return None
+        return model
+
+    def _check_scores(self, model_key: str, model, srcs, mts, refs) -> List[float]:
+        lengths = self.metric(model_key).token_lengths(estimate_tokens(srcs), estimate_tokens(mts), estimate_tokens(refs))
+        return self._predict(model_key, srcs, mts, refs, list(range(len(mts))), lengths, model=model)
+
+    def _calibrate(self, model_key: str, model):
+        # Time the freshly loaded model once per metric type and hardware, for /estimate_time.
+        # In the background, so the job that loaded the model starts scoring right away
+        # (its batches and the benchmark's share the device, so the first measurement
+        # errs on the slow side)
+        config = self.model_configs[model_key]
+        print(f"Calibrating {config['type']} throughput with {model_key} in the background...")
+
+        metric = self.metric(model_key)
+
+        def run(srcs, mts, refs):
+            lengths = metric.token_lengths(estimate_tokens(srcs), estimate_tokens(mts), estimate_tokens(refs))
+            # The model object itself: the benchmark never loads it again if it is evicted meanwhile
+            self._predict(model_key, srcs, mts, refs, list(range(len(mts))), lengths, model=model)
+
+        self.calibration.start_type(metric.type, run)
+
+    def preload(self, model_keys: List[str]):
+        """Load the given models in a background thread, as far as the memory budget allows.
+
+        Called with the models of the next job so their weights are being read
+        while that job's file is parsed or the current model is still running.
+        A preload never evicts a model that is in use.
+        """
+        def run():
+            for model_key in model_keys:
+                try:
+                    metric = self.metric(model_key)
+                    if not metric.batchable or model_key in self.loaded_models:
+                        continue
+                    size = self.loaded_models.known_size(model_key)
+                    if not self.loaded_models.fits(size if size is not None else estimated_nbytes(metric.config)):
+                        continue
+                    self.load_model(model_key)
+                except Exception as e:
+                    print(f"Preloading {model_key} failed: {e}")
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def _score_with_cache(self, model_key: str, srcs, mts, refs, predict, stats: Dict = None) -> List[float]:
+        # Only rows whose (src, mt, ref) triple has not been scored by this model before reach `predict`.
+        # The hit and miss counts are added to stats["score_cache"]
+        config = self.model_configs[model_key]
+        model_id = f"{model_key}:{config['model_name']}"
+        cache = self.score_cache if self.metric(model_key).cacheable else None
+        keys, scores, missing = score_cache.lookup(cache, model_id, srcs, mts, refs)
+        if missing:
+            new_scores = predict(missing)
+            for i, score in zip(missing, new_scores):
+                scores[i] = float(score)
+            if cache is not None:
+                cache.put_many({keys[i]: scores[i] for i in missing})
+        if stats is not None:
+            counts = stats.setdefault("score_cache", {"hits": 0, "misses": 0})
+            counts["hits"] += len(scores) - len(missing)
+            counts["misses"] += len(missing)
+            counts["hit_rate"] = instrumentation.hit_rate(counts["hits"], counts["misses"])
+        return scores
+
+    def _batcher(self, model_key: str) -> MicroBatcher:
+        with self._batchers_lock:
+            batcher = self._batchers.get(model_key)
+            if batcher is None:
+                batcher = self._batchers[model_key] = MicroBatcher(model_key, self.metric(model_key), self.micro_batch_wait)
+            return batcher
+
+    def _predict(self, model_key: str, srcs, mts, refs, rows, lengths, progress_callback=None, model=None,
+                 shared: bool = False) -> List[float]:
+        # Scores `rows` of the parallel srcs/mts/refs lists (refs may be None for metrics
+        # that do not read the reference), one length bucket per Metric.score_batch call.
+        # `shared` sends the buckets through the model's micro-batcher, to be merged with
+        # those of other jobs running at the same time
+        metric = self.metric(model_key)
+        if model is None:
+            model = self.load_model(model_key, progress_callback)
+        batcher = self._batcher(model_key) if shared and self.micro_batch_wait > 0 else None
+
+        def predict_bucket(bucket_rows, batch_size):
+            if batcher is not None:
+                return batcher.score(model, srcs, mts, refs, bucket_rows, batch_size)
+            return metric.score_batch(model, srcs, mts, refs, bucket_rows, batch_size)
+
+        return bucketed_predict(rows, lengths, metric.config, predict_bucket)
+
+    def _score_neural(self, model_key: str, rows: JobRows, progress_callback=None, chunk_callback=None,
+                      stats: Dict = None, checkpoint: checkpoints.Checkpoint = None) -> Dict[str, np.ndarray]:
+        # The job is scored one chunk of rows at a time. Within a chunk, identical
+        # (src, mt, ref) triples across all target columns (e.g. MT systems that agree
+        # on a segment, or the same column selected twice) are scored only once; across
+        # chunks the score cache catches repeats. Every chunk is saved to the checkpoint
+        # and streamed as soon as it is scored.
+        # Model load and inference time, scored rows and cache hits are added to `stats`
+        if stats is None:
+            stats = {"model_load": 0.0, "inference": 0.0, "rows": 0}
+        metric = self.metric(model_key)
+        # Fields the metric ignores (e.g. the reference for TransQuest) are not part of the segment
+        use_src = metric.uses_src
+        use_ref = metric.uses_ref and rows.has_ref
+        scores = {tgt_col: np.full(rows.n_rows, np.nan) for tgt_col in rows.tgt_cols}
+
+        # Chunks finished before the job was interrupted
+        saved = set(checkpoint.chunk_indices(model_key)) if checkpoint is not None else set()
+        if saved:
+            msg = f"{model_key}: resuming {len(saved)} of {rows.n_chunks} chunks from checkpoint"
+            print(msg)
             if progress_callback:
-                progress_callback(f"Loading BERTScore model: {config['model_name']}...")
-            # Initialize BERTScorer
-            # We use use_fast_tokenizer=True by default for speed
-            scorer = BERTScorer(model_type=config['model_name'], device='cuda' if torch.cuda.is_available() else 'cpu')
-            self.loaded_models[model_key] = scorer
-            
-        return self.loaded_models[model_key]
+                progress_callback(msg)
 
-    def evaluate(self, df: pd.DataFrame, src_col: str, tgt_cols: List[str], models: List[str], ref_col: str = None, progress_callback=None) -> pd.DataFrame:
+        n_segments = n_unique = 0
+        for k in range(rows.n_chunks):
+            start, stop = rows.bounds(k)
+            if k in saved:
+                frame = checkpoint.chunk(model_key, k)
+                for tgt_col in rows.tgt_cols:
+                    scores[tgt_col][start:stop] = frame[tgt_col].to_numpy()
+            else:
+                inputs = rows.chunk(k)
+                segments = inputs.unique_segments(use_src, use_ref, metric.multi_reference)
+                n_segments += segments.n_segments
+                n_unique += len(segments)
+                # Estimated token length of each unique segment, for length-bucketed batching
+                src_lengths = inputs.token_lengths('src') if use_src else None
+                ref_lengths = inputs.token_lengths('ref') if use_ref else None
+                lengths = segments.gather({col: metric.token_lengths(src_lengths, inputs.token_lengths('mt', col), ref_lengths) for col in inputs.mt})
+
+                # The metric may keep per-chunk state for the references (e.g. BERTScore's reference embeddings)
+                with metric.references(inputs, segments.refs if use_ref else None) as refs:
+                    def predict(todo):
+                        begin = time.perf_counter()
+                        # Loaded on the first cache miss
+                        model = self.load_model(model_key, progress_callback)
+                        loaded = time.perf_counter()
+                        predicted = self._predict(model_key, segments.srcs, segments.mts, refs, todo, lengths, progress_callback, model, shared=True)
+                        stats["model_load"] += loaded - begin
+                        stats["inference"] += time.perf_counter() - loaded
+                        stats["rows"] += len(todo)
+                        return predicted
+
+                    unique_scores = self._score_with_cache(model_key, segments.srcs, segments.mts, segments.refs, predict, stats)
+                for tgt_col, column in segments.scatter(unique_scores).items():
+                    scores[tgt_col][start:stop] = column
+                if checkpoint is not None:
+                    checkpoint.save_chunk(model_key, k, {tgt_col: column[start:stop] for tgt_col, column in scores.items()})
+            self._stream(model_key, {tgt_col: column[start:stop] for tgt_col, column in scores.items()}, start, chunk_callback)
+            if progress_callback and rows.n_chunks > 1:
+                progress_callback(f"{model_key}: {k + 1} of {rows.n_chunks} chunks scored")
+
+        counts = stats.get("score_cache", {"hits": 0, "misses": 0})
+        msg = (f"{model_key}: {n_segments} segments across {len(rows.tgt_cols)} target columns, "
+               f"{n_unique} unique per chunk ({1 - n_unique / n_segments if n_segments else 0.0:.1%} deduplicated); "
+               f"score cache {counts['hits']} hits, {counts['misses']} misses")
+        print(msg)
+        if progress_callback:
+            progress_callback(msg)
+        return scores
+
+    def _score_stats(self, model_key: str, model, rows: JobRows, progress_callback, chunk_callback=None, stats: Dict = None,
+                     in_pool: bool = False, checkpoint: checkpoints.Checkpoint = None):
+        # A metric with sufficient statistics (BLEU, TER, chrF) computes them one chunk
+        # of rows at a time; each chunk is saved to the checkpoint and its sentence
+        # scores are streamed right away. Only the statistics are kept for the corpus
+        # score and bootstrap interval at the end. Returns (scores, corpus)
+        metric = self.metric(model_key)
+        chunks = checkpoint.stats(model_key) if checkpoint is not None else {}
+        if chunks:
+            msg = f"{model_key}: resuming {len(chunks)} of {rows.n_chunks} chunks from checkpoint"
+            print(msg)
+            progress_callback(msg)
+        todo = [k for k in range(rows.n_chunks) if k not in chunks]
+        workers = STRING_METRIC_WORKERS if metric.cpu_parallel else 1
+
+        def add(k, chunk):
+            chunks[k] = chunk
+            if chunk_callback:
+                chunk_scores = {tgt_col: np.asarray(r["scores"]) for tgt_col, r in metric.summarize(chunk, n_bootstrap=0).items()}
+                self._stream(model_key, chunk_scores, rows.bounds(k)[0], chunk_callback)
+
+        for k in sorted(chunks):
+            add(k, chunks[k])
+        begin = time.perf_counter()
+        for k, chunk in zip(todo, metric.chunk_stats(model, rows, todo, workers, progress_callback, in_pool)):
+            start, stop = rows.bounds(k)
+            if checkpoint is not None and stop > start:
+                checkpoint.save_stats(model_key, k, chunk)
+            add(k, chunk)
+            stats["rows"] += (stop - start) * len(rows.tgt_cols)
+            if rows.n_chunks > 1:
+                progress_callback(f"{model_key}: {k + 1} of {rows.n_chunks} chunks scored")
+        stats["inference"] = time.perf_counter() - begin
+
+        results = metric.summarize({tgt_col: np.concatenate([chunks[k][tgt_col] for k in range(rows.n_chunks)])
+                                    for tgt_col in rows.tgt_cols})
+        scores = {tgt_col: np.asarray(r["scores"], dtype=np.float64) for tgt_col, r in results.items()}
+        return scores, {tgt_col: {"corpus": r["corpus"], "ci": r["ci"]} for tgt_col, r in results.items()}
+
+    def _score_whole(self, model_key: str, model, rows: JobRows, progress_callback, chunk_callback=None, stats: Dict = None,
+                     in_pool: bool = False, checkpoint: checkpoints.Checkpoint = None):
+        # Metrics without sufficient statistics score the whole job in one pass. Returns (scores, corpus)
+        metric = self.metric(model_key)
+        results = checkpoint.result(model_key) if checkpoint is not None else None
+        if results is not None:
+            msg = f"{model_key}: resumed from checkpoint"
+            print(msg)
+            progress_callback(msg)
+        else:
+            workers = STRING_METRIC_WORKERS if metric.cpu_parallel else 1
+            begin = time.perf_counter()
+            results = metric.score_columns(model, rows.all(), workers, progress_callback, in_pool)
+            stats["inference"] = time.perf_counter() - begin
+            stats["rows"] = rows.n_rows * len(rows.tgt_cols)
+            if checkpoint is not None:
+                checkpoint.save_result(model_key, results)
+        scores = {tgt_col: np.asarray(r["scores"], dtype=np.float64) for tgt_col, r in results.items()}
+        self._stream(model_key, scores, 0, chunk_callback)
+        return scores, {tgt_col: {"corpus": r["corpus"], "ci": r["ci"]} for tgt_col, r in results.items()}
+
+    @staticmethod
+    def _stream(model_key: str, scores: Dict[str, np.ndarray], start: int, chunk_callback=None):
+        # Sends the scores of rows start, start + 1, ... of every target column in blocks of STREAM_CHUNK_ROWS
+        if not chunk_callback:
+            return
+        for tgt_col, column in scores.items():
+            for offset in range(0, len(column), STREAM_CHUNK_ROWS):
+                chunk_callback(model_key, tgt_col, start + offset, column[offset:offset + STREAM_CHUNK_ROWS].tolist())
+
+    def _run_metric(self, model_key: str, rows: JobRows, progress_callback, chunk_callback=None,
+                    in_pool: bool = False, preload: List[str] = (), checkpoint: checkpoints.Checkpoint = None) -> Dict:
+        # Scores of every target column with one model:
+        # {"scores": {tgt_col: array}, "corpus": {tgt_col: {...}}, "stats": {"model_load", "inference", "rows", ...}}
+        metric = self.metric(model_key)
+        # Start reading the next model's weights while this one runs
+        self.preload(list(preload))
+        stats = {"model_load": 0.0, "inference": 0.0, "rows": 0}
+        # Batchable (neural) models are only loaded once a segment misses the score cache
+        start = time.perf_counter()
+        model = None if metric.batchable else self.load_model(model_key, progress_callback)
+        stats["model_load"] = time.perf_counter() - start
+
+        msg = f"Evaluating {', '.join(rows.tgt_cols)} with {model_key}..."
+        print(msg)
+        progress_callback(msg)
+
+        corpus = {}
+        model_start = time.perf_counter()
+        # Pinned: a model in use is never evicted to make room for another one
+        with self.loaded_models.pinned(model_key):
+            if metric.batchable:
+                # Batchable models score all target columns in one pass per model
+                column_scores = self._score_neural(model_key, rows, progress_callback, chunk_callback, stats, checkpoint)
+            else:
+                score = self._score_stats if metric.sufficient_stats else self._score_whole
+                column_scores, corpus = score(model_key, model, rows, progress_callback, chunk_callback, stats, in_pool, checkpoint)
+
+        for tgt_col, result in corpus.items():
+            if result["corpus"] is not None:
+                msg = f"{metric.name} corpus score for {tgt_col}: {result['corpus']:.2f}"
+                if result["ci"]:
+                    msg += f" (95% CI {result['ci'][0]:.2f}-{result['ci'][1]:.2f})"
+                print(msg)
+                progress_callback(msg)
+
+        if stats["rows"] and stats["inference"] > 0:
+            stats["rows_per_second"] = stats["rows"] / stats["inference"]
+        msg = f"{model_key} finished in {time.perf_counter() - model_start:.2f}s"
+        if stats.get("rows_per_second"):
+            msg += f" ({stats['rows_per_second']:.1f} rows/s)"
+        print(msg)
+        progress_callback(msg)
+        return {"scores": column_scores, "corpus": corpus, "stats": stats}
+
+    def evaluate(self, df: pd.DataFrame, src_col: str, tgt_cols: List[str], models: List[str], ref_col: str = None, progress_callback=None,
+                 chunk_callback=None, extra_ref_cols: List[str] = None, checkpoint_dir: str = None) -> pd.DataFrame:
+        # chunk_callback(model_key, tgt_col, start_row, scores) streams the scores in
+        # blocks of STREAM_CHUNK_ROWS rows as soon as they are available.
+        # extra_ref_cols are further references for metrics that take several (BERTScore).
+        # Every model scores the job in chunks of CHECKPOINT_CHUNK_ROWS rows, so only the
+        # chunks being scored are held as strings. With checkpoint_dir, finished chunks are
+        # saved there and a job that was interrupted resumes from them (see checkpoint.py)
         if progress_callback:
             progress_callback("Starting evaluation...")
         else:
             print("Starting evaluation...")
             
-        results_df = df.copy()
+        # Score columns are added to a shallow copy: with copy-on-write the (possibly
+        # memory-mapped) upload columns are shared, not duplicated
+        results_df = df.copy(deep=False)
+        # Corpus-level score and bootstrap CI of every string metric column
+        corpus_scores = results_df.attrs.setdefault("corpus_scores", {})
         
-        # Prepare data for evaluation
+        # Prepare data for evaluation: the columns of each chunk are converted as a model reaches it
         # Comet expects: [{"src": "...", "mt": "...", "ref": "..."}] (ref is optional for QE but CometKiwi is QE)
         # TransQuest expects: [[src, mt], ...]
-        
+        rows = JobRows(df, src_col, tgt_cols, ref_col, extra_ref_cols, CHECKPOINT_CHUNK_ROWS)
+        timings = results_df.attrs.setdefault("timings", {})
+        model_timings = timings.setdefault("models", {})
+        # Per model: model_load / inference seconds, rows scored, rows_per_second, score_cache hits
+        metric_timings = timings.setdefault("metrics", {})
+
+        # Neural metrics run one after another on the "device" lane while the string
+        # metrics run on the "cpu" lane at the same time (see scheduler.py)
+        lanes = {}
+        for model_key in models:
+            metric = self.metric(model_key)
+            if metric.requires_ref and (not ref_col or ref_col not in df.columns):
+                raise ValueError(f"Reference column is required for {metric.name} but not provided or found.")
+            lanes.setdefault("device" if metric.batchable else "cpu", []).append(model_key)
+        # With a neural metric in this process, string metric statistics are computed in the
+        # pool, unless STRING_METRIC_WORKERS=1 asks for them to stay in-process
+        in_pool = len(lanes) > 1 and STRING_METRIC_WORKERS != 1
+
+        checkpoint = None
+        if checkpoint_dir:
+            columns = list(dict.fromkeys([src_col, *tgt_cols] + ([ref_col, *(extra_ref_cols or [])] if ref_col else [])))
+            columns = [c for c in columns if c in df.columns]
+            configs = {model_key: self.metric(model_key).config for model_key in models}
+            checkpoint = checkpoints.Checkpoint(checkpoint_dir, checkpoints.fingerprint(df, columns, configs), CHECKPOINT_CHUNK_ROWS)
+
+        scheduler = Scheduler()
+
+        def report(msg):
+            # Also the point where a metric stops after the other lane failed or the job was cancelled
+            scheduler.check()
+            if progress_callback:
+                progress_callback(msg)
+
+        for lane, lane_models in lanes.items():
+            for position, model_key in enumerate(lane_models):
+                run = partial(self._run_metric, model_key, rows, report, chunk_callback, in_pool,
+                              lane_models[position + 1:position + 2], checkpoint)
+                scheduler.add(model_key, lane, run)
+        results = scheduler.run()
+
+        # Join in the order the models were requested
         for model_key in models:
-            model = self.load_model(model_key, progress_callback)
-            config = self.model_configs[model_key]
-            
             for tgt_col in tgt_cols:
-                msg = f"Evaluating {tgt_col} with {model_key}..."
-                print(msg)
-                if progress_callback:
-                    progress_callback(msg)
-                    
-                scores = []
-                
-                if config['type'] == 'comet':
-                    data = []
-                    for _, row in df.iterrows():
-                        item = {"src": str(row[src_col]), "mt": str(row[tgt_col])}
-                        if ref_col and ref_col in df.columns:
-                            item["ref"] = str(row[ref_col])
-                        data.append(item)
-                    
-                    model_output = model.predict(data, batch_size=8, gpus=1 if torch.cuda.is_available() else 0)
-                    scores = model_output.scores
-                    
-                elif config['type'] == 'transquest':
-                    data = []
-                    for _, row in df.iterrows():
-                        data.append([str(row[src_col]), str(row[tgt_col])])
-                        
-                    # TransQuest predict returns (predictions, raw_outputs)
-                    predictions, _ = model.predict(data)
-                    scores = predictions
-
-                elif config['type'] == 'sacrebleu':
-                    if not ref_col or ref_col not in df.columns:
-                        raise ValueError(f"Reference column is required for SacreBLEU but not provided or found.")
-                    
-                    refs = df[ref_col].astype(str).tolist()
-                    sys = df[tgt_col].astype(str).tolist()
-                    
-                    # Check for Chinese characters to decide on tokenizer
-                    # Simple check: if any character in the first few sentences is Chinese
-                    import re
-                    def contains_chinese(text):
-                        return bool(re.search(r'[\u4e00-\u9fff]', text))
-                    
-                    # Check a sample of the reference text
-                    sample_text = "".join(refs[:5])
-                    use_zh = contains_chinese(sample_text)
-                    
-                    tokenizer = 'zh' if use_zh else '13a'
-                    msg = f"Using tokenizer: {tokenizer} (Chinese detected: {use_zh})"
-                    print(msg)
-                    if progress_callback:
-                        progress_callback(msg)
-                    
-                    scores = []
-                    for s, r in zip(sys, refs):
-                        # references expects a list of reference strings for that sentence
-                        score = sacrebleu.sentence_bleu(s, [r], tokenize=tokenizer).score
-                        scores.append(score)
-
-                elif config['type'] == 'ter':
-                    if not ref_col or ref_col not in df.columns:
-                        raise ValueError(f"Reference column is required for TER but not provided or found.")
-                    
-                    refs = df[ref_col].astype(str).tolist()
-                    sys = df[tgt_col].astype(str).tolist()
-                    
-                    # Check for Chinese characters
-                    import re
-                    def contains_chinese(text):
-                        return bool(re.search(r'[\u4e00-\u9fff]', text))
-                    
-                    sample_text = "".join(refs[:5])
-                    use_zh = contains_chinese(sample_text)
-                    
-                    if use_zh:
-                        print("Chinese detected: applying tokenization for TER...")
-                        try:
-                            from sacrebleu.tokenizers.tokenizer_zh import TokenizerZh
-                            tokenizer = TokenizerZh()
-                            # Tokenize both system output and references
-                            sys = [tokenizer(s) for s in sys]
-                            refs = [tokenizer(r) for r in refs]
-                        except ImportError:
-                            print("Warning: Could not import TokenizerZh, TER scores may be inaccurate for Chinese.")
-                    
-                    scores = []
-                    for s, r in zip(sys, refs):
-                        # TER score is an error rate (lower is better), but typically displayed as 0-100
-                        score = sacrebleu.sentence_ter(s, [r]).score
-                        scores.append(score)
-
-                elif config['type'] == 'chrf':
-                    if not ref_col or ref_col not in df.columns:
-                        raise ValueError(f"Reference column is required for chrF but not provided or found.")
-                    
-                    refs = df[ref_col].astype(str).tolist()
-                    sys = df[tgt_col].astype(str).tolist()
-                    
-                    scores = []
-                    for s, r in zip(sys, refs):
-                        score = sacrebleu.sentence_chrf(s, [r]).score
-                        scores.append(score)
-
-                elif config['type'] == 'bertscore':
-                    if not ref_col or ref_col not in df.columns:
-                        raise ValueError(f"Reference column is required for BERTScore but not provided or found.")
-                    
-                    refs = df[ref_col].astype(str).tolist()
-                    sys = df[tgt_col].astype(str).tolist()
-                    
-                    msg = "Calculating BERTScore..."
-                    print(msg)
-                    if progress_callback:
-                        progress_callback(msg)
-                    
-                    # BERTScore can process in batches
-                    P, R, F1 = model.score(sys, refs)
-                    
-                    # We typically use F1 score
-                    scores = F1.tolist()
-                
                 # Add scores to dataframe
-                col_name = f"{model_key}_{tgt_col}"
-                results_df[col_name] = scores
+                results_df[f"{model_key}_{tgt_col}"] = results[model_key]["scores"][tgt_col]
+            for tgt_col, corpus in results[model_key]["corpus"].items():
+                corpus_scores[f"{model_key}_{tgt_col}"] = corpus
+            model_timings[model_key] = scheduler.tasks[model_key].seconds
+            metric_timings[model_key] = results[model_key]["stats"]
+
+        # Summed over models (the lanes overlap, so this can exceed the wall time)
+        timings["model_load"] = sum(stats["model_load"] for stats in metric_timings.values())
+        timings["inference"] = sum(stats["inference"] for stats in metric_timings.values())
+        # Summed over the chunks of every model
+        timings["input_prep"] = rows.prep_seconds
+        msg = f"Input preparation: {rows.prep_seconds:.3f}s for {rows.n_rows} rows x {len(rows.tgt_cols)} target columns in {rows.n_chunks} chunks"
+        print(msg)
+        if progress_callback:
+            progress_callback(msg)
+        token_cache = rows.token_cache_stats()
+        if token_cache:
+            timings["token_cache"] = token_cache
+        timings["wall"] = scheduler.wall_seconds
+        timings["lanes"] = scheduler.busy_share()
+        msg = f"Evaluation finished in {scheduler.wall_seconds:.2f}s; " + ", ".join(
+            f"{lane} lane busy {u['busy_seconds']:.2f}s ({u['busy_share']:.0%} of the wall time)" for lane, u in timings["lanes"].items())
+        print(msg)
+        if progress_callback:
+            progress_callback(msg)
                 
         return results_df
 
@@ -0,0 +1,138 @@
+import os
+import tempfile
+import threading
+from typing import Callable, Dict, NamedTuple
+
+import pandas as pd
+
+# Writing evaluation results in several formats.
+#
+# Parquet and CSV are cheap to write, so they are written as soon as a job
+# finishes. The .xlsx workbook is the slow one: it is built in a background
+# thread with xlsxwriter in constant_memory mode (rows are flushed to disk as
+# they are written) and /download waits for it only when it is actually
+# requested. Files are named after the job id, so jobs on the same upload
+# never overwrite each other's results. Every file is written to a temporary
+# file of its own (two builds of the same workbook, e.g. by the model server
+# and by an API worker, never share one) and renamed when complete, so a
+# half-written file is never served.
+#
+# Formats are pluggable: register_exporter() adds one, and /download serves
+# any registered format by name or file extension.
+
+
+class Exporter(NamedTuple):
+    extension: str
+    media_type: str
+    write: Callable[[pd.DataFrame, str], None]
+    # Eager formats are written before the job finishes, lazy ones in the background
+    eager: bool
+
+
+EXPORTERS: Dict[str, Exporter] = {}
+
+_building: Dict[str, threading.Thread] = {}
+_lock = threading.RLock()
+
+
+def register_exporter(name: str, extension: str, media_type: str, write: Callable[[pd.DataFrame, str], None], eager: bool = True):
+    EXPORTERS[name] = Exporter(extension, media_type, write, eager)
+
+
+def _write_parquet(df: pd.DataFrame, path: str):
+    df.to_parquet(path, index=False)
+
+
+def _write_csv(df: pd.DataFrame, path: str):
+    # With a BOM so Excel detects UTF-8 (e.g. Chinese text) when opening the CSV
+    df.to_csv(path, index=False, encoding="utf-8-sig")
+
+
+def _write_xlsx(df: pd.DataFrame, path: str):
+    import xlsxwriter
+
+    workbook = xlsxwriter.Workbook(path, {"constant_memory": True})
+    try:
+        worksheet = workbook.add_worksheet()
+        worksheet.write_row(0, 0, [str(c) for c in df.columns])
+        # Blank cells instead of NaN, which Excel cannot store
+        rows = df.astype(object).where(df.notna(), None).to_numpy().tolist()
+        for i, row in enumerate(rows, start=1):
+            worksheet.write_row(i, 0, row)
+    finally:
+        workbook.close()
+
+
+register_exporter("parquet", ".parquet", "application/vnd.apache.parquet", _write_parquet)
+register_exporter("csv", ".csv", "text/csv", _write_csv)
+register_exporter("xlsx", ".xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", _write_xlsx, eager=False)
+
+
+def results_basename(job_id: str) -> str:
+    return f"results_{job_id}"
+
+
+def download_name(filename: str, extension: str) -> str:
+    # What the user gets: named after the upload rather than the job
+    return f"results_{os.path.splitext(filename)[0]}{extension}"
+
+
+def exporter_for(filename: str):
+    return next((e for e in EXPORTERS.values() if filename.lower().endswith(e.extension)), None)
+
+
+def _write_atomic(exporter: Exporter, df: pd.DataFrame, path: str):
+    directory, name = os.path.split(path)
+    fd, partial = tempfile.mkstemp(prefix=f".{name[:-len(exporter.extension)]}.", suffix=f".partial{exporter.extension}",
+                                   dir=directory or ".")
+    os.close(fd)
+    try:
+        exporter.write(df, partial)
+        os.replace(partial, path)
+    except BaseException:
+        os.remove(partial)
+        raise
+
+
+def _build_in_background(exporter: Exporter, df: pd.DataFrame, path: str):
+    def run():
+        try:
+            _write_atomic(exporter, df, path)
+        except Exception as e:
+            print(f"Export of {path} failed: {e}")
+        finally:
+            with _lock:
+                _building.pop(path, None)
+
+    thread = threading.Thread(target=run, daemon=True)
+    with _lock:
+        _building[path] = thread
+    thread.start()
+
+
+def write_results(df: pd.DataFrame, directory: str, basename: str):
+    """Write the eager formats now and start building the lazy ones."""
+    for exporter in EXPORTERS.values():
+        path = os.path.join(directory, basename + exporter.extension)
+        if exporter.eager:
+            _write_atomic(exporter, df, path)
+        else:
+            # A file from an earlier run of the job (before a restart) must not be served
+            if os.path.exists(path):
+                os.remove(path)
+            _build_in_background(exporter, df, path)
+
+
+def ensure(path: str):
+    """Make sure a results file exists: wait for its background build, or
+    build it from the Parquet results (e.g. after a restart)."""
+    with _lock:
+        thread = _building.get(path)
+        exporter = exporter_for(path)
+        if thread is None and exporter is not None and not os.path.exists(path):
+            source = path[:-len(exporter.extension)] + EXPORTERS["parquet"].extension
+            if os.path.exists(source):
+                _build_in_background(exporter, pd.read_parquet(source), path)
+                thread = _building[path]
+    if thread is not None:
+        thread.join()
@@ -0,0 +1,246 @@
+import os
+import tempfile
+from typing import List, Tuple
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from config import XLSX_BATCH_ROWS
+
+# Reading uploaded sheets.
+#
+# An upload is parsed once, in a single pass. .xlsx files are read with
+# openpyxl in read-only mode (rows are read from the zip one at a time, without
+# openpyxl's cell objects for the whole workbook) and written to Parquet
+# XLSX_BATCH_ROWS rows at a time, so the pass holds one batch of cell values,
+# not the sheet, and counts the rows as it goes. A column's type (text,
+# numbers or both) is only known once every row has been read: each batch is
+# written with the types seen so far, and if a later batch widens a column
+# (integers to floats, numbers to text) the batches written before it are cast
+# to the wider type at the end, one row group at a time. CSV is read with
+# pandas' C parser and Parquet directly. The parsed rows are cached as Parquet
+# next to the upload, so /evaluate loads them in a fraction of the time it
+# takes to parse the workbook again.
+
+SUPPORTED_EXTENSIONS = (".xlsx", ".csv", ".parquet")
+
+
+def is_supported(filename: str) -> bool:
+    return filename.lower().endswith(SUPPORTED_EXTENSIONS)
+
+
+def cache_path(path: str) -> str:
+    return path + ".cache.parquet"
+
+
+def _header(values) -> List[str]:
+    # Same column names pd.read_excel would give: blank headers become
+    # "Unnamed: i" and repeated names get a ".1", ".2", ... suffix
+    columns, seen = [], {}
+    for i, value in enumerate(values):
+        name = f"Unnamed: {i}" if value is None or (isinstance(value, str) and not value.strip()) else value
+        if isinstance(name, float) and name.is_integer():
+            name = int(name)
+        name = base = str(name)
+        while name in seen:
+            seen[base] += 1
+            name = f"{base}.{seen[base]}"
+        seen[name] = 0
+        columns.append(name)
+    return columns
+
+
+def _is_number(t: pa.DataType) -> bool:
+    return pa.types.is_integer(t) or pa.types.is_floating(t)
+
+
+def _wider(a: pa.DataType, b: pa.DataType) -> pa.DataType:
+    # The type that holds the values of both: a column of blanks takes the other's type,
+    # integers and floats become floats, anything else mixed becomes text
+    if a == b or pa.types.is_null(b):
+        return a
+    if pa.types.is_null(a):
+        return b
+    if _is_number(a) and _is_number(b):
+        return pa.float64()
+    return pa.string()
+
+
+def _column(values) -> pa.Array:
+    # One batch of a column: numbers, dates and text as they are, a mix of types as text
+    try:
+        return pa.array(values)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        return pa.array([None if v is None else str(v) for v in values], pa.string())
+
+
+def _xlsx_to_parquet(path: str, target: str) -> Tuple[List[str], int]:
+    import openpyxl
+
+    workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    directory = os.path.dirname(os.path.abspath(target))
+    parts, writer, schema, n_rows = [], None, None, 0
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = next(rows, None) or ()
+        # Read-only sheets report trailing empty cells and rows; drop them
+        while header and header[-1] is None:
+            header = header[:-1]
+        n_cols = len(header)
+        columns = _header(header)
+
+        def write(batch):
+            nonlocal writer, schema
+            arrays = [_column(values) for values in zip(*batch)]
+            types = [a.type if schema is None else _wider(schema.field(i).type, a.type) for i, a in enumerate(arrays)]
+            if schema is None or types != schema.types:
+                # A column got wider: later batches go to a new part, cast together at the end
+                if writer is not None:
+                    writer.close()
+                schema = pa.schema(list(zip(columns, types)))
+                fd, part = tempfile.mkstemp(suffix=".parquet", dir=directory)
+                os.close(fd)
+                parts.append(part)
+                writer = pq.ParquetWriter(part, schema)
+            writer.write_table(pa.Table.from_arrays([a.cast(t) for a, t in zip(arrays, schema.types)], schema=schema))
+
+        batch = []
+        for row in rows:
+            row = row[:n_cols]
+            if all(v is None for v in row):
+                continue
+            batch.append(row + (None,) * (n_cols - len(row)))
+            if len(batch) == XLSX_BATCH_ROWS:
+                write(batch)
+                n_rows += len(batch)
+                batch = []
+        if batch:
+            write(batch)
+            n_rows += len(batch)
+        if writer is not None:
+            writer.close()
+            writer = None
+
+        if not parts:
+            # Only a header: text columns without rows
+            pq.write_table(pa.Table.from_arrays([pa.array([], pa.string())] * n_cols, names=columns), target)
+        elif len(parts) == 1:
+            os.replace(parts.pop(), target)
+        else:
+            with pq.ParquetWriter(target + ".tmp", schema) as out:
+                for part in parts:
+                    source = pq.ParquetFile(part)
+                    for i in range(source.num_row_groups):
+                        out.write_table(source.read_row_group(i).cast(schema))
+            os.replace(target + ".tmp", target)
+    finally:
+        workbook.close()
+        if writer is not None:
+            writer.close()
+        for part in parts:
+            try:
+                os.remove(part)
+            except OSError:
+                pass
+    return columns, n_rows
+
+
+def _read_xlsx(path: str) -> pd.DataFrame:
+    with tempfile.TemporaryDirectory() as directory:
+        target = os.path.join(directory, "sheet.parquet")
+        _xlsx_to_parquet(path, target)
+        return pd.read_parquet(target)
+
+
+def _read(path: str) -> pd.DataFrame:
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".xlsx":
+        return _read_xlsx(path)
+    if ext == ".csv":
+        return pd.read_csv(path)
+    if ext == ".parquet":
+        return pd.read_parquet(path)
+    raise ValueError(f"Unsupported file type: {ext}")
+
+
+def _normalize(df: pd.DataFrame) -> pd.DataFrame:
+    # Column names are always strings (they round-trip through JSON requests)
+    df.columns = [str(c) for c in df.columns]
+    # Blank cells are NaN, as with pd.read_excel (Parquet and openpyxl give None)
+    return df.where(df.notna(), np.nan) if len(df) else df
+
+
+def columnar(df: pd.DataFrame) -> pd.DataFrame:
+    # Parquet and Arrow need one type per column: mixed text/number columns are stored as text
+    df = df.copy()
+    for col in df.columns[df.dtypes == object]:
+        values = df[col]
+        df[col] = values.where(values.isna(), values.astype(str))
+    return df
+
+
+def parse(path: str) -> pd.DataFrame:
+    """Parse an upload without using or writing the Parquet cache."""
+    return _normalize(_read(path))
+
+
+def to_parquet(path: str, target: str) -> Tuple[List[str], int]:
+    """Parse an upload into the Parquet file `target`; returns (column names, row count)."""
+    if path.lower().endswith(".xlsx"):
+        return _xlsx_to_parquet(path, target)
+    df = parse(path)
+    columnar(df).to_parquet(target, index=False)
+    return df.columns.tolist(), len(df)
+
+
+def scan(path: str) -> Tuple[List[str], int]:
+    """Parse an upload once and return (column names, row count); the rows are cached for load()."""
+    if path.lower().endswith(".parquet"):
+        # Already columnar: names and row count are in the file footer
+        metadata = pq.ParquetFile(path).metadata
+        return [str(c) for c in metadata.schema.to_arrow_schema().names], metadata.num_rows
+    try:
+        return to_parquet(path, cache_path(path))
+    except OSError as e:
+        print(f"Could not cache parsed upload {path}: {e}")
+    df = parse(path)
+    return df.columns.tolist(), len(df)
+
+
+def load(path: str) -> pd.DataFrame:
+    """The parsed upload, from the Parquet cache when it is newer than the file."""
+    if path.lower().endswith(".parquet"):
+        return _normalize(pd.read_parquet(path))
+    cached = cache_path(path)
+    if not (os.path.exists(cached) and os.path.getmtime(cached) >= os.path.getmtime(path)):
+        try:
+            to_parquet(path, cached)
+        except OSError as e:
+            print(f"Could not cache parsed upload {path}: {e}")
+            return parse(path)
+    try:
+        return _normalize(pd.read_parquet(cached))
+    except Exception as e:
+        print(f"Ignoring unreadable upload cache {cached}: {e}")
+    return parse(path)
+
+
+_average_tokens = {}
+
+
+def average_tokens(path: str, columns: List[str]) -> float:
+    """Mean estimated token length of the non-empty cells of `columns` (cached per file version)."""
+    key = (path, os.path.getmtime(path), tuple(columns))
+    if key not in _average_tokens:
+        _average_tokens[key] = mean_tokens(load(path), columns)
+    return _average_tokens[key]
+
+
+def mean_tokens(df: pd.DataFrame, columns: List[str]) -> float:
+    from batching import estimate_tokens
+
+    lengths = [estimate_tokens(df[col].dropna().astype(str).tolist()) for col in columns if col in df.columns]
+    lengths = [l for l in lengths if len(l)]
+    return float(np.concatenate(lengths).mean()) if lengths else 0.0
@@ -0,0 +1,154 @@
+import math
+import threading
+from typing import Callable, Dict, Optional, Tuple
+
+# Process-wide counters, gauges and timing histograms, served on /metrics in
+# the Prometheus text format.
+#
+# Every finished job reports its timing breakdown (see record_job) and the
+# HTTP middleware times every request. Values that are cheap to read when
+# /metrics is scraped (queue depth, score cache size) are registered as
+# callbacks instead of being updated on every change. Everything is in memory
+# and starts from zero when the server restarts, as Prometheus expects.
+
+# Seconds; from a cache lookup to a multi-hour COMET run
+DEFAULT_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300, 900, 3600, math.inf)
+
+# Stages of an evaluation job, in the order they run. "job_load" reads the upload
+# for the job; parsing a file on /upload is the separate "upload_parse" stage
+STAGES = ("queue_wait", "job_load", "input_prep", "model_load", "inference", "export", "store_results")
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _labels(key: Labels, extra: str = "") -> str:
+    parts = []
+    for name, value in key:
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        parts.append(f'{name}="{value}"')
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _number(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value))
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        # name -> (type, help text)
+        self._metrics: Dict[str, Tuple[str, str]] = {}
+        self._values: Dict[str, Dict[Labels, float]] = {}
+        # Histograms: name -> labels -> [bucket counts..., sum, count]
+        self._histograms: Dict[str, Dict[Labels, list]] = {}
+        self._callbacks: Dict[str, Callable[[], Dict[Labels, float]]] = {}
+
+    def describe(self, name: str, kind: str, help_text: str):
+        self._metrics[name] = (kind, help_text)
+
+    def inc(self, name: str, value: float = 1.0, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            values = self._values.setdefault(name, {})
+            values[key] = values.get(key, 0.0) + value
+
+    def set(self, name: str, value: float, **labels):
+        with self._lock:
+            self._values.setdefault(name, {})[tuple(sorted(labels.items()))] = value
+
+    def value(self, name: str, **labels) -> float:
+        with self._lock:
+            return self._values.get(name, {}).get(tuple(sorted(labels.items())), 0.0)
+
+    def observe(self, name: str, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            counts = series.setdefault(key, [0] * len(DEFAULT_BUCKETS) + [0.0, 0])
+            for i, bound in enumerate(DEFAULT_BUCKETS):
+                if value <= bound:
+                    counts[i] += 1
+            counts[-2] += value
+            counts[-1] += 1
+
+    def gauge_callback(self, name: str, callback: Callable[[], Dict[Labels, float]]):
+        """`callback()` returns {labels: value} and is called on every scrape."""
+        self._callbacks[name] = callback
+
+    def render(self, include: Optional[Tuple[str, ...]] = None, exclude: Tuple[str, ...] = ()) -> str:
+        lines = []
+        with self._lock:
+            values = {name: dict(series) for name, series in self._values.items()}
+            histograms = {name: {k: list(v) for k, v in series.items()} for name, series in self._histograms.items()}
+        for name, callback in self._callbacks.items():
+            try:
+                values[name] = callback()
+            except Exception as e:
+                print(f"Reading metric {name} failed: {e}")
+
+        for name, (kind, help_text) in self._metrics.items():
+            if name in exclude or (include is not None and name not in include):
+                continue
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            if kind == "histogram":
+                for key, counts in histograms.get(name, {}).items():
+                    for bound, count in zip(DEFAULT_BUCKETS, counts):
+                        le = 'le="' + _number(bound) + '"'
+                        lines.append(f"{name}_bucket{_labels(key, le)} {count}")
+                    lines.append(f"{name}_sum{_labels(key)} {_number(counts[-2])}")
+                    lines.append(f"{name}_count{_labels(key)} {counts[-1]}")
+            else:
+                for key, value in values.get(name, {}).items():
+                    lines.append(f"{name}{_labels(key)} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+
+# Measured by the process that answers HTTP: with several API workers, each
+# worker serves these and the model server everything else (see main.py)
+HTTP_METRICS = ("mteval_http_request_seconds",)
+
+registry = Registry()
+registry.describe("mteval_http_request_seconds", "histogram", "Time to answer an HTTP request, by route.")
+registry.describe("mteval_stage_seconds", "histogram", "Time an evaluation job spent in each stage, and time /upload spent parsing files (upload_parse).")
+registry.describe("mteval_jobs_total", "counter", "Finished evaluation jobs, by final status.")
+registry.describe("mteval_job_queue_depth", "gauge", "Evaluation jobs waiting to run, by lane.")
+registry.describe("mteval_model_rows_total", "counter", "Segments scored by each model (cache hits excluded).")
+registry.describe("mteval_model_inference_seconds_total", "counter", "Time each model spent scoring.")
+registry.describe("mteval_model_load_seconds_total", "counter", "Time spent loading each model.")
+registry.describe("mteval_model_rows_per_second", "gauge", "Scoring throughput of each model in its last job.")
+registry.describe("mteval_model_batches_total", "counter", "Model calls made by the micro-batcher of each model.")
+registry.describe("mteval_model_batch_requests_total", "counter", "Job batches merged into those calls (see micro_batching.py).")
+registry.describe("mteval_cache_lookups_total", "counter", "Score and tokenization cache lookups, by result.")
+registry.describe("mteval_score_cache_entries", "gauge", "Segment scores in the persistent score cache.")
+registry.describe("mteval_score_cache_bytes", "gauge", "Size of the persistent score cache.")
+
+
+def record_job(status: str, timings: Optional[Dict]):
+    """Add a finished job's timing report (results_df.attrs["timings"] plus the job queue's stages)."""
+    registry.inc("mteval_jobs_total", status=status)
+    timings = timings or {}
+    for stage in STAGES:
+        if stage in timings:
+            registry.observe("mteval_stage_seconds", timings[stage], stage=stage)
+    for model, stats in timings.get("metrics", {}).items():
+        registry.inc("mteval_model_rows_total", stats.get("rows", 0), model=model)
+        registry.inc("mteval_model_inference_seconds_total", stats.get("inference", 0.0), model=model)
+        registry.inc("mteval_model_load_seconds_total", stats.get("model_load", 0.0), model=model)
+        if stats.get("rows_per_second"):
+            registry.set("mteval_model_rows_per_second", stats["rows_per_second"], model=model)
+        for result in ("hits", "misses"):
+            if "score_cache" in stats:
+                registry.inc("mteval_cache_lookups_total", stats["score_cache"][result], cache="score", model=model, result=result)
+    token_cache = timings.get("token_cache")
+    if token_cache:
+        for result in ("hits", "misses"):
+            registry.inc("mteval_cache_lookups_total", token_cache[result], cache="token", model="", result=result)
+
+
+def hit_rate(hits: int, misses: int) -> Optional[float]:
+    return hits / (hits + misses) if hits + misses else None
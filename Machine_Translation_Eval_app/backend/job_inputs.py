@@ -0,0 +1,304 @@
+import re
+import threading
+import time
+from collections.abc import Sequence
+from itertools import repeat
+from typing import Dict, Iterator, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from batching import estimate_tokens
+
+# Column-wise input preparation shared by every model of an evaluation job.
+#
+# A job is scored in chunks of rows (JobRows): the source, reference and target
+# columns of one chunk are converted to lists of strings (JobInputs), and every
+# metric reads those lists. The model-specific inputs are views over them, so
+# e.g. two COMET models scoring the same target column share the same strings
+# instead of each rebuilding them row by row. Only the chunks being scored are
+# held as Python strings; the rest of the job stays in its (possibly
+# memory-mapped) frame.
+
+
+class CometInputs(Sequence):
+    """Read-only list-of-dicts view in the format COMET's predict() expects.
+
+    Items are built on access from the shared column lists; `rows` restricts
+    the view to a subset of rows (e.g. score cache misses).
+    """
+
+    def __init__(self, srcs: List[str], mts: List[str], refs: Optional[List[str]], rows: Optional[List[int]] = None):
+        self._srcs = srcs
+        self._mts = mts
+        self._refs = refs
+        self._rows = rows
+
+    def __len__(self):
+        return len(self._rows) if self._rows is not None else len(self._mts)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        i = self._rows[index] if self._rows is not None else index
+        item = {"src": self._srcs[i], "mt": self._mts[i]}
+        if self._refs is not None:
+            item["ref"] = self._refs[i]
+        return item
+
+
+class TransQuestInputs(Sequence):
+    """Read-only [[src, mt], ...] view for TransQuest's predict()."""
+
+    def __init__(self, srcs: List[str], mts: List[str], rows: Optional[List[int]] = None):
+        self._srcs = srcs
+        self._mts = mts
+        self._rows = rows
+
+    def __len__(self):
+        return len(self._rows) if self._rows is not None else len(self._mts)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        i = self._rows[index] if self._rows is not None else index
+        return [self._srcs[i], self._mts[i]]
+
+
+class UniqueSegments:
+    """The distinct (src, mt, ref) triples across all target columns of a job.
+
+    Fields a metric does not read are None, so e.g. for BERTScore two columns
+    with the same MT for a row collapse to one segment. `positions[tgt_col][i]`
+    is the index of row i's segment in `srcs`/`mts`/`refs`.
+    """
+
+    def __init__(self, srcs: Optional[List[str]], mt: Dict[str, List[str]], refs: Optional[List[str]], n_rows: int):
+        index: Dict[tuple, int] = {}
+        self.srcs: List[Optional[str]] = []
+        self.mts: List[Optional[str]] = []
+        self.refs: List[Optional[str]] = []
+        self.positions: Dict[str, np.ndarray] = {}
+        self._columns = list(mt)
+        first_col, first_row = [], []
+        for col_index, (tgt_col, mts) in enumerate(mt.items()):
+            positions = np.empty(n_rows, dtype=np.int64)
+            column_srcs = srcs if srcs is not None else repeat(None)
+            column_refs = refs if refs is not None else repeat(None)
+            for i, triple in enumerate(zip(column_srcs, mts, column_refs)):
+                j = index.setdefault(triple, len(self.mts))
+                if j == len(self.mts):
+                    self.srcs.append(triple[0])
+                    self.mts.append(triple[1])
+                    self.refs.append(triple[2])
+                    first_col.append(col_index)
+                    first_row.append(i)
+                positions[i] = j
+            self.positions[tgt_col] = positions
+        self.n_rows = n_rows
+        self.n_segments = n_rows * len(mt)
+        self._first_col = np.asarray(first_col, dtype=np.int64)
+        self._first_row = np.asarray(first_row, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.mts)
+
+    @property
+    def duplicate_ratio(self) -> float:
+        return 1 - len(self) / self.n_segments if self.n_segments else 0.0
+
+    def first_rows(self) -> np.ndarray:
+        """The first row (in any target column) that needs each segment."""
+        first = np.full(len(self), self.n_rows, dtype=np.int64)
+        rows = np.arange(self.n_rows)
+        for positions in self.positions.values():
+            np.minimum.at(first, positions, rows)
+        return first
+
+    def gather(self, per_column: Dict[str, np.ndarray]) -> np.ndarray:
+        """Pick the value of each unique segment from per-row, per-target-column arrays."""
+        if not len(self):
+            return np.zeros(0, dtype=np.int64)
+        stacked = np.stack([np.asarray(per_column[col]) for col in self._columns])
+        return stacked[self._first_col, self._first_row]
+
+    def scatter(self, scores: List[float]) -> Dict[str, List[float]]:
+        """Map per-segment scores back to a list of row scores per target column."""
+        scores = np.asarray(scores, dtype=np.float64)
+        return {col: scores[positions].tolist() for col, positions in self.positions.items()}
+
+
+class JobInputs:
+    def __init__(self, df: pd.DataFrame, src_col: str, tgt_cols: List[str], ref_col: Optional[str] = None,
+                 extra_ref_cols: Optional[List[str]] = None, job: Optional["JobRows"] = None):
+        start = time.perf_counter()
+        self.n_rows = len(df)
+        # Python strings of this job's own, read from the (possibly memory-mapped) frame:
+        # COMET, TransQuest, BERTScore and sacrebleu all take str
+        self.src = df[src_col].astype(str).tolist()
+        self.ref = df[ref_col].astype(str).tolist() if ref_col and ref_col in df.columns else None
+        # Further references per row, for metrics that take several (see metrics.Metric.multi_reference)
+        self.extra_refs: Dict[str, List[str]] = {}
+        if self.ref is not None:
+            self.extra_refs = {col: df[col].astype(str).tolist() for col in dict.fromkeys(extra_ref_cols or [])
+                               if col in df.columns and col != ref_col}
+        self.mt: Dict[str, List[str]] = {col: df[col].astype(str).tolist() for col in dict.fromkeys(tgt_cols)}
+        self.prep_seconds = time.perf_counter() - start
+        self._token_lengths: Dict[tuple, np.ndarray] = {}
+        self._chinese: Dict[tuple, bool] = {}
+        self._token_cache = None
+        # The job this is a chunk of: settings every chunk must agree on are decided there
+        self.job = job
+        self._shared: Dict = {}
+
+    def _texts(self, field: str, tgt_col: Optional[str]) -> Optional[List[str]]:
+        # ('mt', tgt_col) names a target column, so a target column called "src" or "ref" is not mistaken for those
+        if field == 'mt':
+            return self.mt[tgt_col]
+        return self.src if field == 'src' else self.ref
+
+    def token_lengths(self, field: str, tgt_col: Optional[str] = None) -> np.ndarray:
+        """Estimated token length of every row of 'src', 'ref' or ('mt', tgt_col) (computed once)."""
+        key = (field, tgt_col)
+        if key not in self._token_lengths:
+            self._token_lengths[key] = estimate_tokens(self._texts(field, tgt_col))
+        return self._token_lengths[key]
+
+    def contains_chinese(self, field: str, tgt_col: Optional[str] = None) -> bool:
+        """Whether the first rows of 'src', 'ref' or ('mt', tgt_col) contain Chinese characters (checked once)."""
+        if self.job is not None:
+            return self.job.contains_chinese(field, tgt_col)
+        key = (field, tgt_col)
+        if key not in self._chinese:
+            texts = self._texts(field, tgt_col)
+            # Simple check: if any character in the first few sentences is Chinese
+            self._chinese[key] = bool(re.search(r'[\u4e00-\u9fff]', "".join((texts or [])[:5])))
+        return self._chinese[key]
+
+    @property
+    def token_cache(self):
+        """Tokenized strings shared by the string metrics the job scores in this process (string_metrics.TokenCache)."""
+        if self.job is not None:
+            return self.job.token_cache
+        if self._token_cache is None:
+            # sacrebleu is only imported by jobs with a string metric
+            from string_metrics import TokenCache
+            self._token_cache = TokenCache()
+        return self._token_cache
+
+    def token_cache_stats(self) -> Optional[Dict]:
+        # Lookups in this process (pool workers keep their own caches); None if no string metric ran here
+        cache = self._token_cache
+        if cache is None or not cache.hits + cache.misses:
+            return None
+        return {"hits": cache.hits, "misses": cache.misses, "hit_rate": cache.hits / (cache.hits + cache.misses)}
+
+    def comet(self, tgt_col: str, rows: Optional[List[int]] = None) -> CometInputs:
+        return CometInputs(self.src, self.mt[tgt_col], self.ref, rows)
+
+    def transquest(self, tgt_col: str, rows: Optional[List[int]] = None) -> TransQuestInputs:
+        return TransQuestInputs(self.src, self.mt[tgt_col], rows)
+
+    def all_refs(self) -> List[str]:
+        """Every reference string of the job, row by row and reference column by column."""
+        if self.ref is None:
+            return []
+        return [ref for group in zip(self.ref, *self.extra_refs.values()) for ref in group]
+
+    def ref_chunks(self) -> Iterator[List[str]]:
+        """all_refs() of every chunk of the job, for statistics over the whole reference corpus (e.g. idf weights)."""
+        if self.job is not None:
+            yield from self.job.ref_chunks()
+        else:
+            yield self.all_refs()
+
+    @property
+    def shared(self) -> Dict:
+        """Per-job state a metric keeps across the chunks of a job (e.g. BERTScore's idf weights)."""
+        return self.job.shared if self.job is not None else self._shared
+
+    def unique_segments(self, use_src: bool, use_ref: bool, multi_ref: bool = False) -> UniqueSegments:
+        refs = self.ref if use_ref else None
+        if use_ref and multi_ref and self.extra_refs:
+            # A tuple of all references of the row
+            refs = list(zip(self.ref, *self.extra_refs.values()))
+        return UniqueSegments(self.src if use_src else None, self.mt, refs, self.n_rows)
+
+
+class JobRows:
+    """The rows of a job, converted to JobInputs one chunk of `chunk_rows` rows at a time.
+
+    Whether a column is Chinese is decided once from the job's first rows, so
+    every chunk is tokenized the same way, and the chunks share the job's
+    token cache.
+    """
+
+    def __init__(self, df: pd.DataFrame, src_col: str, tgt_cols: List[str], ref_col: Optional[str] = None,
+                 extra_ref_cols: Optional[List[str]] = None, chunk_rows: int = 1000):
+        self._df = df
+        self._src_col = src_col
+        self.tgt_cols = list(dict.fromkeys(tgt_cols))
+        self._ref_col = ref_col if ref_col and ref_col in df.columns else None
+        self._extra_ref_cols = extra_ref_cols
+        self.n_rows = len(df)
+        self.chunk_rows = chunk_rows
+        # An empty job still has one (empty) chunk
+        self.n_chunks = max(1, -(-self.n_rows // chunk_rows))
+        self.has_ref = self._ref_col is not None
+        self.shared: Dict = {}
+        # Summed over all chunks converted by either lane
+        self.prep_seconds = 0.0
+        self._lock = threading.Lock()
+        self._chinese: Dict[tuple, bool] = {}
+        self._token_cache = None
+
+    def bounds(self, k: int) -> tuple:
+        start = k * self.chunk_rows
+        return start, min(start + self.chunk_rows, self.n_rows)
+
+    def chunk(self, k: int) -> JobInputs:
+        start, stop = self.bounds(k)
+        inputs = JobInputs(self._df.iloc[start:stop], self._src_col, self.tgt_cols, self._ref_col, self._extra_ref_cols, job=self)
+        with self._lock:
+            self.prep_seconds += inputs.prep_seconds
+        return inputs
+
+    def all(self) -> JobInputs:
+        """Every row as one JobInputs, for metrics that can only score a whole job at once."""
+        inputs = JobInputs(self._df, self._src_col, self.tgt_cols, self._ref_col, self._extra_ref_cols, job=self)
+        with self._lock:
+            self.prep_seconds += inputs.prep_seconds
+        return inputs
+
+    def contains_chinese(self, field: str, tgt_col: Optional[str] = None) -> bool:
+        key = (field, tgt_col)
+        with self._lock:
+            if key not in self._chinese:
+                col = tgt_col if field == 'mt' else self._src_col if field == 'src' else self._ref_col
+                texts = self._df[col].head(5).astype(str).tolist() if col is not None else []
+                self._chinese[key] = bool(re.search(r'[\u4e00-\u9fff]', "".join(texts)))
+            return self._chinese[key]
+
+    def ref_chunks(self) -> Iterator[List[str]]:
+        if self._ref_col is None:
+            return
+        cols = [self._ref_col] + [col for col in dict.fromkeys(self._extra_ref_cols or [])
+                                  if col in self._df.columns and col != self._ref_col]
+        for k in range(self.n_chunks):
+            start, stop = self.bounds(k)
+            part = self._df.iloc[start:stop]
+            yield [ref for group in zip(*(part[col].astype(str).tolist() for col in cols)) for ref in group]
+
+    @property
+    def token_cache(self):
+        with self._lock:
+            if self._token_cache is None:
+                from string_metrics import TokenCache
+                self._token_cache = TokenCache()
+            return self._token_cache
+
+    def token_cache_stats(self) -> Optional[Dict]:
+        cache = self._token_cache
+        if cache is None or not cache.hits + cache.misses:
+            return None
+        return {"hits": cache.hits, "misses": cache.misses, "hit_rate": cache.hits / (cache.hits + cache.misses)}
@@ -0,0 +1,282 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import deque
+from typing import Callable, Dict, List, Optional, Tuple
+
+import pandas as pd
+
+from results_store import ResultsStore
+
+# Asynchronous evaluation jobs.
+#
+# POST /evaluate only records the job and returns its id; worker threads run
+# the evaluations. Job state is kept in SQLite and result rows in Parquet files
+# (results_store.py), so the status and results of finished jobs survive a
+# restart, and jobs that were queued or running when the server stopped are
+# queued again on startup.
+#
+# Jobs are scheduled in lanes: jobs that use a neural model (COMET, TransQuest,
+# BERTScore) go to the "gpu" lane and string-only jobs (BLEU, TER, chrF) to the
+# "cpu" lane. Each lane has its own workers, so a quick BLEU job never waits
+# behind a long COMET job, and the neural jobs do not compete for the GPU.
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED = (DONE, FAILED, CANCELLED)
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class JobStore:
+    def __init__(self, path: str, results_dir: Optional[str] = None):
+        self.path = path
+        self.results_store = ResultsStore(results_dir or os.path.join(os.path.dirname(path), "results"))
+        self._lock = threading.Lock()
+        self._conn = None
+        # One lock per job whose old results are being moved to the results store
+        self._migration_locks: Dict[str, threading.Lock] = {}
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.row_factory = sqlite3.Row
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                " id TEXT PRIMARY KEY, lane TEXT NOT NULL, request TEXT NOT NULL, status TEXT NOT NULL,"
+                " message TEXT, error TEXT, created REAL NOT NULL, started REAL, finished REAL,"
+                " total_rows INTEGER, columns TEXT, timings TEXT)"
+            )
+            # Job databases written before timing reports existed
+            columns = [row["name"] for row in self._conn.execute("PRAGMA table_info(jobs)")]
+            if "timings" not in columns:
+                self._conn.execute("ALTER TABLE jobs ADD COLUMN timings TEXT")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS job_results ("
+                " job_id TEXT NOT NULL, row INTEGER NOT NULL, data TEXT NOT NULL, PRIMARY KEY (job_id, row))"
+            )
+            self._conn.commit()
+        return self._conn
+
+    def create(self, job_id: str, lane: str, request: Dict):
+        with self._lock:
+            conn = self._connect()
+            conn.execute(
+                "INSERT INTO jobs (id, lane, request, status, created) VALUES (?, ?, ?, ?, ?)",
+                (job_id, lane, json.dumps(request), QUEUED, time.time()),
+            )
+            conn.commit()
+
+    def update(self, job_id: str, **fields):
+        columns = ", ".join(f"{k} = ?" for k in fields)
+        with self._lock:
+            conn = self._connect()
+            conn.execute(f"UPDATE jobs SET {columns} WHERE id = ?", (*fields.values(), job_id))
+            conn.commit()
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        with self._lock:
+            row = self._connect().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job["request"] = json.loads(job["request"])
+        job["columns"] = json.loads(job["columns"]) if job["columns"] else None
+        job["timings"] = json.loads(job["timings"]) if job["timings"] else None
+        return job
+
+    def unfinished(self) -> List[Dict]:
+        with self._lock:
+            rows = self._connect().execute(
+                "SELECT id FROM jobs WHERE status IN (?, ?) ORDER BY created", (QUEUED, RUNNING)
+            ).fetchall()
+        return [self.get(row["id"]) for row in rows]
+
+    def save_results(self, job_id: str, df: pd.DataFrame):
+        # Result rows go to the Parquet results store, with their aggregates (see results_store.py)
+        self.results_store.save(job_id, df, df.attrs.get("score_columns"))
+        self.update(job_id, total_rows=len(df), columns=json.dumps([str(c) for c in df.columns]))
+
+    def _migrate_results(self, job_id: str):
+        # Jobs finished before the results store kept their rows as JSON in job_results.
+        # Requests for the same job wait for the first one's migration instead of
+        # reading the rows it is deleting and saving an empty frame over its results
+        with self._lock:
+            migration_lock = self._migration_locks.setdefault(job_id, threading.Lock())
+        with migration_lock:
+            if self.results_store.exists(job_id):
+                return
+            with self._lock:
+                rows = self._connect().execute("SELECT data FROM job_results WHERE job_id = ? ORDER BY row", (job_id,)).fetchall()
+            df = pd.DataFrame([json.loads(row["data"]) for row in rows])
+            self.results_store.save(job_id, df)
+            with self._lock:
+                conn = self._connect()
+                conn.execute("DELETE FROM job_results WHERE job_id = ?", (job_id,))
+                conn.commit()
+                self._migration_locks.pop(job_id, None)
+
+    def _stored_results(self, job_id: str):
+        if not self.results_store.exists(job_id):
+            self._migrate_results(job_id)
+        return self.results_store
+
+    def results(self, job_id: str, offset: int = 0, limit: int = 500, sort: Optional[str] = None, descending: bool = False,
+                filters: Optional[Dict] = None) -> Tuple[int, List[Dict]]:
+        """(matching rows, one page of them); see ResultsStore.page."""
+        return self._stored_results(job_id).page(job_id, offset, limit, sort, descending, filters)
+
+    def summary(self, job_id: str) -> Dict:
+        return self._stored_results(job_id).summary(job_id)
+
+    def series(self, job_id: str, column: str, points: int = 1000) -> Dict:
+        return self._stored_results(job_id).series(job_id, column, points)
+
+    def frame(self, job_id: str) -> pd.DataFrame:
+        return self._stored_results(job_id).frame(job_id)
+
+
+class JobQueue:
+    def __init__(self, store: JobStore, run: Callable, lanes: Dict[str, int], notify: Optional[Callable] = None,
+                 on_finish: Optional[Callable] = None, prefetch: Optional[Callable] = None):
+        """`run(job_id, request, progress_callback)` evaluates a job and returns its results frame.
+
+        `lanes` maps lane name to its number of worker threads; `notify(job, message)`
+        is called with every progress message (e.g. to push it over the websocket).
+        `on_finish(job_id, status, timings)` is called when a job that ran has finished.
+        `prefetch(request)` is called when a job starts, with the request of the job
+        that is now next in its lane (e.g. to start loading that job's models).
+        """
+        self.store = store
+        self.run = run
+        self.lanes = lanes
+        self.notify = notify
+        self.on_finish = on_finish
+        self.prefetch = prefetch
+        self._queues: Dict[str, deque] = {lane: deque() for lane in lanes}
+        self._cancel: Dict[str, threading.Event] = {}
+        self._cond = threading.Condition()
+        self._started = False
+
+    def start(self):
+        if self._started:
+            return
+        self._started = True
+        # Jobs interrupted by a restart start over
+        for job in self.store.unfinished():
+            self.store.update(job["id"], status=QUEUED, message="Requeued after restart", started=None)
+            self._enqueue(job["id"], job["lane"])
+        for lane, workers in self.lanes.items():
+            for n in range(workers):
+                threading.Thread(target=self._worker, args=(lane,), name=f"job-{lane}-{n}", daemon=True).start()
+
+    def _enqueue(self, job_id: str, lane: str):
+        with self._cond:
+            self._cancel[job_id] = threading.Event()
+            self._queues[lane].append(job_id)
+            self._cond.notify_all()
+
+    def submit(self, request: Dict, lane: str) -> str:
+        job_id = uuid.uuid4().hex
+        self.store.create(job_id, lane, request)
+        self._enqueue(job_id, lane)
+        return job_id
+
+    def cancel(self, job_id: str) -> Optional[str]:
+        """Cancel a queued job, or ask a running one to stop at its next progress update."""
+        job = self.store.get(job_id)
+        if job is None or job["status"] in FINISHED:
+            return job["status"] if job else None
+        with self._cond:
+            event = self._cancel.get(job_id)
+            if event is not None:
+                event.set()
+            for queue in self._queues.values():
+                if job_id in queue:
+                    queue.remove(job_id)
+                    self._cancel.pop(job_id, None)
+                    self.store.update(job_id, status=CANCELLED, finished=time.time())
+                    return CANCELLED
+        return job["status"]
+
+    def position(self, job_id: str) -> Optional[int]:
+        with self._cond:
+            for queue in self._queues.values():
+                if job_id in queue:
+                    return list(queue).index(job_id)
+        return None
+
+    def depth(self) -> Dict[str, int]:
+        with self._cond:
+            return {lane: len(queue) for lane, queue in self._queues.items()}
+
+    def _worker(self, lane: str):
+        queue = self._queues[lane]
+        while True:
+            with self._cond:
+                while not queue:
+                    self._cond.wait()
+                job_id = queue.popleft()
+                cancel = self._cancel.get(job_id) or threading.Event()
+                next_id = queue[0] if queue else None
+            if next_id is not None and self.prefetch:
+                next_job = self.store.get(next_id)
+                try:
+                    self.prefetch(next_job["request"])
+                except Exception as e:
+                    print(f"prefetch for job {next_id} failed: {e}")
+            self._run_job(job_id, cancel)
+            with self._cond:
+                self._cancel.pop(job_id, None)
+
+    def _run_job(self, job_id: str, cancel: threading.Event):
+        job = self.store.get(job_id)
+        started = time.time()
+        self.store.update(job_id, status=RUNNING, started=started)
+        # The job's timing report: the stages measured by `run` (results_df.attrs["timings"]) plus the queue's own
+        timings = {"queue_wait": started - job["created"]}
+
+        def progress_callback(message: str):
+            # Progress updates double as cancellation points
+            if cancel.is_set():
+                raise JobCancelled()
+            self.store.update(job_id, message=message)
+            if self.notify:
+                self.notify(job, message)
+
+        try:
+            results_df = self.run(job_id, job["request"], progress_callback)
+            if cancel.is_set():
+                raise JobCancelled()
+            timings.update(results_df.attrs.get("timings", {}))
+            start = time.perf_counter()
+            self.store.save_results(job_id, results_df)
+            timings["store_results"] = time.perf_counter() - start
+            timings["total"] = time.time() - started
+            status = DONE
+            self.store.update(job_id, status=DONE, finished=time.time(), message="Evaluation finished", timings=json.dumps(timings))
+        except JobCancelled:
+            status = CANCELLED
+            self.store.update(job_id, status=CANCELLED, finished=time.time(), message="Evaluation cancelled")
+        except Exception as e:
+            import traceback
+            traceback.print_exc()
+            status = FAILED
+            self.store.update(job_id, status=FAILED, finished=time.time(), error=str(e))
+        if self.on_finish:
+            try:
+                self.on_finish(job_id, status, timings)
+            except Exception as e:
+                print(f"on_finish for job {job_id} failed: {e}")
@@ -1,16 +1,28 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException, BackgroundTasks, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, UploadFile, File, HTTPException, BackgroundTasks, WebSocket, WebSocketDisconnect, Request, Query
 from fastapi.middleware.cors import CORSMiddleware
 import uvicorn
 import os
-import shutil
 import pandas as pd
 from typing import List, Dict, Optional
 from config import get_models
 from utils import get_hardware_info, estimate_time
 from pydantic import BaseModel
-from evaluator import evaluator
+from config import JOBS_DB_PATH, RESULTS_DIR, API_WORKERS, MODEL_SERVER, CALIBRATION_PATH
+from calibration import Calibration
+import metrics
+from job_queue import JobStore, QUEUED, DONE
+from evaluation_job import UPLOAD_DIR, create_job_queue, upload_store
+from model_client import ModelServerClient, ModelServerError, RemoteJobQueue, ensure_server, stop_server
+import ingest
+import export
+import instrumentation
+import significance
+import threading
+import time
 import asyncio
-from huggingface_hub import login
+import json
+import math
+import msgpack
 
 app = FastAPI(title="MT Evaluation App")
 
@@ -23,39 +35,70 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-UPLOAD_DIR = "uploads"
+@app.middleware("http")
+async def time_requests(request: Request, call_next):
+    start = time.perf_counter()
+    response = await call_next(request)
+    # Labelled by route template (/jobs/{job_id}), not by the concrete path
+    route = getattr(request.scope.get("route"), "path", "unmatched")
+    instrumentation.registry.observe("mteval_http_request_seconds", time.perf_counter() - start, method=request.method, route=route)
+    return response
+
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
 # WebSocket Connection Manager
 class ConnectionManager:
     def __init__(self):
         self.active_connections: Dict[str, WebSocket] = {}
+        # Frame format for score chunks: "json" (text frames) or "msgpack" (binary frames)
+        self.formats: Dict[str, str] = {}
 
-    async def connect(self, websocket: WebSocket, client_id: str):
+    async def connect(self, websocket: WebSocket, client_id: str, format: str = "json"):
         await websocket.accept()
         self.active_connections[client_id] = websocket
+        self.formats[client_id] = format
 
     def disconnect(self, client_id: str):
         if client_id in self.active_connections:
             del self.active_connections[client_id]
+        self.formats.pop(client_id, None)
 
     async def send_message(self, message: str, client_id: str):
         if client_id in self.active_connections:
             await self.active_connections[client_id].send_text(message)
 
+    async def send_chunk(self, chunk: Dict, client_id: str):
+        websocket = self.active_connections.get(client_id)
+        if websocket is None:
+            return
+        if self.formats.get(client_id) == "msgpack":
+            await websocket.send_bytes(msgpack.packb(chunk, use_single_float=True))
+        else:
+            # Compact JSON; NaN is not valid JSON, so missing scores are sent as null
+            chunk = dict(chunk, scores=[round(v, 6) if v is not None and math.isfinite(v) else None for v in chunk["scores"]])
+            await websocket.send_text(json.dumps(chunk, separators=(",", ":"), ensure_ascii=False))
+
 manager = ConnectionManager()
 
 class TimeEstimateRequest(BaseModel):
     rows: int
     models: List[str]
+    # With the upload and its selected columns, the estimate uses the file's average segment length
+    filename: Optional[str] = None
+    upload_id: Optional[str] = None
+    columns: Optional[List[str]] = None
+    n_target_columns: int = 1
 
 class EvaluateRequest(BaseModel):
     filename: str
+    upload_id: Optional[str] = None # From /upload; without it the latest upload named `filename` is used
     src_col: str
     tgt_cols: List[str]
     models: List[str]
     ref_col: Optional[str] = None # Optional reference column
+    extra_ref_cols: List[str] = [] # Further references (used by BERTScore)
     client_id: Optional[str] = None # Optional for backward compatibility, but needed for progress
+    stream: bool = False # Push score chunks over the websocket as they are computed
 
 @app.get("/")
 def read_root():
@@ -67,6 +110,7 @@ class TokenVerificationRequest(BaseModel):
 @app.post("/verify_token")
 def verify_token(request: TokenVerificationRequest):
     try:
+        from huggingface_hub import login
         login(token=request.token)
         return {"status": "success", "message": "Token verified and login successful"}
     except Exception as e:
@@ -75,13 +119,40 @@ def verify_token(request: TokenVerificationRequest):
 
 
 @app.websocket("/ws/{client_id}")
-async def websocket_endpoint(websocket: WebSocket, client_id: str):
-    await manager.connect(websocket, client_id)
+async def websocket_endpoint(websocket: WebSocket, client_id: str, format: str = "json"):
+    # ?format=msgpack sends score chunks as binary msgpack frames instead of JSON text
+    await manager.connect(websocket, client_id, "msgpack" if format == "msgpack" else "json")
+    stop = threading.Event()
+    if model_server is not None:
+        # The client's job may run for any worker; relay its events from the model server
+        threading.Thread(target=relay_events, args=(client_id, stop), daemon=True).start()
     try:
         while True:
             await websocket.receive_text()
     except WebSocketDisconnect:
         manager.disconnect(client_id)
+    finally:
+        stop.set()
+
+def relay_events(client_id: str, stop: threading.Event):
+    try:
+        conn = model_server.subscribe(client_id)
+    except ModelServerError as e:
+        logging.error(f"Cannot relay job events to {client_id}: {e}")
+        return
+    try:
+        while not stop.is_set():
+            if not conn.poll(1):
+                continue
+            kind, payload = conn.recv()
+            if kind == "chunk":
+                send_chunk(client_id, payload)
+            else:
+                asyncio.run_coroutine_threadsafe(manager.send_message(payload, client_id), main_loop)
+    except (OSError, EOFError) as e:
+        logging.error(f"Model server stopped relaying job events to {client_id}: {e}")
+    finally:
+        conn.close()
 
 # Configure logging
 import logging
@@ -90,42 +161,32 @@ logging.basicConfig(filename='backend_debug.log', level=logging.INFO, format='%(
 @app.post("/upload")
 def upload_file(file: UploadFile = File(...)):
     logging.info(f"Received upload request for file: {file.filename}")
-    if not file.filename.endswith('.xlsx'):
+    if not ingest.is_supported(file.filename):
         logging.error("Invalid file type")
-        raise HTTPException(status_code=400, detail="Invalid file type. Please upload an .xlsx file.")
+        raise HTTPException(status_code=400, detail="Invalid file type. Please upload an .xlsx, .csv or .parquet file.")
     
-    file_path = os.path.join(UPLOAD_DIR, file.filename)
-    logging.info(f"Saving file to {file_path}")
+    # Stored by content: the SHA-256 is computed while the file is copied, and a
+    # file that was uploaded before is neither stored nor parsed again
     try:
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        logging.info("File saved successfully")
-    except Exception as e:
-        logging.error(f"Error saving file: {e}")
-        raise HTTPException(status_code=500, detail=f"Error saving file: {e}")
-    
-    # Validate and parse columns
-    try:
-        logging.info("Reading excel file for columns")
-        # Check encoding by reading headers. Excel files usually handle encoding well, 
-        # but we'll ensure we can read it.
-        df = pd.read_excel(file_path, nrows=0) 
-        columns = df.columns.tolist()
-        logging.info(f"Columns found: {columns}")
-        
-        # Basic check for empty columns or weird characters could go here
-        
-        logging.info("Reading excel file for total rows")
-        total_rows = pd.read_excel(file_path).shape[0]
-        logging.info(f"Total rows: {total_rows}")
-        
-        response = {"filename": file.filename, "columns": columns, "total_rows": total_rows}
-        logging.info(f"Sending response: {response}")
-        return response
+        start = time.perf_counter()
+        meta = upload_store.save(file.file, file.filename)
+        instrumentation.registry.observe("mteval_stage_seconds", time.perf_counter() - start, stage="upload_parse")
     except Exception as e:
         logging.error(f"Error processing file: {e}")
-        os.remove(file_path)
         raise HTTPException(status_code=400, detail=f"Error reading file: {str(e)}")
+    logging.info(f"Stored {file.filename} as {meta['upload_id']}: {meta['total_rows']} rows, columns {meta['columns']}")
+
+    response = {"filename": file.filename, "upload_id": meta["upload_id"], "columns": meta["columns"], "total_rows": meta["total_rows"]}
+    logging.info(f"Sending response: {response}")
+    return response
+
+def resolve_upload(filename: Optional[str], upload_id: Optional[str]) -> Optional[str]:
+    # The stored upload a request refers to; None for a file placed in uploads/ directly
+    if upload_id:
+        if not upload_store.exists(upload_id):
+            raise HTTPException(status_code=404, detail="Upload not found")
+        return upload_id
+    return upload_store.lookup(filename) if filename else None
 
 @app.get("/models")
 def list_models():
@@ -134,97 +195,223 @@ def list_models():
 @app.post("/estimate_time")
 def get_time_estimate(request: TimeEstimateRequest):
     hardware = get_hardware_info()
-    seconds = estimate_time(request.rows, len(request.models), hardware)
-    return {"estimated_seconds": seconds, "hardware": hardware}
+    configs = get_models()
+    selected = [metric(m) for m in request.models if m in configs]
+
+    avg_tokens = 32.0
+    if request.columns:
+        upload_id = resolve_upload(request.filename, request.upload_id)
+        if upload_id:
+            avg_tokens = upload_store.mean_tokens(upload_id, request.columns) or avg_tokens
+        elif request.filename and os.path.exists(os.path.join(UPLOAD_DIR, request.filename)):
+            avg_tokens = ingest.average_tokens(os.path.join(UPLOAD_DIR, request.filename), request.columns) or avg_tokens
+
+    seconds = estimate_time(request.rows, selected, hardware, calibration, avg_tokens,
+                            max(request.n_target_columns, 1))
+    calibrated = [t for t in dict.fromkeys(m.type for m in selected) if calibration.has(t)]
+    return {"estimated_seconds": seconds, "hardware": hardware, "avg_tokens": avg_tokens, "calibrated": calibrated}
+
+@app.get("/calibration")
+def get_calibration():
+    return calibration.results()
+
+# Event loop of the server, used to push progress messages from job worker threads
+main_loop = None
+
+def notify_progress(job: Dict, message: str):
+    client_id = job["request"].get("client_id")
+    if client_id and main_loop is not None:
+        asyncio.run_coroutine_threadsafe(manager.send_message(message, client_id), main_loop)
+
+def send_chunk(client_id: str, chunk: Dict):
+    if main_loop is not None:
+        asyncio.run_coroutine_threadsafe(manager.send_chunk(chunk, client_id), main_loop)
+
+if MODEL_SERVER:
+    # One of several API workers: jobs run in the model server (see model_server.py).
+    # A worker only reads the model configs, the metric metadata and the measured
+    # throughput; the Evaluator (score cache, model residency) lives in the server
+    model_server = ModelServerClient()
+    job_queue = RemoteJobQueue(model_server, JobStore(JOBS_DB_PATH, RESULTS_DIR))
+    calibration = Calibration(CALIBRATION_PATH, get_hardware_info)
+    _metrics = {}
+
+    def metric(model_key: str) -> metrics.Metric:
+        # Metric instances only describe the metric; no model is loaded here
+        if model_key not in _metrics:
+            _metrics[model_key] = metrics.create(model_key, get_models()[model_key])
+        return _metrics[model_key]
+else:
+    from evaluator import evaluator
+    model_server = None
+    job_queue = create_job_queue(evaluator, notify_progress, send_chunk)
+    calibration = evaluator.calibration
+    metric = evaluator.metric
+
+@app.on_event("startup")
+async def start_job_queue():
+    global main_loop
+    main_loop = asyncio.get_running_loop()
+    if model_server is None:
+        job_queue.start()
+        # Time the string metrics on this machine (first startup per hardware only)
+        calibration.start()
+
+def job_lane(models: List[str]) -> str:
+    # Jobs with a metric that prefers a GPU go to the GPU lane, the others to the CPU lane
+    return "gpu" if any(metric(m).gpu_preferred for m in models) else "cpu"
 
 @app.post("/evaluate")
-async def evaluate(request: EvaluateRequest):
-    file_path = os.path.join(UPLOAD_DIR, request.filename)
-    if not os.path.exists(file_path):
+def evaluate(request: EvaluateRequest):
+    # The job is tied to the upload's content, so a later upload with the same name does not change it
+    request.upload_id = resolve_upload(request.filename, request.upload_id)
+    if request.upload_id is None and not os.path.exists(os.path.join(UPLOAD_DIR, request.filename)):
         raise HTTPException(status_code=404, detail="File not found")
-    
-    # Define progress callback
-    def progress_callback(message: str):
-        if request.client_id:
-            asyncio.run(manager.send_message(message, request.client_id))
+    unknown = [m for m in request.models if m not in get_models()]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown model: {', '.join(unknown)}")
+
+    job_id = job_queue.submit(request.dict(), job_lane(request.models))
+    logging.info(f"Queued evaluation job {job_id} for {request.filename}")
+    return {"job_id": job_id, "status": QUEUED, "position": job_queue.position(job_id)}
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str):
+    job = job_queue.store.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    job["position"] = job_queue.position(job_id)
+    return job
 
+@app.post("/jobs/{job_id}/cancel")
+def cancel_job(job_id: str):
+    status = job_queue.cancel(job_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return {"job_id": job_id, "status": status}
+
+def finished_job(job_id: str) -> Dict:
+    job = job_queue.store.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job["status"] != DONE:
+        raise HTTPException(status_code=409, detail=f"Job is {job['status']}")
+    return job
+
+def parse_filters(filters: List[str]) -> Dict[str, tuple]:
+    # ?filter=<column>:<min>:<max>, either bound may be empty; column names may contain ":"
+    parsed = {}
+    for spec in filters:
+        parts = spec.rsplit(":", 2)
+        if len(parts) != 3:
+            raise HTTPException(status_code=400, detail=f"Invalid filter: {spec}")
+        column, low, high = parts
+        try:
+            parsed[column] = (float(low) if low else None, float(high) if high else None)
+        except ValueError:
+            raise HTTPException(status_code=400, detail=f"Invalid filter: {spec}")
+    return parsed
+
+@app.get("/jobs/{job_id}/results")
+def get_job_results(job_id: str, offset: int = 0, limit: int = 500, sort: Optional[str] = None, order: str = "asc",
+                    filter: List[str] = Query([])):
+    # One page of rows, optionally sorted by a column and filtered by score thresholds
+    job = finished_job(job_id)
+    limit = max(1, min(limit, 5000))
+    if order not in ("asc", "desc"):
+        raise HTTPException(status_code=400, detail=f"Invalid order: {order}")
     try:
-        df = pd.read_excel(file_path)
-        
-        # Run evaluation in a threadpool to avoid blocking the event loop
-        # We need to wrap the call to handle the async callback if possible, 
-        # but asyncio.run inside a thread is tricky. 
-        # Actually, since we are in async def evaluate, we can run synchronous code in threadpool.
-        # But the callback needs to be async to send websocket message?
-        # No, manager.send_message is async.
-        # So we need a sync wrapper for the callback that schedules the async task?
-        # Or just use run_in_executor.
-        
-        # Simplified approach:
-        # The evaluator is synchronous. The callback is synchronous.
-        # Inside the callback, we need to send a message to the websocket.
-        # Since we are in a separate thread (if using run_in_executor), we can't easily access the main event loop.
-        
-        # Alternative: Make evaluate async? No, evaluator uses heavy CPU/GPU, should be blocking or in thread.
-        # Let's use a queue or just run it directly if we don't mind blocking for a bit between updates?
-        # No, blocking the loop is bad.
-        
-        # Better: Use a sync callback that puts messages into a queue, and a background task that sends them?
-        # Or just use `asyncio.run_coroutine_threadsafe` if we have the loop.
-        
-        loop = asyncio.get_event_loop()
-        
-        def sync_progress_callback(message: str):
-            if request.client_id:
-                asyncio.run_coroutine_threadsafe(manager.send_message(message, request.client_id), loop)
-
-        # Run evaluator in threadpool
-        results_df = await asyncio.to_thread(
-            evaluator.evaluate, 
-            df, 
-            request.src_col, 
-            request.tgt_cols, 
-            request.models, 
-            request.ref_col,
-            sync_progress_callback
-        )
-        
-        # Filter results to keep only selected columns and scores
-        # Order: Source, Reference (if exists), Targets, Scores
-        cols_to_keep = [request.src_col]
-        
-        if request.ref_col:
-            cols_to_keep.append(request.ref_col)
-            
-        cols_to_keep.extend(request.tgt_cols)
-            
-        # Add score columns (columns that are in results_df but not in original df)
-        original_cols = df.columns.tolist()
-        new_cols = [c for c in results_df.columns if c not in original_cols]
-        cols_to_keep.extend(new_cols)
-        
-        # Create filtered dataframe
-        final_df = results_df[cols_to_keep]
-        
-        # Save results
-        output_filename = f"results_{request.filename}"
-        output_path = os.path.join(UPLOAD_DIR, output_filename)
-        final_df.to_excel(output_path, index=False)
-        
-        return results_df.to_dict(orient="records")
-    except Exception as e:
-        import traceback
-        traceback.print_exc()
-        raise HTTPException(status_code=500, detail=f"Evaluation failed: {str(e)}")
+        matching, rows = job_queue.store.results(job_id, max(offset, 0), limit, sort, order == "desc", parse_filters(filter))
+    except KeyError as e:
+        raise HTTPException(status_code=400, detail=f"Unknown column: {e.args[0]}")
+    return {"total_rows": job["total_rows"], "matching_rows": matching, "offset": offset, "limit": limit, "rows": rows}
 
-from fastapi.responses import FileResponse
+@app.get("/jobs/{job_id}/summary")
+def get_job_summary(job_id: str):
+    # Aggregates and histograms of every score column, computed when the job finished
+    finished_job(job_id)
+    return job_queue.store.summary(job_id)
+
+@app.get("/jobs/{job_id}/series")
+def get_job_series(job_id: str, column: str, points: int = 1000):
+    # Evenly spaced scores of one column, enough for a scatter plot of any job size
+    finished_job(job_id)
+    try:
+        return job_queue.store.series(job_id, column, max(1, min(points, 10000)))
+    except KeyError:
+        raise HTTPException(status_code=400, detail=f"Unknown column: {column}")
+
+@app.get("/jobs/{job_id}/significance")
+def get_job_significance(job_id: str, n_bootstrap: int = 1000, n_trials: int = 1000, alpha: float = 0.05):
+    # Paired bootstrap and approximate randomization tests between every pair of target columns, for every metric
+    job = finished_job(job_id)
+    systems, metrics = job["request"]["tgt_cols"], job["request"]["models"]
+    if len(systems) < 2:
+        raise HTTPException(status_code=400, detail="Significance tests need at least two target columns")
+    if not 0 < alpha < 1:
+        raise HTTPException(status_code=400, detail=f"Invalid alpha: {alpha}")
+    try:
+        return significance.compare_systems(job_queue.store.frame(job_id), systems, metrics,
+                                            max(0, min(n_bootstrap, 10000)), max(0, min(n_trials, 10000)), alpha=alpha)
+    except (KeyError, ValueError) as e:
+        # Score columns missing, or no segment scored for every system
+        raise HTTPException(status_code=409, detail=str(e.args[0]))
+
+from fastapi.responses import FileResponse, PlainTextResponse
+
+@app.get("/metrics")
+def get_metrics():
+    # Prometheus text exposition format
+    if model_server is None:
+        text = instrumentation.registry.render()
+    else:
+        # This worker's HTTP timings, the jobs and models from the model server
+        try:
+            text = instrumentation.registry.render(include=instrumentation.HTTP_METRICS) + model_server.call("metrics")
+        except ModelServerError as e:
+            raise HTTPException(status_code=503, detail=str(e))
+    return PlainTextResponse(text, media_type="text/plain; version=0.0.4")
 
 @app.get("/download/{filename}")
-def download_file(filename: str):
+async def download_file(filename: str, format: Optional[str] = None):
+    # ?format=csv|parquet|xlsx picks the format of a results file regardless of the extension asked for
+    if format is not None:
+        if format not in export.EXPORTERS:
+            raise HTTPException(status_code=400, detail=f"Unknown format: {format}")
+        filename = os.path.splitext(filename)[0] + export.EXPORTERS[format].extension
     file_path = os.path.join(UPLOAD_DIR, filename)
+    exporter = export.exporter_for(filename)
+    if exporter is not None:
+        # The workbook may still be being built
+        await asyncio.to_thread(export.ensure, file_path)
+    if not os.path.exists(file_path):
+        raise HTTPException(status_code=404, detail="File not found")
+    media_type = exporter.media_type if exporter else None
+    return FileResponse(file_path, media_type=media_type, filename=filename)
+
+@app.get("/jobs/{job_id}/download")
+async def download_results(job_id: str, format: str = "xlsx"):
+    # The job's results file, named after its upload for the browser
+    job = finished_job(job_id)
+    exporter = export.EXPORTERS.get(format)
+    if exporter is None:
+        raise HTTPException(status_code=400, detail=f"Unknown format: {format}")
+    file_path = os.path.join(UPLOAD_DIR, export.results_basename(job_id) + exporter.extension)
+    await asyncio.to_thread(export.ensure, file_path)
     if not os.path.exists(file_path):
         raise HTTPException(status_code=404, detail="File not found")
-    return FileResponse(file_path, media_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', filename=filename)
+    return FileResponse(file_path, media_type=exporter.media_type,
+                        filename=export.download_name(job["request"]["filename"], exporter.extension))
 
 if __name__ == "__main__":
-    uvicorn.run("main:app", host="127.0.0.1", port=8000, reload=True)
+    if API_WORKERS > 1:
+        # The workers inherit MODEL_SERVER and submit their jobs to one model server
+        os.environ["MODEL_SERVER"] = "1"
+        server_process = ensure_server(ModelServerClient())
+        try:
+            uvicorn.run("main:app", host="127.0.0.1", port=8000, workers=API_WORKERS)
+        finally:
+            # A model server started here goes down with the API; one that was already running is left alone
+            stop_server(server_process)
+    else:
+        uvicorn.run("main:app", host="127.0.0.1", port=8000, reload=True)
@@ -0,0 +1,105 @@
+import threading
+from typing import Dict
+
+# Loaders for the metric backends, imported only when a model is loaded.
+#
+# torch, COMET, TransQuest, BERTScore and transformers take several seconds to
+# import, so nothing here imports them at module level: a job that only uses
+# BLEU, TER or chrF never pays for them. The metric classes in metrics.py call
+# these loaders from their load().
+
+_patch_lock = threading.Lock()
+_patched = False
+
+
+def cuda_available() -> bool:
+    import torch
+    return torch.cuda.is_available()
+
+
+def patch_transformers_for_transquest():
+    """Compatibility shims TransQuest needs on current transformers versions (applied once)."""
+    global _patched
+    # A second loader waits until the shims are in place; a failed attempt is retried by the next
+    with _patch_lock:
+        if _patched:
+            return
+        _apply_transquest_patches()
+        _patched = True
+
+
+def _apply_transquest_patches():
+    import torch
+    import transformers.optimization
+    import torch.optim
+    if not hasattr(transformers.optimization, "AdamW"):
+        transformers.optimization.AdamW = torch.optim.AdamW
+    if not hasattr(transformers.optimization, "Adafactor"):
+        class Adafactor(torch.optim.Optimizer):
+            def __init__(self, params, **kwargs):
+                super().__init__(params, {})
+            def step(self): pass
+        transformers.optimization.Adafactor = Adafactor
+
+    # Patch ROBERTA_PRETRAINED_MODEL_ARCHIVE_LIST
+    try:
+        import transformers.models.roberta.modeling_roberta
+        if not hasattr(transformers.models.roberta.modeling_roberta, "ROBERTA_PRETRAINED_MODEL_ARCHIVE_LIST"):
+            transformers.models.roberta.modeling_roberta.ROBERTA_PRETRAINED_MODEL_ARCHIVE_LIST = [
+                "roberta-base", "roberta-large", "roberta-large-mnli", "distilroberta-base",
+                "roberta-base-openai-detector", "roberta-large-openai-detector",
+            ]
+    except ImportError: pass
+
+    # Patch SequenceSummary
+    try:
+        import transformers.models.xlm.modeling_xlm
+        if not hasattr(transformers.models.xlm.modeling_xlm, "SequenceSummary"):
+            class SequenceSummary(torch.nn.Module):
+                def __init__(self, config):
+                    super().__init__()
+                    self.summary = torch.nn.Identity()
+                def forward(self, x): return x
+            transformers.models.xlm.modeling_xlm.SequenceSummary = SequenceSummary
+    except ImportError: pass
+
+    # Patch XLM_ROBERTA_PRETRAINED_MODEL_ARCHIVE_LIST
+    try:
+        import transformers.models.xlm_roberta.modeling_xlm_roberta
+        if not hasattr(transformers.models.xlm_roberta.modeling_xlm_roberta, "XLM_ROBERTA_PRETRAINED_MODEL_ARCHIVE_LIST"):
+            transformers.models.xlm_roberta.modeling_xlm_roberta.XLM_ROBERTA_PRETRAINED_MODEL_ARCHIVE_LIST = [
+                "xlm-roberta-base", "xlm-roberta-large",
+            ]
+    except ImportError: pass
+
+
+def load_comet(config: Dict, progress_callback=None):
+    from comet import download_model, load_from_checkpoint
+
+    if progress_callback:
+        progress_callback(f"Downloading/Loading Comet model: {config['model_name']}...")
+    model_path = download_model(config['model_name'])
+    model = load_from_checkpoint(model_path)
+    model.eval()
+    if cuda_available():
+        model = model.cuda()
+    return model
+
+
+def load_transquest(config: Dict, progress_callback=None):
+    patch_transformers_for_transquest()
+    from transquest.algo.sentence_level.monotransquest.run_model import MonoTransQuestModel
+
+    if progress_callback:
+        progress_callback(f"Downloading/Loading TransQuest model: {config['model_name']}...")
+    return MonoTransQuestModel("xlmroberta", config['model_name'], use_cuda=cuda_available())
+
+
+def load_bertscore(config: Dict, progress_callback=None):
+    from bert_score import BERTScorer
+
+    if progress_callback:
+        progress_callback(f"Loading BERTScore model: {config['model_name']}...")
+    # Initialize BERTScorer
+    # We use use_fast_tokenizer=True by default for speed
+    return BERTScorer(model_type=config['model_name'], device='cuda' if cuda_available() else 'cpu')
@@ -0,0 +1,326 @@
+import importlib
+import threading
+from contextlib import contextmanager
+from typing import Dict, Hashable, Iterator, List, Optional, Type
+
+import numpy as np
+
+import metric_backends
+
+# Metric types.
+#
+# Every "type" in the model configuration maps to a Metric class that declares
+# what the metric needs and how it runs, so the evaluator does not branch on
+# type names:
+#   requires_ref  - the job must have a reference column
+#   uses_src / uses_ref - the fields the metric reads (also the score cache key)
+#   gpu_preferred - runs much faster on a GPU (jobs go to the GPU lane)
+#   batchable     - scored through score_batch() in length-bucketed batches,
+#                   with deduplication and the persistent score cache
+#   cpu_parallel  - scored by score_columns() sharded across worker processes
+#   sufficient_stats - scored chunk by chunk: chunk_stats() gives per-row
+#                   statistics, summarize() the scores from all of them
+#   multi_reference - reads all reference columns of the job, not only the first
+# cost() estimates the run time from the calibrated throughput. score_requests()
+# scores the batches of several concurrent jobs in one call (see micro_batching.py).
+#
+# Third-party metrics subclass Metric and are registered with
+# @register_metric, or named in models_config.json as
+# "metric_class": "module:Class" (imported on first use).
+
+
+class Metric:
+    type: str = ""
+    display_name: str = ""
+    requires_ref = False
+    uses_src = True
+    uses_ref = True
+    gpu_preferred = False
+    batchable = False
+    cpu_parallel = False
+    sufficient_stats = False
+    multi_reference = False
+
+    def __init__(self, key: str, config: Dict):
+        self.key = key
+        self.config = config
+
+    @property
+    def name(self) -> str:
+        return self.display_name or self.type
+
+    @property
+    def cacheable(self) -> bool:
+        # Whether a segment's score only depends on the segment (see score_cache.py)
+        return True
+
+    def load(self, progress_callback=None):
+        raise NotImplementedError
+
+    @contextmanager
+    def references(self, inputs, refs: List):
+        """The per-job form of the unique segments' references, passed to score_batch() as `refs`."""
+        yield refs
+
+    def score_batch(self, model, srcs: List[str], mts: List[str], refs: Optional[List[str]], rows: List[int], batch_size: int) -> List[float]:
+        """Scores of `rows` of the parallel srcs/mts/refs lists, as one batch."""
+        raise NotImplementedError
+
+    def batch_key(self, refs) -> Hashable:
+        """Requests whose `refs` give the same key can be scored in one score_requests() call."""
+        # Jobs with and without a reference column cannot share a batch
+        return refs is None
+
+    def score_requests(self, model, requests: List[tuple], batch_size: int) -> List[List[float]]:
+        """Scores of several score_batch() requests (srcs, mts, refs, rows) of concurrent jobs, in one call."""
+        srcs = [r_srcs[i] for r_srcs, _, _, rows in requests for i in rows]
+        mts = [r_mts[i] for _, r_mts, _, rows in requests for i in rows]
+        refs = None if requests[0][2] is None else [r_refs[i] for _, _, r_refs, rows in requests for i in rows]
+        scores = list(self.score_batch(model, srcs, mts, refs, list(range(len(mts))), batch_size))
+        bounds = np.cumsum([0] + [len(rows) for *_, rows in requests])
+        return [scores[a:b] for a, b in zip(bounds[:-1], bounds[1:])]
+
+    def score_columns(self, model, inputs, workers: int, progress_callback=None, in_pool: bool = False) -> Dict[str, Dict]:
+        """Score all target columns of `inputs` (a JobInputs); {tgt_col: {"scores", "corpus", "ci"}}.
+
+        `in_pool` asks for the work to be done outside this process, because
+        a neural metric is running in it at the same time.
+        """
+        raise NotImplementedError
+
+    def chunk_stats(self, model, rows, chunk_ids: List[int], workers: int, progress_callback=None,
+                    in_pool: bool = False) -> Iterator[Dict[str, np.ndarray]]:
+        """Per-row statistics {tgt_col: array} of the given chunks of `rows` (a job_inputs.JobRows), in order."""
+        raise NotImplementedError
+
+    def summarize(self, stats: Dict[str, np.ndarray], n_bootstrap: Optional[int] = None) -> Dict[str, Dict]:
+        """{tgt_col: {"scores", "corpus", "ci"}} from the chunk_stats() of all rows of a job."""
+        raise NotImplementedError
+
+    def token_lengths(self, src: Optional[np.ndarray], mt: np.ndarray, ref: Optional[np.ndarray]) -> np.ndarray:
+        # Estimated tokens the model reads per segment, for length-bucketed batching
+        lengths = mt
+        if self.uses_src and src is not None:
+            lengths = lengths + src
+        if self.uses_ref and ref is not None:
+            lengths = lengths + ref
+        return lengths
+
+    def cost(self, rows: int, n_columns: int, avg_tokens: float, calibration=None, hardware: Optional[Dict] = None) -> float:
+        """Estimated seconds to score `rows` x `n_columns` segments."""
+        per_segment = calibration.seconds_per_segment(self.type, avg_tokens) if calibration else None
+        if per_segment is not None:
+            return rows * n_columns * per_segment
+        # Heuristic:
+        # CPU: ~1 row per second per model (very rough)
+        # GPU: ~10-50 rows per second per model
+        if (hardware or {}).get("device") == "cpu":
+            rows_per_sec = 1.0
+        else:
+            rows_per_sec = 20.0 # Conservative GPU estimate
+        return rows * n_columns / rows_per_sec
+
+
+METRICS: Dict[str, Type[Metric]] = {}
+
+
+def register_metric(cls: Type[Metric]) -> Type[Metric]:
+    METRICS[cls.type] = cls
+    return cls
+
+
+def metric_class(config: Dict) -> Type[Metric]:
+    spec = config.get("metric_class")
+    if spec:
+        module_name, _, class_name = spec.partition(":")
+        return getattr(importlib.import_module(module_name), class_name)
+    cls = METRICS.get(config.get("type"))
+    if cls is None:
+        raise ValueError(f"Unknown metric type: {config.get('type')}")
+    return cls
+
+
+def create(key: str, config: Dict) -> Metric:
+    return metric_class(config)(key, config)
+
+
+@register_metric
+class CometMetric(Metric):
+    type = "comet"
+    display_name = "COMET"
+    # Reference-free (QE) COMET models simply get no "ref"
+    uses_ref = True
+    gpu_preferred = True
+    batchable = True
+
+    def load(self, progress_callback=None):
+        return metric_backends.load_comet(self.config, progress_callback)
+
+    def score_batch(self, model, srcs, mts, refs, rows, batch_size):
+        from job_inputs import CometInputs
+        model_output = model.predict(CometInputs(srcs, mts, refs, rows), batch_size=batch_size, gpus=1 if metric_backends.cuda_available() else 0)
+        return model_output.scores
+
+
+@register_metric
+class TransQuestMetric(Metric):
+    type = "transquest"
+    display_name = "TransQuest"
+    uses_ref = False
+    gpu_preferred = True
+    batchable = True
+
+    def __init__(self, key, config):
+        super().__init__(key, config)
+        # predict() takes its batch size from the shared model's args, so a call sets
+        # it and predicts under this lock (calibration and the int8 check do not go
+        # through the micro-batcher, which otherwise serializes a model's calls)
+        self._predict_lock = threading.Lock()
+
+    def load(self, progress_callback=None):
+        return metric_backends.load_transquest(self.config, progress_callback)
+
+    def score_batch(self, model, srcs, mts, refs, rows, batch_size):
+        from job_inputs import TransQuestInputs
+        with self._predict_lock:
+            model.args.eval_batch_size = batch_size
+            # TransQuest predict returns (predictions, raw_outputs)
+            predictions, _ = model.predict(list(TransQuestInputs(srcs, mts, rows)))
+        # A single input comes back as a 0-d array
+        return np.atleast_1d(predictions).tolist()
+
+
+@register_metric
+class BertScoreMetric(Metric):
+    type = "bertscore"
+    display_name = "BERTScore"
+    requires_ref = True
+    uses_src = False
+    gpu_preferred = True
+    batchable = True
+
+    def load(self, progress_callback=None):
+        return metric_backends.load_bertscore(self.config, progress_callback)
+
+    multi_reference = True
+
+    @property
+    def cacheable(self):
+        # With idf weighting a score depends on the whole reference corpus
+        return not self.config.get("idf", False)
+
+    @contextmanager
+    def references(self, inputs, refs):
+        from config import BERTSCORE_REF_CACHE_MB, BERTSCORE_REF_CACHE_DIR
+        from reference_embeddings import ReferenceEmbeddings
+        # Every reference string is embedded once per chunk and reused by all target columns;
+        # idf weights are computed once over all references of the job
+        embeddings = ReferenceEmbeddings(refs, inputs.ref_chunks(), BERTSCORE_REF_CACHE_MB * 1024 * 1024, BERTSCORE_REF_CACHE_DIR,
+                                         idf=self.config.get("idf", False), shared=inputs.shared.setdefault(("idf", self.key), {}))
+        try:
+            yield embeddings
+        finally:
+            embeddings.close()
+
+    def batch_key(self, refs):
+        if hasattr(refs, "score"):
+            # The candidates of several jobs are embedded together, each matched against its
+            # own job's reference embeddings; idf weights belong to one job's corpus
+            return "embeddings", id(refs) if refs.idf else None
+        return "strings"
+
+    def score_requests(self, model, requests, batch_size):
+        if hasattr(requests[0][2], "score"):
+            from reference_embeddings import score_many
+            return score_many(model, [(refs, mts, rows) for _, mts, refs, rows in requests], batch_size)
+        return super().score_requests(model, requests, batch_size)
+
+    def score_batch(self, model, srcs, mts, refs, rows, batch_size):
+        if hasattr(refs, "score"):
+            return refs.score(model, mts, rows, batch_size)
+        # Plain lists (e.g. calibration): BERTScore can process in batches
+        P, R, F1 = model.score([mts[i] for i in rows], [refs[i] for i in rows], batch_size=batch_size)
+        # We typically use F1 score
+        return F1.tolist()
+
+    def token_lengths(self, src, mt, ref):
+        # Candidates and references are embedded in the same batches
+        return np.maximum(mt, ref)
+
+
+class StringMetric(Metric):
+    requires_ref = True
+    uses_src = False
+    cpu_parallel = True
+    sufficient_stats = True
+
+    def load(self, progress_callback=None):
+        # SacreBLEU metrics don't need heavy model loading
+        return self.type
+
+    def announce(self, use_zh: bool, progress_callback=None):
+        # How the text is tokenized, reported once per job
+        pass
+
+    def chunk_stats(self, model, rows, chunk_ids, workers, progress_callback=None, in_pool=False):
+        from string_metrics import chunk_stats
+        # Chunks are converted as the scorer reaches them; every chunk uses the
+        # tokenizer chosen from the job's first rows and the job's token cache
+        use_zh = rows.contains_chinese('ref')
+        self.announce(use_zh, progress_callback)
+        chunks = ((inputs.ref, inputs.mt) for inputs in map(rows.chunk, chunk_ids))
+        return chunk_stats(self.type, chunks, rows.n_rows, use_zh=use_zh, workers=workers, in_pool=in_pool,
+                           token_cache=rows.token_cache)
+
+    def summarize(self, stats, n_bootstrap=None):
+        from string_metrics import DEFAULT_BOOTSTRAP, summarize
+        return summarize(self.type, stats, DEFAULT_BOOTSTRAP if n_bootstrap is None else n_bootstrap)
+
+    def score_columns(self, model, inputs, workers, progress_callback=None, in_pool=False):
+        from string_metrics import score_columns
+        self.announce(inputs.contains_chinese('ref'), progress_callback)
+        # All target columns are scored in one pass per model: the reference
+        # column is tokenized once and large sheets are sharded across the
+        # string metric process pool. The job's token cache lets BLEU and TER
+        # share Chinese tokenization when they are scored in this process
+        return score_columns(self.type, inputs.ref, inputs.mt, use_zh=inputs.contains_chinese('ref'), workers=workers,
+                             in_pool=in_pool, token_cache=inputs.token_cache)
+
+    def cost(self, rows, n_columns, avg_tokens, calibration=None, hardware=None):
+        per_segment = calibration.seconds_per_segment(self.type, avg_tokens) if calibration else None
+        if per_segment is None:
+            return super().cost(rows, n_columns, avg_tokens, calibration, hardware)
+        from string_metrics import MIN_ROWS_PER_SHARD, resolve_workers
+        from config import STRING_METRIC_WORKERS
+        shards = min(resolve_workers(STRING_METRIC_WORKERS), max(1, rows // MIN_ROWS_PER_SHARD))
+        return rows * n_columns * per_segment / shards
+
+
+@register_metric
+class BleuMetric(StringMetric):
+    type = "sacrebleu"
+    display_name = "SacreBLEU"
+
+    def announce(self, use_zh, progress_callback=None):
+        # Chinese characters in the references decide the tokenizer
+        tokenizer = 'zh' if use_zh else '13a'
+        msg = f"Using tokenizer: {tokenizer} (Chinese detected: {use_zh})"
+        print(msg)
+        if progress_callback:
+            progress_callback(msg)
+
+
+@register_metric
+class TerMetric(StringMetric):
+    type = "ter"
+    display_name = "TER"
+
+    def announce(self, use_zh, progress_callback=None):
+        if use_zh:
+            print("Chinese detected: applying tokenization for TER...")
+
+
+@register_metric
+class ChrfMetric(StringMetric):
+    type = "chrf"
+    display_name = "chrF"
@@ -0,0 +1,117 @@
+import threading
+import time
+from concurrent.futures import Future
+from typing import List, Optional, Tuple
+
+import instrumentation
+
+# Micro-batching of neural metric calls across concurrent jobs.
+#
+# With several jobs on the GPU lane (GPU_JOB_WORKERS > 1) small jobs would
+# each call predict() with the few segments of one length bucket, paying the
+# model's fixed per-call cost (COMET builds a trainer and a data loader per
+# call) for a batch that is mostly empty. Instead every loaded COMET,
+# TransQuest and BERTScore model gets a MicroBatcher: jobs submit their length
+# buckets (see batching.py) and wait, while one thread per model takes the
+# oldest request and every pending request it can share a call with (same
+# model object, same batch size, same form of references; Metric.batch_key),
+# up to one full batch: a request that only partly fits is split, its first
+# rows going into this call and the rest waiting for the next. The oldest
+# request is always taken whole, even when it alone exceeds the batch (its
+# rows are already one length bucket). It waits at most `max_wait` seconds after the oldest
+# request arrived for the batch to fill, scores the lot with one
+# Metric.score_requests() call and hands each job its own scores. Requests
+# that arrive while the model is busy are merged on the next round without
+# any wait. The thread also keeps jobs from running the same model object at
+# the same time. The evaluator only uses it with GPU_JOB_WORKERS > 1: a single
+# job worker has no other job to share calls with.
+
+
+class _Request:
+    def __init__(self, model, srcs, mts, refs, rows, batch_size: int, key):
+        self.model = model
+        self.args = (srcs, mts, refs, rows)
+        self.rows = len(rows)
+        self.batch_size = batch_size
+        self.key = key
+        self.arrived = time.monotonic()
+        self.future = Future()
+        # Futures of the leading rows split off into earlier calls, in row order
+        self.heads: List[Future] = []
+
+    def split(self, n: int) -> "_Request":
+        # The first n rows as a request of their own; this one keeps the rest
+        srcs, mts, refs, rows = self.args
+        head = _Request(self.model, srcs, mts, refs, rows[:n], self.batch_size, self.key)
+        head.arrived = self.arrived
+        self.args = (srcs, mts, refs, rows[n:])
+        self.rows -= n
+        self.heads.append(head.future)
+        return head
+
+
+class MicroBatcher:
+    def __init__(self, model_key: str, metric, max_wait: float):
+        self.model_key = model_key
+        self.metric = metric
+        self.max_wait = max_wait
+        self._pending: List[_Request] = []
+        self._cond = threading.Condition()
+        threading.Thread(target=self._run, name=f"micro-batcher-{model_key}", daemon=True).start()
+
+    def score(self, model, srcs, mts, refs, rows: List[int], batch_size: int) -> List[float]:
+        """Metric.score_batch() of one job's rows, scored together with other jobs' pending rows."""
+        request = _Request(model, srcs, mts, refs, rows, batch_size, (id(model), batch_size, self.metric.batch_key(refs)))
+        with self._cond:
+            self._pending.append(request)
+            self._cond.notify_all()
+        scores = request.future.result()
+        return [score for head in request.heads for score in head.result()] + list(scores)
+
+    def _group(self) -> Tuple[List[_Request], Optional[Tuple[_Request, int]]]:
+        # The oldest request and the pending ones that fit whole in its batch, in arrival
+        # order, plus (request, rows) for the first one that only fits in part
+        first = self._pending[0]
+        group, rows = [first], first.rows
+        for request in self._pending[1:]:
+            if rows >= first.batch_size:
+                break
+            if request.key != first.key:
+                continue
+            if rows + request.rows > first.batch_size:
+                return group, (request, first.batch_size - rows)
+            group.append(request)
+            rows += request.rows
+        return group, None
+
+    def _take(self) -> List[_Request]:
+        with self._cond:
+            self._cond.wait_for(lambda: self._pending)
+            deadline = self._pending[0].arrived + self.max_wait
+            while True:
+                group, partial = self._group()
+                remaining = deadline - time.monotonic()
+                if partial is not None or sum(request.rows for request in group) >= group[0].batch_size or remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            taken = set(map(id, group))
+            self._pending = [request for request in self._pending if id(request) not in taken]
+            if partial is not None:
+                request, rows = partial
+                group.append(request.split(rows))
+        return group
+
+    def _run(self):
+        while True:
+            group = self._take()
+            try:
+                results = self.metric.score_requests(group[0].model, [request.args for request in group], group[0].batch_size)
+            except BaseException as e:
+                # Every job of the batch sees the failure
+                for request in group:
+                    request.future.set_exception(e)
+                continue
+            for request, scores in zip(group, results):
+                request.future.set_result(scores)
+            instrumentation.registry.inc("mteval_model_batches_total", model=self.model_key)
+            instrumentation.registry.inc("mteval_model_batch_requests_total", len(group), model=self.model_key)
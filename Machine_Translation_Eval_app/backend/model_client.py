@@ -0,0 +1,193 @@
+import glob
+import hashlib
+import json
+import os
+import secrets
+import subprocess
+import sys
+import threading
+import time
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client
+from typing import Dict, Optional
+
+import config
+from config import MODEL_SERVER_ADDRESS, MODEL_SERVER_KEY_PATH
+
+# Talking to the model server (see model_server.py) from the API workers.
+#
+# Requests are (op, args) tuples over a multiprocessing connection: a unix
+# socket (a named pipe on Windows, or TCP for "host:port"), authenticated with
+# a key shared through a file only the user can read. Every thread has its own
+# connection, so the workers' thread pools never wait on each other.
+
+# Seconds to wait for a model server started by ensure_server(), or for one to stop
+START_TIMEOUT = 30
+STOP_TIMEOUT = 30
+
+
+class ModelServerError(RuntimeError):
+    pass
+
+
+def address(value: str = MODEL_SERVER_ADDRESS):
+    host, sep, port = value.rpartition(":")
+    if sep and port.isdigit() and not value.startswith("\\\\"):
+        return (host or "127.0.0.1", int(port))
+    return value
+
+
+def authkey(create: bool = False) -> bytes:
+    key = os.getenv("MODEL_SERVER_AUTHKEY")
+    if key:
+        return key.encode("utf-8")
+    if create and not os.path.exists(MODEL_SERVER_KEY_PATH):
+        os.makedirs(os.path.dirname(MODEL_SERVER_KEY_PATH) or ".", exist_ok=True)
+        fd = os.open(MODEL_SERVER_KEY_PATH, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, "w") as f:
+            f.write(secrets.token_hex(32))
+    with open(MODEL_SERVER_KEY_PATH, encoding="utf-8") as f:
+        return f.read().strip().encode("utf-8")
+
+
+def server_version() -> str:
+    """Digest of the backend code and configuration a model server started from here would run.
+
+    A running server whose version differs (the code was edited, a model entry
+    or an environment variable changed) is replaced by ensure_server().
+    """
+    digest = hashlib.sha256()
+    backend_dir = os.path.dirname(os.path.abspath(__file__))
+    for path in sorted(glob.glob(os.path.join(backend_dir, "*.py"))):
+        digest.update(os.path.basename(path).encode("utf-8"))
+        with open(path, "rb") as f:
+            digest.update(f.read())
+    # How the API reaches the server is not part of what the server runs
+    settings = {name: value for name, value in vars(config).items()
+                if name.isupper() and not name.startswith("MODEL_SERVER") and name != "API_WORKERS"}
+    digest.update(json.dumps([settings, config.get_models()], sort_keys=True, default=str).encode("utf-8"))
+    return digest.hexdigest()
+
+
+class ModelServerClient:
+    def __init__(self, server_address=None):
+        self.address = address() if server_address is None else server_address
+        self._local = threading.local()
+
+    def connect(self):
+        try:
+            return Client(self.address, authkey=authkey())
+        except (OSError, EOFError, AuthenticationError) as e:
+            raise ModelServerError(f"Model server not reachable at {self.address}: {e}")
+
+    def call(self, op: str, *args):
+        # A request that could not be sent is retried once on a new connection;
+        # one that was sent is not, since the server may already have run it
+        for attempt in (0, 1):
+            conn = getattr(self._local, "conn", None)
+            try:
+                if conn is None:
+                    conn = self._local.conn = self.connect()
+                conn.send((op, args))
+                break
+            except (OSError, EOFError, ModelServerError):
+                self._local.conn = None
+                if attempt:
+                    raise
+        try:
+            status, value = conn.recv()
+        except (OSError, EOFError) as e:
+            self._local.conn = None
+            raise ModelServerError(f"Model server closed the connection: {e}")
+        if status == "error":
+            raise ModelServerError(value)
+        return value
+
+    def subscribe(self, client_id: str):
+        """A connection that receives the client's events: ("message", text) and ("chunk", chunk) tuples."""
+        conn = self.connect()
+        conn.send(("subscribe", (client_id,)))
+        return conn
+
+    def ping(self) -> bool:
+        try:
+            return self.call("ping") == "pong"
+        except (OSError, ModelServerError):
+            return False
+
+
+class RemoteJobQueue:
+    # The parts of JobQueue the API uses, run by the model server. Jobs and
+    # results are read from the shared job store directly.
+    def __init__(self, client: ModelServerClient, store):
+        self.client = client
+        self.store = store
+
+    def start(self):
+        pass
+
+    def submit(self, request: Dict, lane: str) -> str:
+        return self.client.call("submit", request, lane)
+
+    def cancel(self, job_id: str) -> Optional[str]:
+        return self.client.call("cancel", job_id)
+
+    def position(self, job_id: str) -> Optional[int]:
+        return self.client.call("position", job_id)
+
+    def depth(self) -> Dict[str, int]:
+        return self.client.call("depth")
+
+
+def ensure_server(client: ModelServerClient) -> Optional[subprocess.Popen]:
+    """Start the model server in the background unless one of this code and configuration
+    is running (a stale one is shut down first); returns the started process."""
+    if client.ping():
+        try:
+            running = client.call("version")
+        except ModelServerError:
+            # A server from before versions were reported
+            running = None
+        if running == server_version():
+            return None
+        print(f"The model server on {client.address} runs other code or configuration; restarting it")
+        shutdown_server(client)
+    authkey(create=True)
+    print(f"Starting model server on {client.address}")
+    process = subprocess.Popen([sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "model_server.py")])
+    deadline = time.monotonic() + START_TIMEOUT
+    while not client.ping():
+        if process.poll() is not None:
+            raise ModelServerError(f"Model server exited with code {process.returncode}")
+        if time.monotonic() > deadline:
+            process.terminate()
+            raise ModelServerError(f"Model server did not start within {START_TIMEOUT}s")
+        time.sleep(0.2)
+    return process
+
+
+def shutdown_server(client: ModelServerClient):
+    """Ask the model server to exit and wait until it has; its unfinished jobs are requeued on the next start."""
+    try:
+        client.call("shutdown")
+    except ModelServerError as e:
+        if client.ping():
+            raise ModelServerError(f"Could not stop the model server on {client.address} ({e}); stop it by hand")
+    deadline = time.monotonic() + STOP_TIMEOUT
+    while client.ping():
+        if time.monotonic() > deadline:
+            raise ModelServerError(f"Model server on {client.address} did not stop within {STOP_TIMEOUT}s")
+        time.sleep(0.2)
+
+
+def stop_server(process: Optional[subprocess.Popen]):
+    """Stop a model server started by ensure_server(), when the process that started it exits."""
+    if process is None or process.poll() is not None:
+        return
+    print("Stopping model server")
+    process.terminate()
+    try:
+        process.wait(STOP_TIMEOUT)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
@@ -0,0 +1,146 @@
+import gc
+import sys
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+# Keeps the loaded metric models within a RAM budget.
+#
+# Models are kept in least-recently-used order. Before a model is loaded, and
+# again once its real size is known, unpinned models are evicted from the LRU
+# end until everything fits the budget. A model is pinned (reference counted)
+# while a job uses it, so it is never evicted mid-evaluation; if the pinned
+# models alone exceed the budget the load still goes ahead rather than failing
+# the job.
+
+# Rough resident size per metric type, used until a model has been loaded once
+# (can be overridden per model with "memory_mb" in models_config.json)
+DEFAULT_MODEL_MB = {
+    "comet": 2300,
+    "transquest": 2300,
+    "bertscore": 700,
+}
+
+
+def model_nbytes(model) -> int:
+    # COMET models are torch modules; TransQuest and BERTScorer wrap one
+    for obj in (model, getattr(model, "model", None), getattr(model, "_model", None)):
+        parameters = getattr(obj, "parameters", None)
+        if callable(parameters):
+            try:
+                return sum(p.numel() * p.element_size() for p in parameters())
+            except Exception:
+                continue
+    return 0
+
+
+def estimated_nbytes(config: Dict) -> int:
+    mb = config.get("memory_mb", DEFAULT_MODEL_MB.get(config.get("type"), 0))
+    return int(mb) * 1024 * 1024
+
+
+def default_budget_bytes() -> int:
+    # Half of the physical memory, or no limit where that cannot be determined
+    try:
+        import os
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") // 2
+    except (AttributeError, ValueError, OSError):
+        return 0
+
+
+class ModelResidencyManager:
+    def __init__(self, budget_bytes: int = 0):
+        # 0 means unlimited
+        self.budget_bytes = budget_bytes
+        self._models: "OrderedDict[str, object]" = OrderedDict()
+        self._sizes: Dict[str, int] = {}
+        self._pins: Dict[str, int] = {}
+        self._lock = threading.RLock()
+        self._load_locks: Dict[str, threading.Lock] = {}
+
+    def __contains__(self, model_key: str) -> bool:
+        with self._lock:
+            return model_key in self._models
+
+    def get(self, model_key: str):
+        with self._lock:
+            model = self._models.get(model_key)
+            if model is not None:
+                self._models.move_to_end(model_key)
+            return model
+
+    def known_size(self, model_key: str) -> Optional[int]:
+        return self._sizes.get(model_key)
+
+    def resident_bytes(self) -> int:
+        with self._lock:
+            return sum(self._sizes.get(k, 0) for k in self._models)
+
+    def pinned_bytes(self) -> int:
+        with self._lock:
+            return sum(self._sizes.get(k, 0) for k in self._models if self._pins.get(k))
+
+    def fits(self, nbytes: int) -> bool:
+        # Whether a model of `nbytes` could be made resident without touching pinned models
+        return not self.budget_bytes or self.pinned_bytes() + nbytes <= self.budget_bytes
+
+    @contextmanager
+    def pinned(self, model_key: str):
+        with self._lock:
+            self._pins[model_key] = self._pins.get(model_key, 0) + 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._pins[model_key] -= 1
+                if not self._pins[model_key]:
+                    del self._pins[model_key]
+
+    @contextmanager
+    def loading(self, model_key: str):
+        # Serializes loads of the same model (e.g. a preload racing a job)
+        with self._lock:
+            lock = self._load_locks.setdefault(model_key, threading.Lock())
+        with lock:
+            yield
+
+    def reserve(self, model_key: str, nbytes: int, progress_callback=None):
+        """Evict unpinned models until `nbytes` more fit into the budget."""
+        if not self.budget_bytes:
+            return
+        with self._lock:
+            while self._models and self.resident_bytes() + nbytes > self.budget_bytes:
+                victim = next((k for k in self._models if k != model_key and not self._pins.get(k)), None)
+                if victim is None:
+                    break
+                self._evict(victim, progress_callback)
+
+    def put(self, model_key: str, model, progress_callback=None):
+        nbytes = model_nbytes(model)
+        with self._lock:
+            self._models[model_key] = model
+            self._models.move_to_end(model_key)
+            self._sizes[model_key] = nbytes
+        self.reserve(model_key, 0, progress_callback)
+
+    def _evict(self, model_key: str, progress_callback=None):
+        msg = f"Unloading model: {model_key} ({self._sizes.get(model_key, 0) / 2 ** 20:.0f} MB) to stay within the memory budget"
+        print(msg)
+        if progress_callback:
+            progress_callback(msg)
+        del self._models[model_key]
+        gc.collect()
+        torch = sys.modules.get("torch")
+        if torch is not None and torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "budget_bytes": self.budget_bytes,
+                "resident_bytes": self.resident_bytes(),
+                "models": {
+                    k: {"bytes": self._sizes.get(k, 0), "pins": self._pins.get(k, 0)} for k in self._models
+                },
+            }
@@ -0,0 +1,150 @@
+import os
+import queue
+import signal
+import sys
+import threading
+from multiprocessing.connection import Listener
+from multiprocessing import AuthenticationError
+from typing import Dict, List
+
+import instrumentation
+from evaluation_job import create_job_queue
+from evaluator import evaluator
+from model_client import ModelServerClient, address, authkey, server_version
+
+# The model-serving process of a multi-worker deployment (API_WORKERS > 1).
+#
+# uvicorn's workers are separate processes; if each ran jobs it would load its
+# own copy of every COMET/TransQuest/BERTScore model and they would compete
+# for the GPU. Instead the workers only answer HTTP and forward job requests
+# here (see model_client.py): this process owns the evaluator, the loaded
+# models and the job queue, so jobs from every worker share one copy of each
+# model and one GPU lane. Job progress and streamed score chunks go back to
+# whichever worker holds the client's websocket, through a subscription.
+#
+# Run it with `python model_server.py`; `python main.py` starts it when
+# API_WORKERS > 1 and none is running.
+
+# Events buffered per subscriber before the oldest progress messages are dropped
+SUBSCRIBER_QUEUE_SIZE = 10000
+
+
+class ModelServer:
+    def __init__(self):
+        # client id -> event queues of the connections subscribed to it
+        self._subscribers: Dict[str, List[queue.Queue]] = {}
+        self._lock = threading.Lock()
+        self.job_queue = create_job_queue(evaluator, self.notify, self.send_chunk)
+        # The code and configuration this server started with (see model_client.ensure_server)
+        self.version = server_version()
+        self.handlers = {
+            "submit": self.job_queue.submit,
+            "cancel": self.job_queue.cancel,
+            "position": self.job_queue.position,
+            "depth": self.job_queue.depth,
+            # Everything but the HTTP timings, which each API worker measures itself
+            "metrics": lambda: instrumentation.registry.render(exclude=instrumentation.HTTP_METRICS),
+            "ping": lambda: "pong",
+            "version": lambda: self.version,
+            "shutdown": self.shutdown,
+        }
+
+    def shutdown(self):
+        # After the reply is sent; SIGTERM makes serve() close the listener (and its socket file)
+        threading.Timer(0.2, os.kill, (os.getpid(), signal.SIGTERM)).start()
+        return "stopping"
+
+    def publish(self, client_id: str, event):
+        with self._lock:
+            queues = list(self._subscribers.get(client_id, ()))
+        for events in queues:
+            try:
+                events.put_nowait(event)
+            except queue.Full:
+                # A worker that stopped reading; its client misses events rather than stalling the job
+                pass
+
+    def notify(self, job: Dict, message: str):
+        client_id = job["request"].get("client_id")
+        if client_id:
+            self.publish(client_id, ("message", message))
+
+    def send_chunk(self, client_id: str, chunk: Dict):
+        self.publish(client_id, ("chunk", chunk))
+
+    def _serve_subscriber(self, conn, client_id: str):
+        events = queue.Queue(SUBSCRIBER_QUEUE_SIZE)
+        with self._lock:
+            self._subscribers.setdefault(client_id, []).append(events)
+        try:
+            while True:
+                try:
+                    event = events.get(timeout=1)
+                except queue.Empty:
+                    # The worker closes the connection when the websocket goes away
+                    if conn.poll():
+                        conn.recv()
+                    continue
+                conn.send(event)
+        except (OSError, EOFError):
+            pass
+        finally:
+            with self._lock:
+                subscribed = self._subscribers.get(client_id, [])
+                if events in subscribed:
+                    subscribed.remove(events)
+                if not subscribed:
+                    self._subscribers.pop(client_id, None)
+
+    def _serve(self, conn):
+        try:
+            while True:
+                op, args = conn.recv()
+                if op == "subscribe":
+                    self._serve_subscriber(conn, *args)
+                    return
+                handler = self.handlers.get(op)
+                if handler is None:
+                    conn.send(("error", f"Unknown request: {op}"))
+                    continue
+                try:
+                    result = ("ok", handler(*args))
+                except Exception as e:
+                    result = ("error", str(e))
+                conn.send(result)
+        except (OSError, EOFError):
+            pass
+        finally:
+            conn.close()
+
+    def serve(self, server_address=None):
+        server_address = address() if server_address is None else server_address
+        if ModelServerClient(server_address).ping():
+            print(f"A model server is already running on {server_address}")
+            return
+        if isinstance(server_address, str) and os.name != "nt" and os.path.exists(server_address):
+            # Left behind by a server that did not shut down cleanly
+            os.remove(server_address)
+
+        listener = Listener(server_address, authkey=authkey(create=True))
+        self.job_queue.start()
+        # Time the string metrics on this machine (first startup per hardware only)
+        evaluator.calibration.start()
+        print(f"Model server listening on {server_address}")
+        try:
+            while True:
+                try:
+                    conn = listener.accept()
+                except (AuthenticationError, OSError, EOFError) as e:
+                    print(f"Rejected model server connection: {e}")
+                    continue
+                threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+        finally:
+            listener.close()
+
+
+if __name__ == "__main__":
+    os.makedirs("uploads", exist_ok=True)
+    # Stopped by the API process that started it, or by the shutdown request: exit through serve()'s cleanup
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    ModelServer().serve()
@@ -0,0 +1,140 @@
+import os
+import re
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+# int8 CPU backend for the COMET and TransQuest models.
+#
+# With "backend": "int8" on a model entry in models_config.json (or
+# CPU_BACKEND=int8 for all of them), the Linear layers of the encoder and the
+# estimator are replaced by dynamically quantized int8 versions when the model
+# is loaded on a machine without CUDA. That roughly halves CPU inference time
+# and shrinks the weights about 4x.
+#
+# The first time a model is quantized, real segments (the rows of the sample
+# sheet QUANTIZATION_CHECK_PATH) are scored with the original and the
+# quantized model; if any score moves by more than the tolerance
+# ("quantization_tolerance", default 0.02) the float model is kept. Models that
+# pass have their int8 weights saved under QUANTIZED_MODEL_DIR as a state_dict,
+# together with the library versions, the check segments and the float
+# model's scores on them. A later load quantizes the float model in place,
+# loads those weights (weights_only, so nothing is unpickled) and checks the
+# scores again; an artifact written by other library versions is ignored.
+#
+# check_quantization.py compares the float and int8 scores of a whole sheet.
+
+DEFAULT_TOLERANCE = 0.02
+CHECK_SEGMENTS = 32
+CHECK_TOKENS = 32
+VERSIONED_PACKAGES = ("torch", "transformers", "unbabel-comet", "transquest")
+
+
+def use_int8(config: Dict, default_backend: str) -> bool:
+    backend = config.get("backend", default_backend)
+    if backend != "int8" or config.get("type") not in ("comet", "transquest"):
+        return False
+    import torch
+    return not torch.cuda.is_available()
+
+
+def set_intra_op_threads(threads: int):
+    # 0 keeps PyTorch's default (one thread per core)
+    if threads > 0:
+        import torch
+        torch.set_num_threads(threads)
+
+
+def _detach_trainer(model):
+    # The Lightning trainer that COMET's predict() attaches is neither copyable nor part of the model
+    try:
+        model.trainer = None
+    except Exception:
+        pass
+
+
+def module_of(model, metric_type: str):
+    # The torch module whose Linear layers are quantized (TransQuest wraps it)
+    return model.model if metric_type == "transquest" else model
+
+
+def quantize(module, inplace: bool = False):
+    """An int8 version of `module`: a copy, or `module` itself converted with `inplace`."""
+    import torch
+    _detach_trainer(module)
+    return torch.quantization.quantize_dynamic(module, {torch.nn.Linear}, dtype=torch.qint8, inplace=inplace)
+
+
+def check_segments(path: str, n: Optional[int] = CHECK_SEGMENTS) -> Optional[Tuple[List[str], List[str], List[str]]]:
+    """Up to `n` (srcs, mts, refs) rows of a sheet: the first column is the source, the
+    second the reference and every further column a translation (all rows with n=None). None without the file."""
+    if not os.path.exists(path):
+        return None
+    import ingest
+    df = ingest.load(path)
+    columns = df.columns.tolist()
+    if len(columns) < 3:
+        return None
+    srcs, mts, refs = [], [], []
+    for tgt_col in columns[2:]:
+        for src, ref, mt in zip(df[columns[0]], df[columns[1]], df[tgt_col]):
+            srcs.append(str(src))
+            refs.append(str(ref))
+            mts.append(str(mt))
+    return srcs[:n], mts[:n], refs[:n]
+
+
+def library_versions() -> Dict[str, Optional[str]]:
+    from importlib import metadata
+    versions = {}
+    for package in VERSIONED_PACKAGES:
+        try:
+            versions[package] = metadata.version(package)
+        except metadata.PackageNotFoundError:
+            versions[package] = None
+    return versions
+
+
+def artifact_path(directory: str, config: Dict) -> str:
+    name = re.sub(r"[^A-Za-z0-9_.-]+", "_", config["model_name"])
+    return os.path.join(directory, f"{name}.int8.pt")
+
+
+def load_artifact(path: str, config: Dict) -> Optional[Dict]:
+    """The saved int8 state_dict, check segments and float scores, if written for this model by these library versions."""
+    if not os.path.exists(path):
+        return None
+    import torch
+    try:
+        # Plain tensors, strings and numbers only: nothing in the file is executed
+        saved = torch.load(path, map_location="cpu", weights_only=True)
+    except Exception as e:
+        print(f"Ignoring unreadable quantized model {path}: {e}")
+        return None
+    versions = library_versions()
+    if saved.get("model_name") != config["model_name"] or saved.get("versions") != versions:
+        print(f"Ignoring quantized model {path}: written for {saved.get('model_name')} with {saved.get('versions')}, running {versions}")
+        return None
+    return saved
+
+
+def save_artifact(path: str, module, config: Dict, segments: Tuple[List[str], List[str], List[str]], float_scores: List[float]):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    import torch
+    srcs, mts, refs = segments
+    tmp = path + ".tmp"
+    torch.save({
+        "model_name": config["model_name"],
+        "versions": library_versions(),
+        "state_dict": module.state_dict(),
+        "check": {"srcs": list(srcs), "mts": list(mts), "refs": list(refs), "scores": [float(x) for x in float_scores]},
+    }, tmp)
+    os.replace(tmp, path)
+
+
+def max_difference(reference: List[float], candidate: List[float]) -> float:
+    return float(np.max(np.abs(np.asarray(reference, dtype=np.float64) - np.asarray(candidate, dtype=np.float64))))
+
+
+def tolerance(config: Dict) -> float:
+    return float(config.get("quantization_tolerance", DEFAULT_TOLERANCE))
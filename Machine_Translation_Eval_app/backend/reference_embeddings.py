@@ -0,0 +1,207 @@
+import os
+import shutil
+import tempfile
+import threading
+from collections import Counter, defaultdict
+from contextlib import nullcontext
+from functools import partial
+from itertools import chain
+from math import log
+from multiprocessing import Pool
+from typing import Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+
+# Reference token embeddings for BERTScore, computed once per chunk of a job.
+#
+# bert_score's score() embeds the candidates and the references of every call,
+# so every target column and every length bucket re-encodes the same
+# references. Here each distinct reference string of a chunk is encoded once,
+# the first time a batch needs it, and its token embeddings (plus idf weights)
+# are kept until the chunk is scored: in RAM up to a byte budget, beyond that in
+# memory-mapped .npy files in a temporary directory. Candidates are embedded
+# per batch and matched against the stored references with bert_score's greedy
+# cosine matching. A segment may have several references; like bert_score, the
+# best-matching reference counts. score_many() embeds and matches the
+# candidates of several jobs' batches together, one batch at a time (see
+# micro_batching.py).
+
+
+def corpus_idf(corpus: Iterable[List[str]], tokenizer, nthreads: int = 4):
+    # bert_score's get_idf_dict, with the documents counted chunk by chunk
+    from bert_score.utils import process
+    idf_count = Counter()
+    num_docs = 0
+    process_partial = partial(process, tokenizer=tokenizer)
+    with Pool(nthreads) if nthreads > 0 else nullcontext() as p:
+        for chunk in corpus:
+            num_docs += len(chunk)
+            idf_count.update(chain.from_iterable(p.map(process_partial, chunk) if p else map(process_partial, chunk)))
+    idf = defaultdict(lambda: log((num_docs + 1) / 1))
+    idf.update({idx: log((num_docs + 1) / (c + 1)) for idx, c in idf_count.items()})
+    return idf
+
+
+class ReferenceEmbeddings:
+    def __init__(self, refs: Sequence, corpus: Iterable[List[str]], budget_bytes: int, directory: Optional[str] = None,
+                 idf: bool = False, shared: Optional[Dict] = None):
+        # `refs` has one entry per segment: a string, or a tuple of strings for
+        # several references. idf weights are computed from `corpus`, all
+        # reference strings of the job (one per row and reference column) in
+        # chunks, and kept in `shared` for the job's other chunks
+        self._ids: Dict[str, int] = {}
+        self.groups: List[List[int]] = []
+        for ref in refs:
+            group = [ref] if isinstance(ref, str) else list(ref)
+            self.groups.append([self._ids.setdefault(s, len(self._ids)) for s in group])
+        self.strings = list(self._ids)
+        self.corpus = corpus
+        self.idf = idf
+        self.shared = shared if shared is not None else {}
+        self.budget_bytes = budget_bytes
+        self.directory = directory
+        self.encoded = 0
+        self.ram_bytes = 0
+        self.mapped_bytes = 0
+        self._idf_dict = None
+        # String id -> (block, first token row, token count); blocks hold [embedding | idf] rows
+        self._where: Dict[int, tuple] = {}
+        self._blocks: List[np.ndarray] = []
+        self._tmpdir: Optional[str] = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.groups)
+
+    def __getitem__(self, index):
+        # The reference string(s) of a segment, as bert_score's score() takes them
+        group = [self.strings[j] for j in self.groups[index]]
+        return group[0] if len(group) == 1 else group
+
+    def idf_dict(self, model):
+        if self._idf_dict is None:
+            if self.idf:
+                # Computed once per job, not per batch or chunk
+                if "idf_dict" not in self.shared:
+                    self.shared["idf_dict"] = corpus_idf(self.corpus, model._tokenizer, model.nthreads)
+                self._idf_dict = self.shared["idf_dict"]
+            else:
+                self._idf_dict = defaultdict(lambda: 1.0)
+                self._idf_dict[model._tokenizer.sep_token_id] = 0
+                self._idf_dict[model._tokenizer.cls_token_id] = 0
+        return self._idf_dict
+
+    def _store(self, ids: List[int], lengths: np.ndarray, rows: np.ndarray):
+        if self.ram_bytes + rows.nbytes <= self.budget_bytes:
+            block = rows
+            self.ram_bytes += rows.nbytes
+        else:
+            if self._tmpdir is None:
+                if self.directory:
+                    os.makedirs(self.directory, exist_ok=True)
+                self._tmpdir = tempfile.mkdtemp(prefix="refs-", dir=self.directory)
+            path = os.path.join(self._tmpdir, f"{len(self._blocks)}.npy")
+            mapped = np.lib.format.open_memmap(path, mode="w+", dtype=rows.dtype, shape=rows.shape)
+            mapped[:] = rows
+            mapped.flush()
+            del mapped
+            block = np.load(path, mmap_mode="r")
+            self.mapped_bytes += rows.nbytes
+        starts = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+        for i, start, length in zip(ids, starts, lengths):
+            self._where[i] = (len(self._blocks), int(start), int(length))
+        self._blocks.append(block)
+        self.encoded += len(ids)
+
+    def encode(self, model, ids: List[int], batch_size: int):
+        """Embed the references among `ids` that have not been embedded yet."""
+        from bert_score.utils import get_bert_embedding
+
+        with self._lock:
+            todo = [i for i in dict.fromkeys(ids) if i not in self._where]
+            # Longest first, as bert_score does, so batches are padded to similar lengths
+            todo.sort(key=lambda i: -len(self.strings[i]))
+            idf_dict = self.idf_dict(model)
+            for start in range(0, len(todo), batch_size):
+                batch = todo[start:start + batch_size]
+                embedding, mask, idf = get_bert_embedding([self.strings[i] for i in batch], model._model, model._tokenizer,
+                                                          idf_dict, device=model.device)
+                lengths = mask.sum(dim=1).cpu().numpy()
+                embedding = embedding.float().cpu().numpy()
+                idf = idf.float().cpu().numpy()
+                rows = np.concatenate([
+                    np.concatenate([embedding[k, :n], idf[k, :n, None]], axis=1) for k, n in enumerate(lengths)
+                ]).astype(np.float32)
+                self._store(batch, lengths, rows)
+
+    def _get(self, i: int) -> np.ndarray:
+        block, start, length = self._where[i]
+        return self._blocks[block][start:start + length]
+
+    def score(self, model, mts: List[str], rows: List[int], batch_size: int) -> List[float]:
+        """BERTScore F1 of mts[i] against the reference(s) of segment i, for every i in `rows`."""
+        return score_many(model, [(self, mts, rows)], batch_size)[0]
+
+    def close(self):
+        self._blocks = []
+        self._where = {}
+        if self._tmpdir is not None:
+            shutil.rmtree(self._tmpdir, ignore_errors=True)
+            self._tmpdir = None
+
+
+def score_many(model, requests: List[tuple], batch_size: int) -> List[List[float]]:
+    """ReferenceEmbeddings.score() of several (embeddings, mts, rows) requests, e.g. of concurrent jobs.
+
+    The candidates of all requests are embedded and matched `batch_size`
+    segments at a time, with the idf weights of the first request's embeddings,
+    so device memory follows the batch size rather than the number of rows.
+    """
+    for embeddings, _, rows in requests:
+        embeddings.encode(model, [j for r in rows for j in embeddings.groups[r]], batch_size)
+    idf_dict = requests[0][0].idf_dict(model)
+
+    segments = [(embeddings, mts[r], embeddings.groups[r]) for embeddings, mts, rows in requests for r in rows]
+    F = np.concatenate([_match(model, segments[start:start + batch_size], idf_dict, batch_size)
+                        for start in range(0, len(segments), batch_size)]) if segments else np.zeros(0, dtype=np.float32)
+
+    # Best reference of each segment
+    bounds = np.cumsum([0] + [len(group) for _, _, group in segments])
+    best = np.maximum.reduceat(F, bounds[:-1]) if segments else F
+    if getattr(model, "rescale_with_baseline", False):
+        baseline = float(model.baseline_vals[2])
+        best = (best - baseline) / (1 - baseline)
+    splits = np.cumsum([0] + [len(rows) for _, _, rows in requests])
+    return [best[a:b].tolist() for a, b in zip(splits[:-1], splits[1:])]
+
+
+def _match(model, segments: List[tuple], idf_dict, batch_size: int) -> np.ndarray:
+    # F1 of every (candidate, reference) pair of one batch of (embeddings, candidate, reference ids) segments
+    import torch
+    from bert_score.utils import get_bert_embedding, greedy_cos_idf
+
+    hyp_embedding, hyp_mask, hyp_idf = get_bert_embedding([mt for _, mt, _ in segments], model._model, model._tokenizer,
+                                                          idf_dict, batch_size=batch_size, device=model.device)
+    # One (candidate, reference) pair per reference of every segment
+    pair_hyp = [k for k, (_, _, group) in enumerate(segments) for _ in group]
+    refs = [embeddings._get(j) for embeddings, _, group in segments for j in group]
+    max_len = max(len(ref) for ref in refs)
+    dim = refs[0].shape[1] - 1
+    # Padding as in bert_score (never matched: the mask and the idf weights are 0 there)
+    ref_embedding = np.full((len(refs), max_len, dim), 2.0, dtype=np.float32)
+    ref_idf = np.zeros((len(refs), max_len), dtype=np.float32)
+    ref_mask = np.zeros((len(refs), max_len), dtype=bool)
+    for k, ref in enumerate(refs):
+        ref_embedding[k, :len(ref)] = ref[:, :dim]
+        ref_idf[k, :len(ref)] = ref[:, dim]
+        ref_mask[k, :len(ref)] = True
+
+    device = hyp_embedding.device
+    index = torch.as_tensor(pair_hyp, device=device)
+    with torch.no_grad():
+        P, R, F = greedy_cos_idf(
+            torch.from_numpy(ref_embedding).to(device), torch.from_numpy(ref_mask).to(device),
+            torch.from_numpy(ref_idf).to(device),
+            hyp_embedding.index_select(0, index).float(), hyp_mask.index_select(0, index),
+            hyp_idf.index_select(0, index).float())
+    return F.cpu().numpy()
@@ -0,0 +1,162 @@
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+# Results of finished evaluation jobs, for the results API.
+#
+# Each job's results frame (the selected text columns plus one column per
+# model and target column) is written once as <job_id>.parquet, next to a
+# <job_id>.summary.json with the aggregates and histogram of every score
+# column, computed when the job finishes. The frontend asks for the summary
+# (charts) and for one page of rows at a time (table), sorted and filtered by
+# score thresholds on the server, so a 100k-row job is never sent whole.
+# The frames of the most recently read jobs stay in memory.
+
+HISTOGRAM_BINS = 20
+PERCENTILES = (5, 25, 50, 75, 95)
+# Frames of this many jobs are kept in memory for paging
+CACHED_JOBS = 4
+
+
+def summarize_column(values: pd.Series) -> Dict:
+    values = pd.to_numeric(values, errors="coerce").to_numpy(dtype=np.float64)
+    values = values[np.isfinite(values)]
+    if not len(values):
+        return {"count": 0}
+    counts, edges = np.histogram(values, bins=HISTOGRAM_BINS)
+    return {
+        "count": int(len(values)),
+        "mean": float(values.mean()),
+        "std": float(values.std()),
+        "min": float(values.min()),
+        "max": float(values.max()),
+        "percentiles": {str(p): float(v) for p, v in zip(PERCENTILES, np.percentile(values, PERCENTILES))},
+        "histogram": {"edges": edges.tolist(), "counts": counts.tolist()},
+    }
+
+
+def _records(df: pd.DataFrame) -> List[Dict]:
+    # to_json turns NaN into null and numpy scalars into plain numbers
+    return json.loads(df.to_json(orient="records", force_ascii=False))
+
+
+class ResultsStore:
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._frames: "OrderedDict[str, pd.DataFrame]" = OrderedDict()
+
+    def _path(self, job_id: str, suffix: str) -> str:
+        return os.path.join(self.directory, f"{job_id}{suffix}")
+
+    def exists(self, job_id: str) -> bool:
+        return os.path.exists(self._path(job_id, ".parquet"))
+
+    def save(self, job_id: str, df: pd.DataFrame, score_columns: Optional[List[str]] = None):
+        os.makedirs(self.directory, exist_ok=True)
+        df = df.reset_index(drop=True)
+        df.columns = [str(c) for c in df.columns]
+        if score_columns is None:
+            score_columns = [c for c in df.columns if pd.api.types.is_numeric_dtype(df[c])]
+        summary = {
+            "total_rows": len(df),
+            "columns": df.columns.tolist(),
+            "score_columns": [str(c) for c in score_columns],
+            "aggregates": {str(c): summarize_column(df[c]) for c in score_columns},
+            "corpus_scores": df.attrs.get("corpus_scores", {}),
+        }
+        # attrs (timings, corpus scores) are stored in the summary, not in the Parquet metadata
+        df.attrs = {}
+        # The summary first: exists() looks for the Parquet file
+        for suffix, write in ((".summary.json", lambda p: _write_json(p, summary)),
+                              (".parquet", lambda p: df.to_parquet(p, index=False))):
+            path = self._path(job_id, suffix)
+            # A temporary file of its own, so two writers of one job never share one
+            fd, tmp = tempfile.mkstemp(prefix=f".{job_id}.", suffix=f".partial{suffix}", dir=self.directory)
+            os.close(fd)
+            try:
+                write(tmp)
+                os.replace(tmp, path)
+            except BaseException:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+                raise
+        with self._lock:
+            self._frames.pop(job_id, None)
+
+    def summary(self, job_id: str) -> Dict:
+        with open(self._path(job_id, ".summary.json"), encoding="utf-8") as f:
+            return json.load(f)
+
+    def frame(self, job_id: str) -> pd.DataFrame:
+        with self._lock:
+            df = self._frames.get(job_id)
+            if df is not None:
+                self._frames.move_to_end(job_id)
+                return df
+        df = pd.read_parquet(self._path(job_id, ".parquet"))
+        with self._lock:
+            self._frames[job_id] = df
+            while len(self._frames) > CACHED_JOBS:
+                self._frames.popitem(last=False)
+        return df
+
+    def page(self, job_id: str, offset: int = 0, limit: int = 500, sort: Optional[str] = None, descending: bool = False,
+             filters: Optional[Dict[str, Tuple[Optional[float], Optional[float]]]] = None) -> Tuple[int, List[Dict]]:
+        """One page of rows, each with its original position as "_row".
+
+        `filters` maps a score column to (min, max) thresholds (either may be
+        None); rows outside any of them are left out. Returns (number of
+        matching rows, rows of the page).
+        """
+        df = self.frame(job_id)
+        keep = np.ones(len(df), dtype=bool)
+        for column, (low, high) in (filters or {}).items():
+            if column not in df.columns:
+                raise KeyError(column)
+            values = pd.to_numeric(df[column], errors="coerce").to_numpy(dtype=np.float64)
+            if low is not None:
+                keep &= values >= low
+            if high is not None:
+                keep &= values <= high
+        rows = np.flatnonzero(keep)
+        if sort is not None:
+            if sort not in df.columns:
+                raise KeyError(sort)
+            # Stable, with missing scores last in either direction
+            order = df[sort].iloc[rows].reset_index(drop=True).sort_values(ascending=not descending, kind="stable",
+                                                                              na_position="last").index.to_numpy()
+            rows = rows[order]
+        selected = rows[offset:offset + limit]
+        page = df.iloc[selected].copy()
+        page.insert(0, "_row", selected)
+        return len(rows), _records(page)
+
+    def series(self, job_id: str, column: str, points: int = 1000) -> Dict:
+        """At most `points` evenly spaced (row, score) pairs of a column, for scatter plots."""
+        df = self.frame(job_id)
+        if column not in df.columns:
+            raise KeyError(column)
+        rows = np.unique(np.linspace(0, len(df) - 1, min(points, len(df))).astype(np.int64)) if len(df) else np.zeros(0, dtype=np.int64)
+        values = pd.to_numeric(df[column].iloc[rows], errors="coerce")
+        return {"rows": rows.tolist(), "values": [None if pd.isna(v) else float(v) for v in values]}
+
+    def delete(self, job_id: str):
+        with self._lock:
+            self._frames.pop(job_id, None)
+        for suffix in (".parquet", ".summary.json"):
+            try:
+                os.remove(self._path(job_id, suffix))
+            except FileNotFoundError:
+                pass
+
+
+def _write_json(path: str, data: Dict):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
@@ -0,0 +1,100 @@
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional
+
+# Running the metrics of one evaluation job concurrently.
+#
+# Every task runs on a lane, and every lane is one thread: the "device" lane
+# runs the neural metrics one after another on the GPU (so two models never
+# compete for its memory), while the "cpu" lane runs the string metrics, whose
+# statistics are computed in the string metric process pool. A task starts once
+# the tasks it depends on have finished; tasks of the same lane run in the
+# order they were added. The first failure (including a cancelled job) stops
+# every lane and is re-raised by run().
+
+
+class Task:
+    def __init__(self, name: str, lane: str, run: Callable[[], object], deps: Iterable[str] = ()):
+        self.name = name
+        self.lane = lane
+        self.run = run
+        self.deps = list(deps)
+        self.result = None
+        self.seconds = 0.0
+        self.done = False
+
+
+class Scheduler:
+    def __init__(self):
+        self.tasks: Dict[str, Task] = {}
+        self.wall_seconds = 0.0
+        self._cond = threading.Condition()
+        self._error: Optional[BaseException] = None
+
+    def add(self, name: str, lane: str, run: Callable[[], object], deps: Iterable[str] = ()):
+        # Dependencies must be added first, which also keeps the graph acyclic
+        deps = list(deps)
+        unknown = [d for d in deps if d not in self.tasks]
+        if unknown:
+            raise ValueError(f"Task {name} depends on unknown tasks: {', '.join(unknown)}")
+        self.tasks[name] = Task(name, lane, run, deps)
+
+    def lanes(self) -> Dict[str, List[Task]]:
+        lanes: Dict[str, List[Task]] = {}
+        for task in self.tasks.values():
+            lanes.setdefault(task.lane, []).append(task)
+        return lanes
+
+    def check(self):
+        """Raise in a running task once a task on another lane has failed."""
+        if self._error is not None:
+            raise RuntimeError("Evaluation stopped: another metric failed")
+
+    def _run_lane(self, tasks: List[Task]):
+        for task in tasks:
+            with self._cond:
+                self._cond.wait_for(lambda: self._error is not None or all(self.tasks[d].done for d in task.deps))
+                if self._error is not None:
+                    return
+            start = time.perf_counter()
+            try:
+                task.result = task.run()
+            except BaseException as e:
+                with self._cond:
+                    if self._error is None:
+                        self._error = e
+                    self._cond.notify_all()
+                return
+            finally:
+                task.seconds = time.perf_counter() - start
+            with self._cond:
+                task.done = True
+                self._cond.notify_all()
+
+    def run(self) -> Dict[str, object]:
+        """Run all tasks and return their results by name; the first lane runs on the calling thread."""
+        start = time.perf_counter()
+        lanes = list(self.lanes().values())
+        threads = [threading.Thread(target=self._run_lane, args=(tasks,), daemon=True) for tasks in lanes[1:]]
+        for thread in threads:
+            thread.start()
+        if lanes:
+            self._run_lane(lanes[0])
+        for thread in threads:
+            thread.join()
+        self.wall_seconds = time.perf_counter() - start
+        if self._error is not None:
+            raise self._error
+        return {name: task.result for name, task in self.tasks.items()}
+
+    def busy_share(self) -> Dict[str, Dict[str, float]]:
+        """Seconds every lane spent running tasks and the fraction of the job's wall time they cover.
+
+        This is lane time, not device utilization: a lane counts as busy while
+        a task runs, whether or not the GPU or the worker processes are working.
+        """
+        report = {}
+        for lane, tasks in self.lanes().items():
+            busy = sum(task.seconds for task in tasks)
+            report[lane] = {"busy_seconds": busy, "busy_share": busy / self.wall_seconds if self.wall_seconds else 0.0}
+        return report
@@ -0,0 +1,118 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional, Sequence
+
+# Persistent, content-addressed cache of segment scores for the neural metrics.
+#
+# An entry is keyed by the model (key and underlying model name) plus a SHA-256
+# of the (src, mt, ref) triple the metric actually reads, so re-uploading a
+# sheet with one extra MT column only sends the new segments to the models.
+# The SQLite file is bounded in size: when it grows past `max_bytes` the least
+# recently used entries are deleted.
+
+# SQLite's historical limit on host parameters per statement
+_BATCH = 900
+
+
+def segment_key(model_id: str, src: Optional[str], mt: Optional[str], ref: Optional[str]) -> str:
+    payload = json.dumps([model_id, src, mt, ref], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ScoreCache:
+    def __init__(self, path: str, max_bytes: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS scores ("
+                " key TEXT PRIMARY KEY, score REAL NOT NULL, last_used REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS scores_last_used ON scores(last_used)")
+            self._conn.commit()
+        return self._conn
+
+    def get_many(self, keys: Sequence[str]) -> Dict[str, float]:
+        """Return the cached scores for `keys` (missing keys are left out) and mark them as used."""
+        found = {}
+        unique_keys = list(dict.fromkeys(keys))
+        with self._lock:
+            conn = self._connect()
+            for i in range(0, len(unique_keys), _BATCH):
+                chunk = unique_keys[i:i + _BATCH]
+                placeholders = ",".join("?" * len(chunk))
+                rows = conn.execute(f"SELECT key, score FROM scores WHERE key IN ({placeholders})", chunk)
+                found.update(rows.fetchall())
+            if found:
+                now = time.time()
+                conn.executemany("UPDATE scores SET last_used = ? WHERE key = ?", [(now, k) for k in found])
+                conn.commit()
+        return found
+
+    def put_many(self, items: Dict[str, float]):
+        if not items:
+            return
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            conn.executemany(
+                "INSERT OR REPLACE INTO scores (key, score, last_used) VALUES (?, ?, ?)",
+                [(k, float(v), now) for k, v in items.items()],
+            )
+            conn.commit()
+            self._evict(conn)
+
+    def _used_bytes(self, conn: sqlite3.Connection) -> int:
+        page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+        page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+        free_pages = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        return (page_count - free_pages) * page_size
+
+    def _evict(self, conn: sqlite3.Connection):
+        used = self._used_bytes(conn)
+        if used <= self.max_bytes:
+            return
+        count = conn.execute("SELECT COUNT(*) FROM scores").fetchone()[0]
+        if count == 0:
+            return
+        # Drop enough of the least recently used entries to get back under 90% of the budget
+        per_entry = used / count
+        n_delete = min(count, int((used - 0.9 * self.max_bytes) / per_entry) + 1)
+        conn.execute(
+            "DELETE FROM scores WHERE key IN (SELECT key FROM scores ORDER BY last_used LIMIT ?)",
+            (n_delete,),
+        )
+        conn.commit()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            conn = self._connect()
+            count = conn.execute("SELECT COUNT(*) FROM scores").fetchone()[0]
+            return {"entries": count, "bytes": self._used_bytes(conn), "max_bytes": self.max_bytes}
+
+
+def lookup(cache: Optional[ScoreCache], model_id: str, srcs: List[Optional[str]], mts: List[Optional[str]],
+           refs: List[Optional[str]]):
+    """Split rows into cached scores and rows that still need the model.
+
+    Returns (keys, scores, missing) where `scores` has the cached value or None
+    for every row and `missing` lists the row indices to score.
+    """
+    keys = [segment_key(model_id, s, m, r) for s, m, r in zip(srcs, mts, refs)]
+    found = cache.get_many(keys) if cache is not None else {}
+    scores = [found.get(k) for k in keys]
+    missing = [i for i, s in enumerate(scores) if s is None]
+    return keys, scores, missing
@@ -0,0 +1,176 @@
+import math
+from itertools import combinations
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from string_metrics import BOOTSTRAP_SEED, DEFAULT_BOOTSTRAP
+
+# Significance tests between the translations (systems) of a job.
+#
+# Every pair of target columns is compared on every metric with a paired
+# bootstrap test and a paired approximate randomization test on the segment
+# scores written by Evaluator.evaluate (columns "<model>_<target column>").
+# The test statistic is the difference of the mean segment scores; for BLEU,
+# TER and chrF that is the mean sentence score, not the corpus score (whose
+# interval string_metrics.py already reports).
+#
+# Nothing loops over pairs, metrics or resamples in Python. A block of
+# resamples is a (resamples x segments) weight matrix, and one matrix product
+# with the (segments x metrics*systems) score matrix gives the resampled means
+# of every system on every metric; pairwise differences are taken from those.
+# Randomization trials likewise are a matrix of random signs times the
+# (segments x metrics*pairs) score differences.
+#
+# Bootstrap resamples use Poisson(1) weights (the "Poisson bootstrap") instead
+# of multinomial draw counts: each segment is weighted independently, which
+# is a table lookup per cell rather than n draws plus a bincount per resample,
+# and the means are normalized by the total weight of the resample. For
+# anything but tiny test sets the two are indistinguishable, and 1000
+# resamples of 100k segments take well under a second.
+
+# Upper bound on (resamples x segments) cells materialized at once
+BLOCK_CELLS = 2 ** 21
+# Poisson(1) quantiles of 16 random bits
+_POISSON_TABLE_BITS = 16
+
+
+def _poisson_table() -> np.ndarray:
+    cdf = np.cumsum([math.exp(-1) / math.factorial(k) for k in range(20)])
+    u = (np.arange(2 ** _POISSON_TABLE_BITS) + 0.5) / 2 ** _POISSON_TABLE_BITS
+    return np.searchsorted(cdf, u).astype(np.uint8)
+
+
+_POISSON = _poisson_table()
+
+
+def _blocks(total: int, n: int):
+    block = max(1, min(total, BLOCK_CELLS // max(n, 1)))
+    for start in range(0, total, block):
+        yield min(block, total - start)
+
+
+def _random_bytes(rng: np.random.Generator, count: int) -> np.ndarray:
+    # Raw generator output: several times faster than rng.integers for uniform bits
+    return rng.bit_generator.random_raw((count + 7) // 8).view(np.uint8)[:count]
+
+
+def bootstrap_means(scores: np.ndarray, n_bootstrap: int, rng: np.random.Generator) -> np.ndarray:
+    """Resampled column means of a (segments x columns) matrix, (n_bootstrap x columns)."""
+    n, k = scores.shape
+    # Centered, so float32 sums of large columns keep their precision; the
+    # extra column of ones gives the total weight of each resample
+    center = scores.mean(axis=0)
+    centered = np.ones((n, k + 1), dtype=np.float32)
+    centered[:, :k] = scores - center
+    means = []
+    for b in _blocks(n_bootstrap, n):
+        draws = _random_bytes(rng, 2 * b * n).view(np.uint16).reshape(b, n)
+        weights = np.take(_POISSON, draws).astype(np.float32)
+        sums = (weights @ centered).astype(np.float64)
+        # An all-zero resample (only possible for a handful of segments) counts every segment once
+        total = np.where(sums[:, k] > 0, sums[:, k], n)
+        means.append(sums[:, :k] / total[:, None])
+    return np.concatenate(means) + center
+
+
+def randomization_statistics(diffs: np.ndarray, n_trials: int, rng: np.random.Generator) -> np.ndarray:
+    """|mean difference| of every column of (segments x columns) `diffs` after swapping
+    each segment's two scores with probability 1/2, (n_trials x columns)."""
+    n = diffs.shape[0]
+    diffs32 = diffs.astype(np.float32)
+    column_sums = diffs.sum(axis=0)
+    stats = []
+    for b in _blocks(n_trials, n):
+        # A swap negates the segment's difference: sum(sign * d) = 2 * sum(kept * d) - sum(d)
+        bits = _random_bytes(rng, b * ((n + 7) // 8)).reshape(b, -1)
+        kept = np.unpackbits(bits, axis=1, count=n).astype(np.float32)
+        stats.append(np.abs(2 * (kept @ diffs32).astype(np.float64) - column_sums) / n)
+    return np.concatenate(stats)
+
+
+def paired_tests(scores: np.ndarray, n_bootstrap: int = DEFAULT_BOOTSTRAP, n_trials: int = DEFAULT_BOOTSTRAP,
+                 seed: Optional[int] = BOOTSTRAP_SEED, alpha: float = 0.05) -> Dict[str, np.ndarray]:
+    """Bootstrap and randomization tests on a (metrics x systems x segments) score array.
+
+    Returns "pairs", the (a, b) system index of every pair, and arrays indexed
+    [metric, system] ("mean", "ci") and [metric, pair] ("delta", "delta_ci",
+    "p_bootstrap", "p_randomization"); a delta is system a minus system b.
+    """
+    n_metrics, n_systems, n = scores.shape
+    pairs = np.array(list(combinations(range(n_systems), 2)), dtype=np.int64).reshape(-1, 2)
+    rng = np.random.default_rng(seed)
+    # Segments as rows, (metric, system) as columns
+    flat = scores.reshape(n_metrics * n_systems, n).T.astype(np.float64)
+    means = flat.mean(axis=0).reshape(n_metrics, n_systems)
+    delta = means[:, pairs[:, 0]] - means[:, pairs[:, 1]]
+    low, high = 100 * alpha / 2, 100 * (1 - alpha / 2)
+    result = {"pairs": pairs, "mean": means, "delta": delta}
+
+    if n_bootstrap > 0 and n:
+        samples = bootstrap_means(flat, n_bootstrap, rng).reshape(n_bootstrap, n_metrics, n_systems)
+        result["ci"] = np.stack(np.percentile(samples, [low, high], axis=0), axis=-1)
+        deltas = samples[:, :, pairs[:, 0]] - samples[:, :, pairs[:, 1]]
+        result["delta_ci"] = np.stack(np.percentile(deltas, [low, high], axis=0), axis=-1)
+        # Two-sided: how often the resampled difference, shifted to a true difference of 0, is at least as large
+        extreme = np.abs(deltas - deltas.mean(axis=0)) >= np.abs(delta)
+        result["p_bootstrap"] = (extreme.sum(axis=0) + 1) / (n_bootstrap + 1)
+
+    if n_trials > 0 and n and len(pairs):
+        diffs = (scores[:, pairs[:, 0]] - scores[:, pairs[:, 1]]).reshape(-1, n).T
+        stats = randomization_statistics(diffs, n_trials, rng).reshape(n_trials, n_metrics, len(pairs))
+        # Ties count as at least as extreme, so a system compared with itself gets p = 1
+        extreme = stats >= np.abs(delta)
+        result["p_randomization"] = (extreme.sum(axis=0) + 1) / (n_trials + 1)
+    return result
+
+
+def compare_systems(df: pd.DataFrame, systems: List[str], metrics: List[str], n_bootstrap: int = DEFAULT_BOOTSTRAP,
+                    n_trials: int = DEFAULT_BOOTSTRAP, seed: Optional[int] = BOOTSTRAP_SEED, alpha: float = 0.05) -> Dict:
+    """Pairwise significance of the target columns `systems` on the model keys `metrics`.
+
+    Reads the "<metric>_<system>" score columns of an evaluated frame. Only
+    segments scored by every metric for every system are used; ValueError if
+    there are none (the means and tests would all be NaN).
+    """
+    columns = [f"{metric}_{system}" for metric in metrics for system in systems]
+    missing = [c for c in columns if c not in df.columns]
+    if missing:
+        raise KeyError(f"Missing score columns: {', '.join(missing)}")
+    values = df[columns].apply(pd.to_numeric, errors="coerce").to_numpy(dtype=np.float64)
+    values = values[np.isfinite(values).all(axis=1)]
+    scores = values.T.reshape(len(metrics), len(systems), -1)
+    if scores.shape[2] == 0:
+        raise ValueError("No segment has a score from every metric for every target column")
+    tests = paired_tests(scores, n_bootstrap, n_trials, seed, alpha)
+
+    def interval(array, *index):
+        return [float(v) for v in array[index]] if array is not None else None
+
+    report = {
+        "segments": int(scores.shape[2]),
+        "n_bootstrap": n_bootstrap,
+        "n_trials": n_trials,
+        "alpha": alpha,
+        "systems": {
+            metric: {
+                system: {"mean": float(tests["mean"][m, s]), "ci": interval(tests.get("ci"), m, s)}
+                for s, system in enumerate(systems)
+            }
+            for m, metric in enumerate(metrics)
+        },
+        "pairs": [],
+    }
+    for m, metric in enumerate(metrics):
+        for p, (a, b) in enumerate(tests["pairs"]):
+            report["pairs"].append({
+                "metric": metric,
+                "a": systems[a],
+                "b": systems[b],
+                "delta": float(tests["delta"][m, p]),
+                "delta_ci": interval(tests.get("delta_ci"), m, p),
+                "p_bootstrap": float(tests["p_bootstrap"][m, p]) if "p_bootstrap" in tests else None,
+                "p_randomization": float(tests["p_randomization"][m, p]) if "p_randomization" in tests else None,
+            })
+    return report
@@ -0,0 +1,545 @@
+import hashlib
+import math
+import multiprocessing
+import os
+import re
+import sys
+import threading
+import uuid
+from collections import OrderedDict, defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import count
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import sacrebleu
+from sacrebleu.metrics.lib_ter import translation_edit_rate
+
+from config import STRING_METRIC_WORKERS, TOKEN_CACHE_MB
+
+# Batched scoring for the string metrics (BLEU, TER, chrF).
+#
+# sacrebleu.sentence_bleu/ter/chrf build a new metric object, re-tokenize and
+# re-extract the reference n-grams on every call. Here each column is
+# tokenized once, tokens and characters are interned into integer arrays, and
+# n-gram matches of all segments are counted with NumPy (TER, which needs an
+# edit distance per pair, only computes each distinct pair once). The
+# sufficient statistics of every segment are stored in one integer matrix.
+# Sentence scores, the corpus score and the bootstrap confidence interval are
+# then all computed from that matrix with vectorized NumPy code. The scores are
+# identical to the sacrebleu sentence_* / corpus_* defaults.
+
+BLEU_ORDER = 4
+CHRF_ORDER = 6
+CHRF_BETA = 2
+
+DEFAULT_BOOTSTRAP = 1000
+BOOTSTRAP_SEED = 12345
+# Upper bound on (resamples x rows) materialized at once while bootstrapping
+BOOTSTRAP_BLOCK_CELLS = 2 ** 23
+
+
+def _my_log(x):
+    # Same convention as sacrebleu.utils.my_log: log(0) is a large negative number
+    with np.errstate(divide='ignore'):
+        return np.where(x > 0, np.log(np.where(x > 0, x, 1.0)), -9999999999.0)
+
+
+def bleu_from_stats(stats: np.ndarray, effective_order: bool) -> np.ndarray:
+    # stats: (..., 2 + 2 * BLEU_ORDER) -> [sys_len, ref_len, correct..., total...]
+    stats = np.asarray(stats, dtype=np.float64)
+    sys_len, ref_len = stats[..., 0], stats[..., 1]
+    correct = stats[..., 2:2 + BLEU_ORDER]
+    total = stats[..., 2 + BLEU_ORDER:]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        bp = np.where(sys_len < ref_len,
+                      np.where(sys_len > 0, np.exp(1 - ref_len / np.where(sys_len > 0, sys_len, 1)), 0.0),
+                      1.0)
+
+        # Orders are only used up to the first one without any hypothesis n-gram
+        active = np.cumprod(total > 0, axis=-1).astype(bool)
+        # 'exp' smoothing: every order without a match halves the pseudo count again
+        zero = active & (correct == 0)
+        smooth = np.power(2.0, np.cumsum(zero, axis=-1))
+        safe_total = np.where(total > 0, total, 1)
+        precisions = np.where(correct > 0, 100.0 * correct / safe_total, 100.0 / (smooth * safe_total))
+        precisions = np.where(active, precisions, 0.0)
+
+    if effective_order:
+        order = active.sum(axis=-1)
+        log_p = np.where(active, _my_log(precisions), 0.0).sum(axis=-1)
+    else:
+        order = np.full(sys_len.shape, BLEU_ORDER)
+        log_p = _my_log(precisions).sum(axis=-1)
+
+    score = bp * np.exp(log_p / np.maximum(order, 1))
+    return np.where(correct.sum(axis=-1) > 0, score, 0.0)
+
+
+def chrf_from_stats(stats: np.ndarray) -> np.ndarray:
+    # stats: (..., 3 * CHRF_ORDER) -> [hyp, ref, match] per character order
+    stats = np.asarray(stats, dtype=np.float64)
+    n_hyp, n_ref, n_match = stats[..., 0::3], stats[..., 1::3], stats[..., 2::3]
+    factor = CHRF_BETA ** 2
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        valid = (n_hyp > 0) & (n_ref > 0)
+        prec = np.where(valid, n_match / np.where(n_hyp > 0, n_hyp, 1), 0.0)
+        rec = np.where(valid, n_match / np.where(n_ref > 0, n_ref, 1), 0.0)
+        eff_order = valid.sum(axis=-1)
+        avg_prec = prec.sum(axis=-1) / np.maximum(eff_order, 1)
+        avg_rec = rec.sum(axis=-1) / np.maximum(eff_order, 1)
+        denom = factor * avg_prec + avg_rec
+        score = 100 * (1 + factor) * avg_prec * avg_rec / np.where(denom > 0, denom, 1)
+
+    return np.where(avg_prec + avg_rec > 0, score, 0.0)
+
+
+def ter_from_stats(stats: np.ndarray) -> np.ndarray:
+    # stats: (..., 2) -> [num_edits, ref_len]
+    stats = np.asarray(stats, dtype=np.float64)
+    edits, ref_len = stats[..., 0], stats[..., 1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        score = np.where(ref_len > 0, edits / np.where(ref_len > 0, ref_len, 1),
+                         np.where(edits > 0, 1.0, 0.0))
+    return 100 * score
+
+
+def bootstrap_ci(stats: np.ndarray, score_fn, n_bootstrap: int = DEFAULT_BOOTSTRAP,
+                 seed: int = BOOTSTRAP_SEED, alpha: float = 0.05):
+    """Percentile bootstrap interval of a corpus-level score.
+
+    Each resample is represented by how often every row was drawn, so the
+    resampled corpus statistics are a single (resamples x rows) @ (rows x stats)
+    product instead of a Python loop.
+    """
+    n = stats.shape[0]
+    if n == 0 or n_bootstrap <= 0:
+        return None
+
+    rng = np.random.default_rng(seed)
+    stats = stats.astype(np.float64)
+    block = max(1, min(n_bootstrap, BOOTSTRAP_BLOCK_CELLS // n))
+    samples = []
+    for start in range(0, n_bootstrap, block):
+        b = min(block, n_bootstrap - start)
+        idx = rng.integers(0, n, size=(b, n)) + (np.arange(b) * n)[:, None]
+        counts = np.bincount(idx.ravel(), minlength=b * n).reshape(b, n)
+        samples.append(score_fn(counts @ stats))
+    samples = np.concatenate(samples)
+
+    low, high = np.percentile(samples, [100 * alpha / 2, 100 * (1 - alpha / 2)])
+    return float(low), float(high)
+
+
+def _ngram_matches(hyp_ids, hyp_rows, ref_ids, ref_rows, n_rows: int, max_order: int, base: int) -> np.ndarray:
+    """Clipped n-gram matches per row for orders 1..max_order.
+
+    `*_ids` hold the integer id of every token (or character) of a side and
+    `*_rows` the row it belongs to. N-grams are interned order by order: an
+    n-gram key is the dense id of its (row, (n-1)-gram prefix) combined with its
+    last unit, so keys stay within int64 whatever the vocabulary size. An n-gram
+    can only match if its prefix matched, so positions whose n-gram does not
+    occur on both sides of its row are dropped before the next order.
+
+    Returns a (n_rows, max_order) array.
+    """
+    ids = np.concatenate([hyp_ids, ref_ids]).astype(np.int64)
+    rows = np.concatenate([hyp_rows, ref_rows]).astype(np.int64)
+    side = np.concatenate([np.zeros(len(hyp_ids), dtype=np.int64), np.ones(len(ref_ids), dtype=np.int64)])
+    # Exclusive end of the (row, side) segment each unit belongs to
+    bounds = np.flatnonzero(np.diff(rows * 2 + side) != 0) + 1
+    seg_end = np.repeat(np.append(bounds, len(ids)), np.diff(np.concatenate([[0], bounds, [len(ids)]])))
+    correct = np.zeros((n_rows, max_order), dtype=np.int64)
+
+    # Start positions of the surviving n-grams of the current order and their dense ids
+    pos = np.arange(len(ids), dtype=np.int64)
+    dense = rows
+    for n in range(1, max_order + 1):
+        if n > 1:
+            # The n-gram at i is the (n-1)-gram at i extended by the unit at i+n-1
+            keep = pos + n - 1 < seg_end[pos]
+            pos, dense = pos[keep], dense[keep]
+        if len(pos) == 0:
+            break
+
+        # Hash-based factorization is much cheaper than the sort behind np.unique
+        dense, keys = pd.factorize(dense * base + ids[pos + n - 1])
+        dense = dense.astype(np.int64)
+        n_keys = len(keys)
+        counts = np.bincount(dense * 2 + side[pos], minlength=2 * n_keys).reshape(n_keys, 2)
+        key_rows = np.zeros(n_keys, dtype=np.int64)
+        key_rows[dense] = rows[pos]
+        correct[:, n - 1] = np.bincount(key_rows, weights=counts.min(axis=1), minlength=n_rows)
+
+        shared = (counts > 0).all(axis=1)[dense]
+        pos, dense = pos[shared], dense[shared]
+
+    return correct
+
+
+def _ngram_totals(lengths: np.ndarray, max_order: int) -> np.ndarray:
+    # Number of n-grams of each order in a sequence of the given length
+    return np.maximum(lengths[:, None] - np.arange(max_order)[None, :], 0)
+
+
+def _flatten(units: List[np.ndarray]):
+    lengths = np.fromiter((len(u) for u in units), dtype=np.int64, count=len(units))
+    flat = np.concatenate(units) if units else np.zeros(0, dtype=np.int64)
+    rows = np.repeat(np.arange(len(units), dtype=np.int64), lengths)
+    return flat, rows, lengths
+
+
+class TokenCache:
+    """Tokenized strings of one evaluation job, keyed by (tokenizer, string).
+
+    With Chinese text BLEU's 'zh' tokenizer and TER's Chinese pre-tokenization
+    produce the same string, so whichever of the two runs second reuses the
+    other's output, as far as both run in the same process: a job scored
+    in-process shares one cache between its string metrics, while in the pool
+    every worker keeps a cache for the job it last scored a shard of, so BLEU
+    and TER only share the shards a worker happens to get for both. `id`
+    identifies the job to the workers.
+
+    Entries are keyed by a digest of the string, so only the tokenized form is
+    held, and the least recently used ones are dropped beyond `max_bytes`.
+    """
+
+    def __init__(self, max_bytes: int = TOKEN_CACHE_MB * 1024 * 1024):
+        self.id = uuid.uuid4().hex
+        self.max_bytes = max_bytes
+        self._tokens: "OrderedDict[bytes, str]" = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._tokens)
+
+    def tokenize(self, name: str, tokenizer: Callable[[str], str], text: str) -> str:
+        key = hashlib.blake2b(f"{name}\0{text}".encode("utf-8"), digest_size=16).digest()
+        tokens = self._tokens.get(key)
+        if tokens is not None:
+            self._tokens.move_to_end(key)
+            self.hits += 1
+            return tokens
+        tokens = tokenizer(text)
+        self.misses += 1
+        self._tokens[key] = tokens
+        self._bytes += len(key) + sys.getsizeof(tokens)
+        while self._bytes > self.max_bytes and self._tokens:
+            old_key, old_tokens = self._tokens.popitem(last=False)
+            self._bytes -= len(old_key) + sys.getsizeof(old_tokens)
+        return tokens
+
+
+# sacrebleu's '13a' and 'zh' tokenizers with their per-character rules run in C.
+# Their first rule puts spaces around every punctuation character (and matches
+# every space), which re.sub does with one template expansion per match, and
+# the 'zh' tokenizer spaces out Chinese characters in a Python loop. Putting
+# spaces around every match of a one-character pattern is the same as joining
+# the pieces of re.split() on it with spaces, which is what is done here. The
+# output is the same string sacrebleu's tokenizers return.
+_PUNCT_RULE = re.compile(r'([\{-\~\[-\` -\&\(-\+\:-\@\/])')
+_PERIOD_RULES = ((re.compile(r'([^0-9])([\.,])'), r'\1 \2 '), (re.compile(r'([\.,])([^0-9])'), r' \1 \2'))
+_DASH_RULE = re.compile(r'([0-9])(-)')
+_CHINESE = None
+
+
+def _post_tokenize(line: str) -> str:
+    # sacrebleu's TokenizerRegexp
+    line = ' '.join(_PUNCT_RULE.split(line))
+    if '.' in line or ',' in line:
+        for rule, repl in _PERIOD_RULES:
+            line = rule.sub(repl, line)
+    if '-' in line:
+        line = _DASH_RULE.sub(r'\1 \2 ', line)
+    return ' '.join(line.split())
+
+
+def tokenize_13a(line: str) -> str:
+    line = line.replace('<skipped>', '').replace('-\n', '').replace('\n', ' ')
+    if '&' in line:
+        line = line.replace('&quot;', '"').replace('&amp;', '&').replace('&lt;', '<').replace('&gt;', '>')
+    return _post_tokenize(f' {line} ')
+
+
+def tokenize_zh(line: str) -> str:
+    global _CHINESE
+    if _CHINESE is None:
+        from sacrebleu.tokenizers.tokenizer_zh import _UCODE_RANGES
+        # TokenizerZh compares each character with the (start, end) strings of
+        # these ranges; a two-character bound admits the characters after
+        # (start) or up to (end) its first one
+        spans = []
+        for start, end in _UCODE_RANGES:
+            lo = ord(start) if len(start) == 1 else ord(start[0]) + 1
+            hi = ord(end[0])
+            if lo <= hi:
+                spans.append(f'{re.escape(chr(lo))}-{re.escape(chr(hi))}')
+        _CHINESE = re.compile(f"([{''.join(spans)}])")
+    return _post_tokenize(' '.join(_CHINESE.split(line.strip())))
+
+
+def _codepoints(texts: List[str]):
+    # chrF ignores whitespace; every character becomes its code point
+    stripped = [''.join(t.split()) for t in texts]
+    lengths = np.fromiter((len(t) for t in stripped), dtype=np.int64, count=len(stripped))
+    flat = np.frombuffer(''.join(stripped).encode('utf-32-le'), dtype=np.uint32).astype(np.int64)
+    rows = np.repeat(np.arange(len(stripped), dtype=np.int64), lengths)
+    return flat, rows, lengths
+
+
+class StringMetricScorer:
+    """Scores whole columns for one string metric against a fixed reference column.
+
+    References are preprocessed once in `set_references()`, so scoring several
+    target columns against the same reference only tokenizes each of them once.
+    """
+
+    def __init__(self, metric_type: str, tokenize: Optional[str] = None, use_zh: bool = False,
+                 token_cache: Optional[TokenCache] = None):
+        if metric_type not in ('sacrebleu', 'ter', 'chrf'):
+            raise ValueError(f"Unsupported string metric: {metric_type}")
+        self.metric_type = metric_type
+        self.use_zh = use_zh
+        self.token_cache = token_cache if token_cache is not None else TokenCache()
+        self._refs = None
+        self._ref_units = None
+        # BLEU tokens are interned into integer ids shared by all columns
+        self._vocab: Dict[str, int] = defaultdict(count().__next__)
+        self._zh_tokenizer = None
+
+        if metric_type == 'sacrebleu':
+            self.tokenize = tokenize or ('zh' if use_zh else '13a')
+            self._tokenizer = {'13a': tokenize_13a, 'zh': tokenize_zh}.get(self.tokenize) or sacrebleu.BLEU(tokenize=self.tokenize).tokenizer
+        elif metric_type == 'ter':
+            self._tokenizer = sacrebleu.TER().tokenizer
+            if use_zh:
+                self._zh_tokenizer = tokenize_zh
+
+    def _preprocess(self, text: str):
+        cache = self.token_cache
+        if self.metric_type == 'sacrebleu':
+            tokens = cache.tokenize(self.tokenize, self._tokenizer, text.rstrip()).split()
+            return np.fromiter(map(self._vocab.__getitem__, tokens), dtype=np.int64, count=len(tokens))
+        if self.metric_type == 'ter':
+            if self._zh_tokenizer is not None:
+                # TokenizerZh strips the line first, so this is the same string BLEU's 'zh' tokenizer produces
+                text = cache.tokenize('zh', self._zh_tokenizer, text.rstrip())
+            return cache.tokenize('ter', self._tokenizer, text.rstrip()).split()
+        return text
+
+    def _preprocess_column(self, texts: List[str]) -> List:
+        # Tokenize every distinct string of the column exactly once
+        cache = {}
+        out = []
+        for t in texts:
+            if t not in cache:
+                cache[t] = self._preprocess(t)
+            out.append(cache[t])
+        return out
+
+    def set_references(self, refs: List[str]):
+        self._refs = list(refs)
+        # Token ids only need to agree between these references and their hypotheses
+        self._vocab = defaultdict(count().__next__)
+        if self.metric_type == 'sacrebleu':
+            self._ref_units = _flatten(self._preprocess_column(self._refs))
+        elif self.metric_type == 'chrf':
+            self._ref_units = _codepoints(self._refs)
+        else:
+            self._ref_units = self._preprocess_column(self._refs)
+
+    def _ter_stats(self, hyps: List[str]) -> np.ndarray:
+        processed = self._preprocess_column(hyps)
+        stats = np.zeros((len(hyps), 2), dtype=np.int64)
+        # Identical (hyp, ref) pairs share their statistics
+        seen: Dict[tuple, int] = {}
+        for i, key in enumerate(zip(hyps, self._refs)):
+            j = seen.get(key)
+            if j is not None:
+                stats[i] = stats[j]
+                continue
+            seen[key] = i
+            stats[i] = translation_edit_rate(processed[i], self._ref_units[i])
+        return stats
+
+    def compute_stats(self, hyps: List[str]) -> np.ndarray:
+        if self._refs is None:
+            raise ValueError("References must be set before scoring.")
+        if len(hyps) != len(self._refs):
+            raise ValueError("Hypotheses and references must have the same length.")
+
+        if self.metric_type == 'ter':
+            return self._ter_stats(hyps)
+
+        n_rows = len(hyps)
+        ref_ids, ref_rows, ref_len = self._ref_units
+        if self.metric_type == 'sacrebleu':
+            hyp_ids, hyp_rows, hyp_len = _flatten(self._preprocess_column(hyps))
+            correct = _ngram_matches(
+                hyp_ids, hyp_rows, ref_ids, ref_rows, n_rows, BLEU_ORDER, max(len(self._vocab), 1))
+            return np.column_stack([hyp_len, ref_len, correct, _ngram_totals(hyp_len, BLEU_ORDER)])
+
+        hyp_ids, hyp_rows, hyp_len = _codepoints(hyps)
+        correct = _ngram_matches(hyp_ids, hyp_rows, ref_ids, ref_rows, n_rows, CHRF_ORDER, 0x110000)
+        hyp_total = _ngram_totals(hyp_len, CHRF_ORDER)
+        ref_total = _ngram_totals(ref_len, CHRF_ORDER)
+        # sacrebleu does not count hypothesis n-grams of an order the reference lacks
+        hyp_total = np.where(ref_total > 0, hyp_total, 0)
+        return np.stack([hyp_total, ref_total, correct], axis=-1).reshape(n_rows, -1)
+
+    def scores_from_stats(self, stats: np.ndarray, corpus: bool = False) -> np.ndarray:
+        if self.metric_type == 'sacrebleu':
+            # Sentence BLEU uses effective order, corpus BLEU does not (sacrebleu defaults)
+            return bleu_from_stats(stats, effective_order=not corpus)
+        if self.metric_type == 'chrf':
+            return chrf_from_stats(stats)
+        return ter_from_stats(stats)
+
+    def score(self, hyps: List[str], n_bootstrap: int = DEFAULT_BOOTSTRAP) -> Dict:
+        return self.summarize(self.compute_stats(hyps), n_bootstrap)
+
+    def summarize(self, stats: np.ndarray, n_bootstrap: int = DEFAULT_BOOTSTRAP) -> Dict:
+        sentence_scores = self.scores_from_stats(stats)
+        corpus_score = float(self.scores_from_stats(stats.sum(axis=0), corpus=True))
+        ci = bootstrap_ci(stats, lambda s: self.scores_from_stats(s, corpus=True), n_bootstrap)
+        return {
+            "scores": sentence_scores.tolist(),
+            "corpus": corpus_score if math.isfinite(corpus_score) else 0.0,
+            "ci": ci,
+        }
+
+
+# Process-pool execution
+#
+# The statistics of a row only depend on that row, so a column can be split
+# into contiguous shards that are scored in separate processes and
+# concatenated back in order. Workers are spawned rather than forked (the
+# parent may hold torch/CUDA state and threads) and kept alive between jobs, each with one warm scorer per (metric, Chinese)
+# setting so sacrebleu's tokenizer caches survive across shards. The pool is
+# sized once from STRING_METRIC_WORKERS and never resized: concurrent jobs
+# submit shards to it at the same time, and shutting it down under one of
+# them would fail its submits.
+
+# Below this many rows the pickling overhead outweighs the parallel speedup
+MIN_ROWS_PER_SHARD = 2000
+
+_pool = None
+_pool_lock = threading.Lock()
+_worker_scorers: Dict[tuple, StringMetricScorer] = {}
+# Tokenization cache of the job a worker last scored a shard of
+_worker_token_cache: Optional[TokenCache] = None
+
+
+def _worker_stats(metric_type: str, use_zh: bool, refs: List[str], columns: List[List[str]], cache_id: str) -> List[np.ndarray]:
+    global _worker_token_cache
+    if _worker_token_cache is None or _worker_token_cache.id != cache_id:
+        _worker_token_cache = TokenCache()
+        _worker_token_cache.id = cache_id
+    key = (metric_type, use_zh)
+    scorer = _worker_scorers.get(key)
+    if scorer is None:
+        scorer = _worker_scorers[key] = StringMetricScorer(metric_type, use_zh=use_zh)
+    scorer.token_cache = _worker_token_cache
+    scorer.set_references(refs)
+    return [scorer.compute_stats(hyps) for hyps in columns]
+
+
+def get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=resolve_workers(STRING_METRIC_WORKERS),
+                                        mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+
+def shutdown_pool():
+    # Only at exit (and in tests), once no job is scoring
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=True)
+
+
+def resolve_workers(workers: int) -> int:
+    # 0 means one worker per available core
+    if workers <= 0:
+        try:
+            workers = len(os.sched_getaffinity(0))
+        except AttributeError:
+            workers = os.cpu_count() or 1
+    return max(1, workers)
+
+
+def chunk_stats(metric_type: str, chunks: Iterable[Tuple[List[str], Dict[str, List[str]]]], n_rows: int,
+                use_zh: bool = False, workers: int = 1, in_pool: bool = False,
+                token_cache: Optional[TokenCache] = None) -> Iterator[Dict[str, np.ndarray]]:
+    """Statistics of a job scored in chunks: yields {column: stats} for every (refs, columns) chunk, in order.
+
+    With `workers` > 1 and at least MIN_ROWS_PER_SHARD of the job's `n_rows`
+    per worker, or with `in_pool`, the chunks are scored in the process pool,
+    up to `workers` of them at a time; `chunks` is only read as far as that, so
+    only those chunks' strings are held.
+    """
+    workers = min(resolve_workers(workers), max(1, n_rows // MIN_ROWS_PER_SHARD))
+    if token_cache is None:
+        token_cache = TokenCache()
+    if workers == 1 and not in_pool:
+        scorer = StringMetricScorer(metric_type, use_zh=use_zh, token_cache=token_cache)
+        for refs, columns in chunks:
+            scorer.set_references(refs)
+            yield {name: scorer.compute_stats(hyps) for name, hyps in columns.items()}
+        return
+
+    pool = get_pool()
+    pending = deque()
+    try:
+        for refs, columns in chunks:
+            names = list(columns)
+            pending.append((names, pool.submit(_worker_stats, metric_type, use_zh, refs, [columns[name] for name in names], token_cache.id)))
+            if len(pending) >= workers:
+                names, future = pending.popleft()
+                yield dict(zip(names, future.result()))
+        while pending:
+            names, future = pending.popleft()
+            yield dict(zip(names, future.result()))
+    finally:
+        # The job stopped early (cancelled or failed)
+        for _, future in pending:
+            future.cancel()
+
+
+def summarize(metric_type: str, stats: Dict[str, np.ndarray], n_bootstrap: int = DEFAULT_BOOTSTRAP) -> Dict[str, Dict]:
+    """`StringMetricScorer.summarize()` of every column's statistics, keyed by column name."""
+    # Only the score functions are used: no tokenizer settings needed
+    scorer = StringMetricScorer(metric_type)
+    return {name: scorer.summarize(column, n_bootstrap) for name, column in stats.items()}
+
+
+def score_columns(metric_type: str, refs: List[str], columns: Dict[str, List[str]], use_zh: bool = False,
+                  workers: int = 1, n_bootstrap: int = DEFAULT_BOOTSTRAP, in_pool: bool = False,
+                  token_cache: Optional[TokenCache] = None) -> Dict[str, Dict]:
+    """Score several target columns against one reference column.
+
+    With `workers` > 1 and enough rows, the rows are split into up to `workers`
+    shards scored in the process pool; every shard scores all columns so each worker tokenizes its slice of
+    the references once. With `in_pool` even a single shard is scored in the
+    pool, keeping this process free (e.g. for a neural metric running at the
+    same time). Passing the job's `token_cache` to every metric of a job lets
+    them share tokenized strings when they are scored in this process (see
+    TokenCache for the pool). Returns `StringMetricScorer.summarize()` results keyed by column
+    name, in the order of `columns`.
+    """
+    n_rows = len(refs)
+    workers = min(resolve_workers(workers), max(1, n_rows // MIN_ROWS_PER_SHARD))
+    bounds = np.linspace(0, n_rows, workers + 1).astype(int)
+    shards = list(chunk_stats(metric_type, ((refs[lo:hi], {name: hyps[lo:hi] for name, hyps in columns.items()})
+                                            for lo, hi in zip(bounds[:-1], bounds[1:])),
+                              n_rows, use_zh, workers, in_pool, token_cache))
+    return summarize(metric_type, {name: np.concatenate([shard[name] for shard in shards]) for name in columns}, n_bootstrap)
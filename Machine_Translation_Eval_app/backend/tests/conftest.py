@@ -0,0 +1,13 @@
+import os
+import sys
+import tempfile
+
+# The backend modules are imported as top-level modules, as main.py does
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+# Sample sheet shipped with the app (English source, Chinese reference and two MT columns)
+SAMPLE_XLSX = os.path.join(BACKEND_DIR, "uploads", "Goodall.en-zh_ref-zh_mtfs-zh_mt0s.xlsx")
+
+# config.py paths are relative to the working directory: keep the caches,
+# calibration and checkpoints the modules create out of the real uploads/
+os.chdir(tempfile.mkdtemp(prefix="mteval-tests-"))
@@ -0,0 +1,114 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import evaluator as evaluator_module
+import metrics
+import string_metrics
+from evaluator import Evaluator
+
+CHUNK_ROWS = 10
+
+
+class FakeNeuralMetric(metrics.Metric):
+    # Deterministic per-segment scores, failing once `fail_after` segments were scored
+    type = "fake-neural"
+    batchable = True
+    uses_ref = False
+
+    def __init__(self, key, config):
+        super().__init__(key, config)
+        self.scored = 0
+        self.fail_after = None
+
+    def load(self, progress_callback=None):
+        return "fake-model"
+
+    def score_batch(self, model, srcs, mts, refs, rows, batch_size):
+        if self.fail_after is not None and self.scored + len(rows) > self.fail_after:
+            raise RuntimeError("simulated crash")
+        self.scored += len(rows)
+        return [(len(mts[i]) * 7 + len(srcs[i])) % 100 / 100 for i in rows]
+
+
+def make_evaluator():
+    evaluator = Evaluator()
+    evaluator.score_cache = None
+    evaluator.micro_batch_wait = 0
+    config = {"type": FakeNeuralMetric.type, "model_name": "fake", "memory_mb": 1}
+    evaluator.model_configs = {**evaluator.model_configs, "fake": config}
+    evaluator._metrics["fake"] = FakeNeuralMetric("fake", config)
+    # No calibration run: it would count towards the scored segments
+    evaluator.calibration.has = lambda metric_type: True
+    return evaluator
+
+
+@pytest.fixture
+def job(monkeypatch, tmp_path):
+    monkeypatch.setattr(evaluator_module, "CHECKPOINT_CHUNK_ROWS", CHUNK_ROWS)
+    rng = np.random.default_rng(0)
+    n_rows = 95
+    words = ["alpha", "beta", "gamma", "delta", "epsilon", "zeta"]
+
+    def sentences():
+        return [" ".join(rng.choice(words, rng.integers(1, 12))) for _ in range(n_rows)]
+
+    df = pd.DataFrame({"src": sentences(), "ref": sentences(), "a": sentences(), "b": sentences()})
+    # Duplicates across columns and rows are scored once
+    df.loc[::3, "b"] = df.loc[::3, "a"]
+    yield df, str(tmp_path / "checkpoint")
+    string_metrics.shutdown_pool()
+
+
+def run(evaluator, df, checkpoint_dir=None):
+    return evaluator.evaluate(df, "src", ["a", "b"], ["fake", "chrf"], "ref", progress_callback=lambda message: None,
+                              checkpoint_dir=checkpoint_dir)
+
+
+def test_resume_gives_the_same_scores(job):
+    df, checkpoint_dir = job
+    expected = run(make_evaluator(), df)
+    unique = len(set(zip(df["src"], df["a"])) | set(zip(df["src"], df["b"])))
+
+    crashing = make_evaluator()
+    crashing._metrics["fake"].fail_after = unique // 2
+    with pytest.raises(RuntimeError):
+        run(crashing, df, checkpoint_dir)
+    saved = [name for name in os.listdir(os.path.join(checkpoint_dir, "fake")) if name.startswith("chunk-")]
+    assert saved
+
+    resumed = make_evaluator()
+    result = run(resumed, df, checkpoint_dir)
+    # Only the segments of the chunks that were not saved are scored again
+    assert 0 < resumed._metrics["fake"].scored < unique
+    assert crashing._metrics["fake"].scored + resumed._metrics["fake"].scored >= unique
+    pd.testing.assert_frame_equal(result, expected)
+    for column, corpus in expected.attrs["corpus_scores"].items():
+        assert result.attrs["corpus_scores"][column]["corpus"] == pytest.approx(corpus["corpus"])
+
+
+def test_checkpoint_of_other_inputs_is_discarded(job):
+    df, checkpoint_dir = job
+    run(make_evaluator(), df, checkpoint_dir)
+    changed = df.copy()
+    changed.loc[0, "a"] = "something else"
+    again = make_evaluator()
+    result = run(again, changed, checkpoint_dir)
+    # Every segment is scored again (once per chunk it occurs in)
+    expected = sum(len(set(zip(part["src"], part["a"])) | set(zip(part["src"], part["b"])))
+                   for part in (changed.iloc[start:start + CHUNK_ROWS] for start in range(0, len(changed), CHUNK_ROWS)))
+    assert again._metrics["fake"].scored == expected
+    pd.testing.assert_frame_equal(result, run(make_evaluator(), changed))
+
+
+def test_chunks_give_the_scores_of_one_pass(job, monkeypatch):
+    df, checkpoint_dir = job
+    chunked = run(make_evaluator(), df, checkpoint_dir)
+    # The string metric's statistics are saved per chunk
+    assert len([name for name in os.listdir(os.path.join(checkpoint_dir, "chrf")) if name.startswith("stats-")]) == 10
+    monkeypatch.setattr(evaluator_module, "CHECKPOINT_CHUNK_ROWS", len(df))
+    whole = run(make_evaluator(), df)
+    pd.testing.assert_frame_equal(chunked, whole)
+    assert chunked.attrs["corpus_scores"] == whole.attrs["corpus_scores"]
@@ -0,0 +1,43 @@
+import os
+import threading
+
+import pandas as pd
+
+import export
+
+
+def frame(value):
+    return pd.DataFrame({"src": ["a", "b"], "score": [value, value]})
+
+
+def test_jobs_on_the_same_upload_keep_their_own_results(tmp_path):
+    directory = str(tmp_path)
+    threads = [threading.Thread(target=export.write_results, args=(frame(float(i)), directory, export.results_basename(f"job{i}")))
+               for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for i in range(4):
+        path = os.path.join(directory, f"results_job{i}.xlsx")
+        export.ensure(path)
+        assert pd.read_parquet(os.path.join(directory, f"results_job{i}.parquet"))["score"].tolist() == [i, i]
+        assert pd.read_excel(path)["score"].tolist() == [i, i]
+    # No temporary files are left behind
+    assert sorted(os.listdir(directory)) == sorted(f"results_job{i}{ext}" for i in range(4) for ext in (".parquet", ".csv", ".xlsx"))
+
+
+def test_concurrent_builds_of_one_file(tmp_path):
+    # e.g. the model server and an API worker both building a job's workbook
+    path = str(tmp_path / "results_job.xlsx")
+    threads = [threading.Thread(target=export._write_atomic, args=(export.EXPORTERS["xlsx"], frame(1.0), path)) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert pd.read_excel(path)["score"].tolist() == [1.0, 1.0]
+    assert os.listdir(tmp_path) == ["results_job.xlsx"]
+
+
+def test_download_name():
+    assert export.download_name("Goodall.en-zh.xlsx", ".csv") == "results_Goodall.en-zh.csv"
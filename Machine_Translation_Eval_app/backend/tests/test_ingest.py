@@ -0,0 +1,47 @@
+import os
+
+import openpyxl
+import pandas as pd
+import pyarrow.parquet as pq
+
+import ingest
+
+
+def sheet(path):
+    # "num" turns from integers to floats and "mix" from numbers to text after the first batches
+    workbook = openpyxl.Workbook()
+    ws = workbook.active
+    ws.append(["src", None, "num", "mix", "src", "blank"])
+    for i in range(25):
+        ws.append([f"s{i}", i, i if i < 12 else i + 0.5, i if i < 20 else f"t{i}", "x", None])
+    ws.append([None] * 6)
+    ws.append(["last"])
+    workbook.save(path)
+
+
+def test_xlsx_is_written_in_batches(tmp_path, monkeypatch):
+    monkeypatch.setattr(ingest, "XLSX_BATCH_ROWS", 10)
+    path = str(tmp_path / "sheet.xlsx")
+    sheet(path)
+    columns, n_rows = ingest.to_parquet(path, str(tmp_path / "sheet.parquet"))
+    assert columns == ["src", "Unnamed: 1", "num", "mix", "src.1", "blank"]
+    assert n_rows == 26
+    # Only the Parquet file is left: the parts written before a column got wider are removed
+    assert sorted(os.listdir(tmp_path)) == ["sheet.parquet", "sheet.xlsx"]
+    assert pq.ParquetFile(str(tmp_path / "sheet.parquet")).metadata.num_rows == 26
+
+    df = ingest.parse(path)
+    assert df["num"].dtype == "float64"
+    assert df["num"].tolist()[10:14] == [10.0, 11.0, 12.5, 13.5]
+    assert df["mix"].tolist()[18:22] == ["18", "19", "t20", "t21"]
+    assert df["blank"].isna().all()
+    assert df.iloc[-1].isna().tolist() == [False] + [True] * 5
+
+
+def test_load_writes_and_reuses_the_cache(tmp_path):
+    path = str(tmp_path / "sheet.xlsx")
+    sheet(path)
+    df = ingest.load(path)
+    assert os.path.exists(ingest.cache_path(path))
+    assert ingest.scan(path) == (df.columns.tolist(), len(df))
+    pd.testing.assert_frame_equal(ingest.load(path), df)
@@ -0,0 +1,84 @@
+import numpy as np
+import pandas as pd
+
+from job_inputs import JobInputs, UniqueSegments
+
+
+def frame():
+    # Row 1 repeats row 0; "b" agrees with "a" on rows 0, 1 and 3
+    return pd.DataFrame({
+        "src": ["s0", "s0", "s2", "s3"],
+        "ref": ["r0", "r0", "r2", "r3"],
+        "a": ["m0", "m0", "m2", "m3"],
+        "b": ["m0", "m0", "x2", "m3"],
+    })
+
+
+def test_unique_segments_deduplicate():
+    inputs = JobInputs(frame(), "src", ["a", "b"], "ref")
+    segments = inputs.unique_segments(use_src=True, use_ref=True)
+    assert len(segments) == 4
+    assert segments.n_segments == 8
+    assert segments.duplicate_ratio == 0.5
+    # Every row's segment holds that row's fields
+    for col, positions in segments.positions.items():
+        for i, j in enumerate(positions):
+            assert (segments.srcs[j], segments.mts[j], segments.refs[j]) == (inputs.src[i], inputs.mt[col][i], inputs.ref[i])
+
+
+def test_ignored_fields_are_not_part_of_the_segment():
+    df = frame()
+    df["b"] = ["m0", "m9", "m2", "m3"]
+    df.loc[1, "ref"] = "other"
+    # Without the reference, rows 0 and 1 of "a" are the same segment
+    segments = JobInputs(df, "src", ["a", "b"], "ref").unique_segments(use_src=True, use_ref=False)
+    assert segments.refs == [None] * len(segments)
+    assert segments.positions["a"][0] == segments.positions["a"][1]
+
+
+def test_gather_scatter_round_trip():
+    rng = np.random.default_rng(0)
+    n_rows = 200
+    # Few distinct strings, so most segments repeat within and across columns
+    mt = {col: [f"m{v}" for v in rng.integers(0, 20, n_rows)] for col in ("a", "b", "c")}
+    srcs = [f"s{v}" for v in rng.integers(0, 3, n_rows)]
+    segments = UniqueSegments(srcs, mt, None, n_rows)
+    assert len(segments) < 3 * n_rows
+
+    # A score that depends only on the segment, computed per row and column
+    per_row = {col: np.array([hash((s, m)) % 1000 for s, m in zip(srcs, mts)], dtype=np.float64) for col, mts in mt.items()}
+    unique_scores = segments.gather(per_row)
+    assert len(unique_scores) == len(segments)
+    scattered = segments.scatter(unique_scores.tolist())
+    assert list(scattered) == list(mt)
+    for col in mt:
+        assert scattered[col] == per_row[col].tolist()
+
+
+def test_first_rows():
+    segments = JobInputs(frame(), "src", ["a", "b"], "ref").unique_segments(use_src=True, use_ref=True)
+    first = segments.first_rows()
+    for col, positions in segments.positions.items():
+        for i, j in enumerate(positions):
+            assert first[j] <= i
+    assert sorted(first.tolist()) == [0, 2, 2, 3]
+
+
+def test_multi_reference_segments():
+    df = frame()
+    df["ref2"] = ["q0", "q1", "q2", "q3"]
+    inputs = JobInputs(df, "src", ["a"], "ref", ["ref2"])
+    segments = inputs.unique_segments(use_src=False, use_ref=True, multi_ref=True)
+    # Rows 0 and 1 differ in their second reference
+    assert len(segments) == 4
+    assert segments.refs[0] == ("r0", "q0")
+    assert inputs.all_refs() == ["r0", "q0", "r0", "q1", "r2", "q2", "r3", "q3"]
+
+
+def test_target_columns_named_like_fields():
+    # Target columns called "src" and "ref" are not confused with the source and reference
+    df = pd.DataFrame({"source": ["a b c d e f"], "reference": ["一二三"], "src": ["x"], "ref": ["y y"]})
+    inputs = JobInputs(df, "source", ["src", "ref"], "reference")
+    assert inputs.token_lengths("src").tolist() != inputs.token_lengths("mt", "src").tolist()
+    assert inputs.token_lengths("ref").tolist() != inputs.token_lengths("mt", "ref").tolist()
+    assert inputs.contains_chinese("ref") and not inputs.contains_chinese("mt", "ref")
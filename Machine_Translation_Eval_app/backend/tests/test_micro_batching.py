@@ -0,0 +1,52 @@
+import threading
+import time
+
+from micro_batching import MicroBatcher
+
+
+class RecordingMetric:
+    # Scores a row with its mt value and records the rows of every model call
+    def __init__(self):
+        self.calls = []
+
+    def batch_key(self, refs):
+        return refs is None
+
+    def score_requests(self, model, requests, batch_size):
+        self.calls.append(sum(len(rows) for *_, rows in requests))
+        return [[mts[i] for i in rows] for _, mts, _, rows in requests]
+
+
+def submit_all(batcher, jobs, batch_size):
+    results = [None] * len(jobs)
+
+    def run(k, mts):
+        results[k] = batcher.score(None, mts, mts, None, list(range(len(mts))), batch_size)
+
+    threads = []
+    for k, mts in enumerate(jobs):
+        threads.append(threading.Thread(target=run, args=(k, mts)))
+        threads[-1].start()
+        # Arrive in order
+        time.sleep(0.01)
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_batches_never_exceed_the_batch_size():
+    metric = RecordingMetric()
+    batcher = MicroBatcher("fake", metric, max_wait=0.2)
+    jobs = [[float(100 * k + i) for i in range(5)] for k in range(3)]
+    results = submit_all(batcher, jobs, batch_size=8)
+    # Each job gets its own scores in row order, also the one split across two calls
+    assert results == jobs
+    assert metric.calls == [8, 7]
+
+
+def test_an_oversized_first_request_is_taken_whole():
+    metric = RecordingMetric()
+    batcher = MicroBatcher("fake", metric, max_wait=0.2)
+    jobs = [[float(i) for i in range(12)], [1.0, 2.0]]
+    assert submit_all(batcher, jobs, batch_size=8) == jobs
+    assert metric.calls[0] == 12
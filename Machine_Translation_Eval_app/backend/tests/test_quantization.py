@@ -0,0 +1,54 @@
+import os
+
+import pytest
+
+import quantization
+from conftest import SAMPLE_XLSX
+
+torch = pytest.importorskip("torch")
+
+CONFIG = {"type": "comet", "model_name": "Org/some-model"}
+
+
+def module(seed=0):
+    torch.manual_seed(seed)
+    return torch.nn.Sequential(torch.nn.Linear(8, 8), torch.nn.ReLU(), torch.nn.Linear(8, 1))
+
+
+def test_check_segments_are_the_sample_rows():
+    srcs, mts, refs = quantization.check_segments(SAMPLE_XLSX, n=None)
+    # 13 rows x 2 translation columns, source and reference repeated per column
+    assert len(srcs) == len(mts) == len(refs) == 26
+    assert srcs[0].startswith("It was the telegram exchange")
+    assert srcs[13] == srcs[0] and refs[13] == refs[0] and mts[13] != mts[0]
+    assert len(quantization.check_segments(SAMPLE_XLSX, n=10)[0]) == 10
+    assert quantization.check_segments(os.path.join(os.path.dirname(SAMPLE_XLSX), "missing.xlsx")) is None
+
+
+def test_artifact_round_trip(tmp_path):
+    path = quantization.artifact_path(str(tmp_path), CONFIG)
+    int8 = quantization.quantize(module())
+    quantization.save_artifact(path, int8, CONFIG, (["s"], ["m"], ["r"]), [0.5])
+
+    saved = quantization.load_artifact(path, CONFIG)
+    assert saved["check"] == {"srcs": ["s"], "mts": ["m"], "refs": ["r"], "scores": [0.5]}
+    # A fresh float model converted in place takes the saved int8 weights
+    loaded = quantization.quantize(module(seed=1), inplace=True)
+    loaded.load_state_dict(saved["state_dict"])
+    x = torch.randn(4, 8)
+    assert torch.equal(loaded(x), int8(x))
+
+
+def test_artifact_of_other_versions_or_models_is_ignored(tmp_path, monkeypatch):
+    path = quantization.artifact_path(str(tmp_path), CONFIG)
+    quantization.save_artifact(path, quantization.quantize(module()), CONFIG, ([], [], []), [])
+    assert quantization.load_artifact(path, {**CONFIG, "model_name": "Org/other-model"}) is None
+    monkeypatch.setattr(quantization, "library_versions", lambda: {"torch": "0.0"})
+    assert quantization.load_artifact(path, CONFIG) is None
+
+
+def test_pickled_modules_are_not_loaded(tmp_path):
+    # Files that need unpickling arbitrary objects (the old artifact format) are refused
+    path = quantization.artifact_path(str(tmp_path), CONFIG)
+    torch.save(quantization.quantize(module()), path)
+    assert quantization.load_artifact(path, CONFIG) is None
@@ -0,0 +1,99 @@
+import json
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from job_queue import JobStore
+from results_store import ResultsStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = ResultsStore(str(tmp_path / "results"))
+    df = pd.DataFrame({
+        "src": [f"s{i}" for i in range(10)],
+        "mt": [f"m{i}" for i in range(10)],
+        "comet_mt": [0.5, 0.9, np.nan, 0.1, 0.7, 0.3, 0.9, 0.2, 0.8, 0.4],
+        "chrf_mt": [50.0, 90.0, 40.0, 10.0, 70.0, 30.0, 95.0, 20.0, 80.0, 45.0],
+    })
+    df.attrs["corpus_scores"] = {"chrf_mt": {"corpus": 53.0, "ci": [40.0, 60.0]}}
+    store.save("job", df, ["comet_mt", "chrf_mt"])
+    return store
+
+
+def test_summary(store):
+    summary = store.summary("job")
+    assert summary["total_rows"] == 10
+    assert summary["score_columns"] == ["comet_mt", "chrf_mt"]
+    assert summary["aggregates"]["comet_mt"]["count"] == 9
+    assert summary["aggregates"]["chrf_mt"]["mean"] == pytest.approx(53.0)
+    assert sum(summary["aggregates"]["chrf_mt"]["histogram"]["counts"]) == 10
+    assert summary["corpus_scores"]["chrf_mt"]["corpus"] == 53.0
+
+
+def test_pages(store):
+    total, rows = store.page("job", offset=0, limit=4)
+    assert total == 10
+    assert [r["_row"] for r in rows] == [0, 1, 2, 3]
+    total, rows = store.page("job", offset=8, limit=4)
+    assert [r["_row"] for r in rows] == [8, 9]
+    assert rows[0]["mt"] == "m8"
+    # Missing scores come back as null
+    _, rows = store.page("job", offset=2, limit=1)
+    assert rows[0]["comet_mt"] is None
+
+
+def test_sort(store):
+    _, rows = store.page("job", sort="comet_mt")
+    assert [r["_row"] for r in rows] == [3, 7, 5, 9, 0, 4, 8, 1, 6, 2]
+    # Stable for ties, missing scores last in either direction
+    _, rows = store.page("job", sort="comet_mt", descending=True)
+    assert [r["_row"] for r in rows] == [1, 6, 8, 4, 0, 9, 5, 7, 3, 2]
+    _, rows = store.page("job", offset=1, limit=2, sort="chrf_mt", descending=True)
+    assert [r["_row"] for r in rows] == [1, 8]
+
+
+def test_filter(store):
+    total, rows = store.page("job", filters={"comet_mt": (0.3, 0.8)})
+    assert total == 5
+    assert [r["_row"] for r in rows] == [0, 4, 5, 8, 9]
+    total, rows = store.page("job", filters={"comet_mt": (None, 0.5), "chrf_mt": (30.0, None)}, sort="chrf_mt")
+    assert [r["_row"] for r in rows] == [5, 9, 0]
+    assert total == 3
+
+
+def test_unknown_column(store):
+    with pytest.raises(KeyError):
+        store.page("job", sort="bleu_mt")
+    with pytest.raises(KeyError):
+        store.page("job", filters={"bleu_mt": (0, 1)})
+
+
+def test_series_and_delete(store):
+    series = store.series("job", "comet_mt", points=4)
+    assert series["rows"] == [0, 3, 6, 9]
+    assert series["values"] == [0.5, 0.1, 0.9, 0.4]
+    store.delete("job")
+    assert not store.exists("job")
+
+
+def test_concurrent_migrations_of_old_results(tmp_path):
+    # Rows of jobs finished before the results store existed, read by several requests at once
+    job_store = JobStore(str(tmp_path / "jobs.sqlite3"))
+    conn = job_store._connect()
+    conn.executemany("INSERT INTO job_results (job_id, row, data) VALUES (?, ?, ?)",
+                     [("old", i, json.dumps({"src": f"s{i}", "chrf_mt": float(i)})) for i in range(2000)])
+    conn.commit()
+
+    totals = []
+    threads = [threading.Thread(target=lambda: totals.append(job_store.summary("old")["total_rows"])) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert totals == [2000] * 8
+    assert job_store.frame("old")["chrf_mt"].tolist() == [float(i) for i in range(2000)]
+    assert sorted(os.listdir(tmp_path / "results")) == ["old.parquet", "old.summary.json"]
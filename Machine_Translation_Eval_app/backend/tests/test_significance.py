@@ -0,0 +1,86 @@
+from itertools import product
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from significance import bootstrap_means, compare_systems, paired_tests
+
+# Segment scores of three systems on one metric: "a" is better than "b" on
+# almost every segment, "c" is "a" with two segments swapped around
+A = np.array([0.81, 0.75, 0.92, 0.66, 0.88, 0.79, 0.71, 0.95, 0.84, 0.77])
+B = np.array([0.62, 0.70, 0.81, 0.52, 0.85, 0.64, 0.69, 0.80, 0.71, 0.78])
+C = np.array([0.75, 0.81, 0.92, 0.66, 0.88, 0.79, 0.71, 0.95, 0.84, 0.77])
+
+
+def exact_randomization_p(a, b):
+    # Every one of the 2^n swaps of the paired scores
+    diffs = a - b
+    observed = abs(diffs.mean())
+    stats = [abs((np.array(signs) * diffs).mean()) for signs in product((1, -1), repeat=len(diffs))]
+    return np.mean(np.array(stats) >= observed - 1e-12)
+
+
+def test_means_and_deltas():
+    tests = paired_tests(np.stack([[A, B, C]]), n_bootstrap=0, n_trials=0)
+    assert tests["pairs"].tolist() == [[0, 1], [0, 2], [1, 2]]
+    assert tests["mean"][0] == pytest.approx([A.mean(), B.mean(), C.mean()])
+    assert tests["delta"][0] == pytest.approx([A.mean() - B.mean(), 0.0, B.mean() - C.mean()])
+    assert "ci" not in tests and "p_randomization" not in tests
+
+
+def test_randomization_matches_exact_test():
+    tests = paired_tests(np.stack([[A, B, C]]), n_bootstrap=0, n_trials=20000, seed=1)
+    assert tests["p_randomization"][0, 0] == pytest.approx(exact_randomization_p(A, B), abs=0.005)
+    assert tests["p_randomization"][0, 2] == pytest.approx(exact_randomization_p(B, C), abs=0.005)
+    # The same mean: no evidence of a difference
+    assert tests["p_randomization"][0, 1] == 1.0
+
+
+def test_bootstrap():
+    tests = paired_tests(np.stack([[A, B, C]]), n_bootstrap=2000, n_trials=0, seed=1)
+    for s, scores in enumerate((A, B, C)):
+        low, high = tests["ci"][0, s]
+        assert low < scores.mean() < high
+    low, high = tests["delta_ci"][0, 0]
+    assert 0 < low < A.mean() - B.mean() < high
+    assert tests["p_bootstrap"][0, 0] < 0.01
+    assert tests["p_bootstrap"][0, 1] > 0.5
+
+
+def test_bootstrap_means_are_seeded():
+    scores = np.column_stack([A, B])
+    first = bootstrap_means(scores, 100, np.random.default_rng(3))
+    assert first.shape == (100, 2)
+    assert np.array_equal(first, bootstrap_means(scores, 100, np.random.default_rng(3)))
+    # Resampled means stay within the range of the segment scores
+    assert (first >= scores.min(axis=0)).all() and (first <= scores.max(axis=0)).all()
+
+
+def test_compare_systems():
+    df = pd.DataFrame({"comet_a": A, "comet_b": B, "chrf_a": A * 100, "chrf_b": B * 100})
+    # A segment without every score is left out
+    df.loc[10] = [np.nan, 0.5, 50.0, 50.0]
+    report = compare_systems(df, ["a", "b"], ["comet", "chrf"], n_bootstrap=500, n_trials=500, seed=0)
+    assert report["segments"] == 10
+    assert report["systems"]["comet"]["a"]["mean"] == pytest.approx(A.mean())
+    assert report["systems"]["chrf"]["b"]["mean"] == pytest.approx(B.mean() * 100)
+    assert [(p["metric"], p["a"], p["b"]) for p in report["pairs"]] == [("comet", "a", "b"), ("chrf", "a", "b")]
+    comet, chrf = report["pairs"]
+    assert comet["delta"] * 100 == pytest.approx(chrf["delta"])
+    for pair in report["pairs"]:
+        assert pair["delta_ci"][0] > 0
+        assert pair["p_bootstrap"] < 0.05 and pair["p_randomization"] < 0.05
+
+
+def test_compare_systems_missing_column():
+    with pytest.raises(KeyError):
+        compare_systems(pd.DataFrame({"comet_a": A}), ["a", "b"], ["comet"])
+
+
+def test_compare_systems_without_segments():
+    # An empty job, or one where no segment was scored for both systems
+    for df in (pd.DataFrame({"comet_a": [], "comet_b": []}),
+               pd.DataFrame({"comet_a": [0.5, np.nan], "comet_b": [np.nan, 0.5]})):
+        with pytest.raises(ValueError):
+            compare_systems(df, ["a", "b"], ["comet"])
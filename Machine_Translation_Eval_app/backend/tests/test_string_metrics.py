@@ -0,0 +1,136 @@
+import threading
+
+import pytest
+import sacrebleu
+
+import ingest
+import string_metrics
+from conftest import SAMPLE_XLSX
+from string_metrics import StringMetricScorer, TokenCache, score_columns
+
+ENGLISH = {
+    "ref": ["The cat sat on the mat.", "It is raining today.", "He went home early", "", "A b c d e f g"],
+    "mt": ["The cat sat on a mat.", "Today it rains.", "He went home early", "Something", "a b c d e f g"],
+}
+
+
+@pytest.fixture(scope="module")
+def sample():
+    df = ingest.parse(SAMPLE_XLSX)
+    return df["zh_ref"].tolist(), {"zh_mtfs": df["zh_mtfs"].tolist(), "zh_mt0s": df["zh_mt0s"].tolist()}
+
+
+def sentences(sample):
+    # Character-level TER of whole paragraphs takes minutes: first sentences only
+    refs, columns = sample
+    return [t.split("。")[0] for t in refs], {name: [t.split("。")[0] for t in hyps] for name, hyps in columns.items()}
+
+
+def expected(metric_type, hyps, refs, use_zh):
+    # sacrebleu's own sentence and corpus scores, with the settings the scorer uses
+    if metric_type == "sacrebleu":
+        tokenize = "zh" if use_zh else "13a"
+        sentence = [sacrebleu.sentence_bleu(h, [r], tokenize=tokenize).score for h, r in zip(hyps, refs)]
+        corpus = sacrebleu.corpus_bleu(hyps, [refs], tokenize=tokenize).score
+    elif metric_type == "chrf":
+        sentence = [sacrebleu.sentence_chrf(h, [r]).score for h, r in zip(hyps, refs)]
+        corpus = sacrebleu.corpus_chrf(hyps, [refs]).score
+    else:
+        sentence = [sacrebleu.sentence_ter(h, [r]).score for h, r in zip(hyps, refs)]
+        corpus = sacrebleu.corpus_ter(hyps, [refs]).score
+    return sentence, corpus
+
+
+@pytest.mark.parametrize("metric_type", ["sacrebleu", "ter", "chrf"])
+def test_matches_sacrebleu_english(metric_type):
+    scorer = StringMetricScorer(metric_type)
+    scorer.set_references(ENGLISH["ref"])
+    result = scorer.score(ENGLISH["mt"], n_bootstrap=0)
+    sentence, corpus = expected(metric_type, ENGLISH["mt"], ENGLISH["ref"], use_zh=False)
+    assert result["scores"] == pytest.approx(sentence, abs=1e-6)
+    assert result["corpus"] == pytest.approx(corpus, abs=1e-6)
+
+
+def test_tokenizers_match_sacrebleu(sample):
+    from sacrebleu.tokenizers.tokenizer_13a import Tokenizer13a
+    from sacrebleu.tokenizers.tokenizer_zh import TokenizerZh
+    refs, columns = sample
+    tricky = ["3.", ".5", "-1", "a-", "1,000.5", "x,y", "&amp;&lt;b&gt; &quot;", "<skipped> a-\nb\nc", " 中文,a.1 ",
+              "\U00020000\u3400\u4db5\u9fa6。", "e.g. (U.S.) 'quote' $5-6 {x}[y]"]
+    for text in ENGLISH["ref"] + ENGLISH["mt"] + refs + columns["zh_mtfs"] + tricky:
+        assert string_metrics.tokenize_13a(text) == Tokenizer13a()(text)
+        assert string_metrics.tokenize_zh(text) == TokenizerZh()(text)
+
+
+@pytest.mark.parametrize("metric_type", ["sacrebleu", "chrf"])
+def test_matches_sacrebleu_chinese(sample, metric_type):
+    refs, columns = sample
+    results = score_columns(metric_type, refs, columns, use_zh=True, n_bootstrap=0)
+    for name, hyps in columns.items():
+        sentence, corpus = expected(metric_type, hyps, refs, use_zh=True)
+        assert results[name]["scores"] == pytest.approx(sentence, abs=1e-6)
+        assert results[name]["corpus"] == pytest.approx(corpus, abs=1e-6)
+
+
+def test_ter_chinese_uses_zh_tokens(sample):
+    # TER of Chinese text is computed on the 'zh' tokenization BLEU uses
+    refs, columns = sentences(sample)
+    tokenizer = sacrebleu.BLEU(tokenize="zh").tokenizer
+    results = score_columns("ter", refs, columns, use_zh=True, n_bootstrap=0)
+    for name, hyps in columns.items():
+        sentence, corpus = expected("ter", [tokenizer(h.rstrip()) for h in hyps], [tokenizer(r.rstrip()) for r in refs], use_zh=False)
+        assert results[name]["scores"] == pytest.approx(sentence, abs=1e-6)
+        assert results[name]["corpus"] == pytest.approx(corpus, abs=1e-6)
+
+
+def test_shared_token_cache(sample):
+    # BLEU and TER of a Chinese job tokenize each string once between them
+    refs, columns = sentences(sample)
+    cache = TokenCache()
+    score_columns("sacrebleu", refs, columns, use_zh=True, n_bootstrap=0, token_cache=cache)
+    misses = cache.misses
+    score_columns("ter", refs, columns, use_zh=True, n_bootstrap=0, token_cache=cache)
+    assert cache.hits >= misses
+
+
+def test_token_cache_is_bounded():
+    cache = TokenCache(max_bytes=2000)
+    for i in range(200):
+        assert cache.tokenize("zh", lambda text: " ".join(text), f"segment {i}") == " ".join(f"segment {i}")
+    assert 0 < len(cache) < 200
+    # The most recent strings are kept
+    cache.tokenize("zh", lambda text: "recomputed", "segment 199")
+    assert cache.hits == 1
+
+
+def test_bootstrap_ci_contains_corpus_score():
+    scorer = StringMetricScorer("chrf")
+    scorer.set_references(ENGLISH["ref"] * 20)
+    result = scorer.score(ENGLISH["mt"] * 20, n_bootstrap=200)
+    low, high = result["ci"]
+    assert low <= result["corpus"] <= high
+
+
+def test_concurrent_jobs_share_the_pool():
+    # Jobs asking for different shard counts at once all score in the one pool
+    results, errors = {}, []
+
+    def run(workers):
+        try:
+            results[workers] = score_columns("chrf", ENGLISH["ref"], {"mt": ENGLISH["mt"]}, workers=workers, n_bootstrap=0, in_pool=True)
+        except Exception as e:
+            errors.append(e)
+
+    try:
+        threads = [threading.Thread(target=run, args=(workers,)) for workers in (1, 2, 4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        string_metrics.shutdown_pool()
+    assert not errors
+    sentence, _ = expected("chrf", ENGLISH["mt"], ENGLISH["ref"], use_zh=False)
+    assert len(results) == 3
+    for result in results.values():
+        assert result["mt"]["scores"] == pytest.approx(sentence, abs=1e-6)
@@ -0,0 +1,142 @@
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from typing import BinaryIO, Dict, List, Optional
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import ingest
+
+# Uploads, stored by content.
+#
+# An upload is copied into <directory>/<sha256>/ with its SHA-256 computed
+# while it is copied, so identical files are stored and parsed once however
+# often and under whatever names they are uploaded, and a new file never
+# replaces one a running job is reading. Next to the original, every upload
+# has its parsed rows as an uncompressed Arrow IPC file (data.arrow) and its
+# columns and row count (meta.json). Jobs open data.arrow memory-mapped: the
+# frame is a zero-copy view of the file, so concurrent jobs on one upload (in
+# any process) share its pages in the OS page cache instead of each parsing
+# or reading its own copy. Only the frame is shared: each job still converts
+# the columns it scores into Python string lists of its own (see
+# job_inputs.JobInputs), since the metric libraries take Python strings.
+#
+# names.sqlite3 maps an upload's file name to its latest content, for clients
+# that send only the file name to /evaluate.
+
+COPY_CHUNK_BYTES = 1024 * 1024
+
+
+class UploadStore:
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = None
+        self._mean_tokens: Dict[tuple, float] = {}
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(os.path.join(self.directory, "names.sqlite3"), check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS names (name TEXT PRIMARY KEY, upload_id TEXT NOT NULL, uploaded REAL NOT NULL)")
+            self._conn.commit()
+        return self._conn
+
+    def _path(self, upload_id: str, name: str) -> str:
+        # Ids come from clients: only a hex digest names a directory
+        if len(upload_id) != 64 or any(c not in "0123456789abcdef" for c in upload_id):
+            raise KeyError(upload_id)
+        return os.path.join(self.directory, upload_id, name)
+
+    def exists(self, upload_id: str) -> bool:
+        try:
+            return os.path.exists(self._path(upload_id, "meta.json"))
+        except KeyError:
+            return False
+
+    def save(self, file: BinaryIO, filename: str) -> Dict:
+        """Store an uploaded file; returns its meta.json ({upload_id, filename, columns, total_rows, ...}).
+
+        Raises ValueError (or the parser's error) for a file that cannot be parsed.
+        """
+        ext = os.path.splitext(filename)[1].lower()
+        staging = tempfile.mkdtemp(prefix=".upload-", dir=self.directory)
+        try:
+            digest = hashlib.sha256()
+            source = os.path.join(staging, "source" + ext)
+            with open(source, "wb") as out:
+                while True:
+                    chunk = file.read(COPY_CHUNK_BYTES)
+                    if not chunk:
+                        break
+                    digest.update(chunk)
+                    out.write(chunk)
+            upload_id = digest.hexdigest()
+
+            if self.exists(upload_id):
+                print(f"Upload {filename} is already stored as {upload_id[:12]}")
+                meta = self.meta(upload_id)
+            else:
+                start = time.perf_counter()
+                parsed = os.path.join(staging, "data.parquet")
+                columns, total_rows = ingest.to_parquet(source, parsed)
+                # Copied over a row group at a time, uncompressed, so the file can be memory-mapped as is
+                with pq.ParquetFile(parsed) as parquet, pa.OSFile(os.path.join(staging, "data.arrow"), "wb") as sink:
+                    with pa.ipc.new_file(sink, parquet.schema_arrow) as writer:
+                        for i in range(parquet.num_row_groups):
+                            writer.write_table(parquet.read_row_group(i))
+                os.remove(parsed)
+                meta = {"upload_id": upload_id, "filename": filename, "extension": ext, "columns": columns,
+                        "total_rows": total_rows, "bytes": os.path.getsize(source), "parse_seconds": time.perf_counter() - start}
+                with open(os.path.join(staging, "meta.json"), "w", encoding="utf-8") as f:
+                    json.dump(meta, f, ensure_ascii=False)
+                try:
+                    os.rename(staging, os.path.join(self.directory, upload_id))
+                    staging = None
+                except OSError:
+                    # The same file was stored by a concurrent upload meanwhile
+                    meta = self.meta(upload_id)
+        finally:
+            if staging is not None:
+                shutil.rmtree(staging, ignore_errors=True)
+
+        with self._lock:
+            conn = self._connect()
+            conn.execute("INSERT OR REPLACE INTO names (name, upload_id, uploaded) VALUES (?, ?, ?)", (filename, upload_id, time.time()))
+            conn.commit()
+        return dict(meta, filename=filename)
+
+    def lookup(self, filename: str) -> Optional[str]:
+        """The id of the latest upload with this file name."""
+        with self._lock:
+            row = self._connect().execute("SELECT upload_id FROM names WHERE name = ?", (filename,)).fetchone()
+        return row[0] if row and self.exists(row[0]) else None
+
+    def meta(self, upload_id: str) -> Dict:
+        with open(self._path(upload_id, "meta.json"), encoding="utf-8") as f:
+            return json.load(f)
+
+    def table(self, upload_id: str) -> pa.Table:
+        # Memory-mapped: nothing is read until a column is used
+        return pa.ipc.open_file(pa.memory_map(self._path(upload_id, "data.arrow"), "r")).read_all()
+
+    def frame(self, upload_id: str) -> pd.DataFrame:
+        """The parsed upload; its columns are views of the memory-mapped Arrow file, not copies."""
+        # Arrow-backed columns of every type: a plain to_pandas() copies numeric columns
+        # (and, before pandas 3, text columns) into NumPy arrays
+        return self.table(upload_id).to_pandas(types_mapper=pd.ArrowDtype)
+
+    def mean_tokens(self, upload_id: str, columns: List[str]) -> float:
+        # Stored content never changes, so the id is a complete cache key
+        key = (upload_id, tuple(columns))
+        if key not in self._mean_tokens:
+            self._mean_tokens[key] = ingest.mean_tokens(self.frame(upload_id), columns)
+        return self._mean_tokens[key]
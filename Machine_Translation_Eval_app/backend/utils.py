@@ -1,6 +1,6 @@
-import torch
-
 def get_hardware_info():
+    # torch is imported here rather than at module level: it takes seconds to import
+    import torch
     if torch.cuda.is_available():
         return {"device": "cuda", "name": torch.cuda.get_device_name(0)}
     elif torch.backends.mps.is_available():
@@ -8,17 +8,7 @@ def get_hardware_info():
     else:
         return {"device": "cpu", "name": "CPU"}
 
-def estimate_time(rows: int, num_models: int, hardware_info: dict):
-    # Heuristic: 
-    # CPU: ~1 row per second per model (very rough)
-    # GPU: ~10-50 rows per second per model
-    
-    device = hardware_info.get("device")
-    
-    if device == "cpu":
-        rows_per_sec = 1.0
-    else:
-        rows_per_sec = 20.0 # Conservative GPU estimate
-        
-    total_seconds = (rows * num_models) / rows_per_sec
-    return total_seconds
+def estimate_time(rows: int, metrics: list, hardware_info: dict, calibration=None, avg_tokens: float = 32.0, n_columns: int = 1):
+    # Every metric class estimates its own cost (see metrics.Metric.cost): calibrated types use the
+    # measured seconds per segment at the file's average segment length, the others a flat heuristic
+    return sum(metric.cost(rows, n_columns, avg_tokens, calibration, hardware_info) for metric in metrics)
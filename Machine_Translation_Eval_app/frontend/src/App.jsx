@@ -1,9 +1,11 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import axios from 'axios';
 import FileUpload from './components/FileUpload';
 import ModelSelection from './components/ModelSelection';
 import ColumnSelection from './components/ColumnSelection';
 import ResultsVisualization from './components/ResultsVisualization';
+import LiveResults from './components/LiveResults';
+import { emptyLiveResults, addChunk, snapshot } from './liveResults';
 
 const API_URL = 'http://localhost:8000';
 
@@ -17,7 +19,8 @@ function App() {
   const [selectedModels, setSelectedModels] = useState([]);
 
   const [isEvaluating, setIsEvaluating] = useState(false);
-  const [results, setResults] = useState(null);
+  // The finished job whose results are shown; rows are fetched page by page as they are displayed
+  const [resultsJob, setResultsJob] = useState(null);
   const [estimatedTime, setEstimatedTime] = useState(null);
   const [progress, setProgress] = useState("");
   const [clientId] = useState(() => Math.random().toString(36).substring(7));
@@ -46,15 +49,40 @@ function App() {
     return model && model.category === 'Reference-based';
   });
 
+  // Scores streamed so far for the running evaluation (one chunk per model, column and row range)
+  const scoredRef = useRef(0);
+  const expectedRef = useRef(0);
+  // Running means, sampled points and latest rows of the streamed chunks (see liveResults.js)
+  const liveRef = useRef(null);
+  const [liveResults, setLiveResults] = useState(null);
+
   useEffect(() => {
     const ws = new WebSocket(`ws://localhost:8000/ws/${clientId}`);
     ws.onmessage = (event) => {
+      // Progress messages are plain text, score chunks are JSON objects
+      let message = null;
+      try {
+        message = JSON.parse(event.data);
+      } catch {
+        message = null;
+      }
+      if (message && message.type === 'chunk') {
+        scoredRef.current += message.scores.length;
+        setProgress(`Scored ${scoredRef.current} of ${expectedRef.current} segments (${message.model} on ${message.column})`);
+        if (liveRef.current) {
+          addChunk(liveRef.current, message);
+          setLiveResults(snapshot(liveRef.current));
+        }
+        return;
+      }
       setProgress(event.data);
     };
     return () => ws.close();
   }, [clientId]);
 
   const [totalRows, setTotalRows] = useState(0);
+  // The stored upload's content hash; jobs are tied to it rather than to the file name
+  const [uploadId, setUploadId] = useState(null);
 
   const handleUpload = async (uploadedFile) => {
     const formData = new FormData();
@@ -65,6 +93,7 @@ function App() {
       setFile(uploadedFile);
       setColumns(response.data.columns);
       setTotalRows(response.data.total_rows);
+      setUploadId(response.data.upload_id);
       setStep(2);
     } catch (error) {
       console.error("Upload failed", error);
@@ -78,7 +107,12 @@ function App() {
         try {
           const response = await axios.post(`${API_URL}/estimate_time`, {
             rows: totalRows,
-            models: selectedModels
+            models: selectedModels,
+            // Lets the backend use the file's average segment length
+            filename: file ? file.name : null,
+            upload_id: uploadId,
+            columns: [selectedSource, selectedReference, ...selectedTargets].filter(Boolean),
+            n_target_columns: Math.max(selectedTargets.length, 1)
           });
           setEstimatedTime(response.data.estimated_seconds);
         } catch (error) {
@@ -89,7 +123,7 @@ function App() {
       }
     };
     fetchEstimate();
-  }, [totalRows, selectedModels]);
+  }, [totalRows, selectedModels, file, uploadId, selectedSource, selectedReference, selectedTargets]);
 
   const formatTime = (seconds) => {
     if (seconds < 60) return `${Math.round(seconds)} seconds`;
@@ -97,26 +131,65 @@ function App() {
     return `${minutes} minute${minutes !== 1 ? 's' : ''}`;
   };
 
+  const [jobId, setJobId] = useState(null);
+
+  const sleep = (ms) => new Promise(resolve => setTimeout(resolve, ms));
+
+  // Evaluations run as background jobs: poll the job until it finishes
+  const waitForJob = async (id) => {
+    while (true) {
+      const { data: job } = await axios.get(`${API_URL}/jobs/${id}`);
+      if (job.status === 'done') return job;
+      if (job.status === 'failed') throw new Error(job.error || 'Evaluation failed');
+      if (job.status === 'cancelled') throw new Error('Evaluation cancelled');
+      if (job.status === 'queued' && job.position !== null) {
+        setProgress(`Waiting in queue (position ${job.position + 1})...`);
+      }
+      await sleep(1000);
+    }
+  };
+
   const handleEvaluate = async () => {
     setIsEvaluating(true);
     setProgress("Initializing evaluation...");
+    scoredRef.current = 0;
+    expectedRef.current = totalRows * selectedTargets.length * selectedModels.length;
+    liveRef.current = emptyLiveResults(totalRows);
+    setLiveResults(null);
     try {
       const response = await axios.post(`${API_URL}/evaluate`, {
         filename: file.name,
+        upload_id: uploadId,
         src_col: selectedSource,
         tgt_cols: selectedTargets,
         models: selectedModels,
         ref_col: selectedReference,
-        client_id: clientId
+        client_id: clientId,
+        stream: true
       });
-      setResults(response.data);
+      setJobId(response.data.job_id);
+      const job = await waitForJob(response.data.job_id);
+      setResultsJob(job);
       setStep(3);
     } catch (error) {
       console.error("Evaluation failed", error);
-      alert("Evaluation failed: " + error.message);
+      alert("Evaluation failed: " + (error.response?.data?.detail || error.message));
     } finally {
       setIsEvaluating(false);
+      setJobId(null);
       setProgress("");
+      liveRef.current = null;
+      setLiveResults(null);
+    }
+  };
+
+  const handleCancel = async () => {
+    if (!jobId) return;
+    try {
+      await axios.post(`${API_URL}/jobs/${jobId}/cancel`);
+      setProgress("Cancelling...");
+    } catch (error) {
+      console.error("Cancel failed", error);
     }
   };
 
@@ -213,15 +286,26 @@ function App() {
                     <div className="overflow-hidden h-2 mb-4 text-xs flex rounded bg-blue-200">
                       <div className="animate-progress-indeterminate shadow-none flex flex-col text-center whitespace-nowrap text-white justify-center bg-blue-500"></div>
                     </div>
+                    <div className="text-center">
+                      <button
+                        onClick={handleCancel}
+                        disabled={!jobId}
+                        className="text-sm text-gray-600 hover:text-red-600 underline disabled:opacity-50"
+                      >
+                        Cancel
+                      </button>
+                    </div>
                   </div>
                 </div>
               )}
+
+              {isEvaluating && <LiveResults results={liveResults} totalRows={totalRows} />}
             </div>
           </>
         )}
 
         {step === 3 && (
-          <ResultsVisualization results={results} filename={file ? file.name : ""} />
+          <ResultsVisualization apiUrl={API_URL} job={resultsJob} filename={file ? file.name : ""} />
         )}
       </div>
     </div>
@@ -31,11 +31,11 @@ const FileUpload = ({ onUpload }) => {
     };
 
     const handleFile = (file) => {
-        if (file.name.endsWith('.xlsx')) {
+        if (/\.(xlsx|csv|parquet)$/i.test(file.name)) {
             setFile(file);
             onUpload(file);
         } else {
-            alert("Please upload an .xlsx file");
+            alert("Please upload an .xlsx, .csv or .parquet file");
         }
     };
 
@@ -55,7 +55,7 @@ const FileUpload = ({ onUpload }) => {
                     type="file"
                     className="absolute inset-0 w-full h-full opacity-0 cursor-pointer"
                     onChange={handleChange}
-                    accept=".xlsx"
+                    accept=".xlsx,.csv,.parquet"
                 />
 
                 <div className="text-center">
@@ -72,7 +72,7 @@ const FileUpload = ({ onUpload }) => {
                             <svg className="w-12 h-12 text-gray-400 mb-3" fill="none" stroke="currentColor" viewBox="0 0 24 24">
                                 <path strokeLinecap="round" strokeLinejoin="round" strokeWidth="2" d="M7 16a4 4 0 01-.88-7.903A5 5 0 1115.9 6L16 6a5 5 0 011 9.9M15 13l-3-3m0 0l-3 3m3-3v12" />
                             </svg>
-                            <p className="text-lg font-medium text-gray-900">Drop your .xlsx file here</p>
+                            <p className="text-lg font-medium text-gray-900">Drop your .xlsx, .csv or .parquet file here</p>
                             <p className="text-sm text-gray-500 mt-1">or click to browse</p>
                         </div>
                     )}
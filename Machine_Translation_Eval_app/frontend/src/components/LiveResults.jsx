@@ -0,0 +1,73 @@
+import React from 'react';
+import {
+    Chart as ChartJS,
+    LinearScale,
+    PointElement,
+    Tooltip,
+    Legend,
+} from 'chart.js';
+import { Scatter } from 'react-chartjs-2';
+
+ChartJS.register(LinearScale, PointElement, Tooltip, Legend);
+
+const LiveResults = ({ results, totalRows }) => {
+    if (!results || results.series.length === 0) return null;
+    const columns = results.series.map(s => s.column);
+
+    return (
+        <div className="w-full mt-8 space-y-6">
+            <h4 className="text-xl font-semibold text-gray-700 text-center">Scores so far</h4>
+            <div className="grid grid-cols-1 md:grid-cols-2 gap-6">
+                {results.series.map(s => (
+                    <div key={s.column} className="bg-white p-4 rounded-xl shadow-sm border border-gray-200">
+                        <h5 className="text-sm font-semibold text-gray-700 text-center">{s.column}</h5>
+                        <div className="h-48 w-full">
+                            <Scatter
+                                data={{ datasets: [{ label: 'Score', data: s.points, backgroundColor: 'rgba(53, 162, 235, 0.6)', pointRadius: 2 }] }}
+                                options={{
+                                    responsive: true,
+                                    maintainAspectRatio: false,
+                                    animation: false,
+                                    plugins: { legend: { display: false } },
+                                    scales: {
+                                        x: { type: 'linear', min: 0, max: totalRows + 1, title: { display: true, text: 'Sentence Index' } },
+                                        y: { title: { display: true, text: 'Score' } }
+                                    }
+                                }}
+                            />
+                        </div>
+                        <div className="mt-2 text-xs text-gray-500 text-center">
+                            {s.count} of {totalRows} segments · Mean {s.mean.toFixed(4)}
+                        </div>
+                    </div>
+                ))}
+            </div>
+            <div className="bg-white p-4 rounded-xl shadow-sm border border-gray-200 overflow-x-auto">
+                <table className="min-w-full divide-y divide-gray-200">
+                    <thead className="bg-gray-50">
+                        <tr>
+                            <th className="px-4 py-2 text-left text-xs font-medium text-gray-500 uppercase tracking-wider">#</th>
+                            {columns.map(col => (
+                                <th key={col} className="px-4 py-2 text-left text-xs font-medium text-gray-500 uppercase tracking-wider whitespace-nowrap">{col}</th>
+                            ))}
+                        </tr>
+                    </thead>
+                    <tbody className="bg-white divide-y divide-gray-200">
+                        {results.rows.map(([row, cells]) => (
+                            <tr key={row}>
+                                <td className="px-4 py-2 whitespace-nowrap text-sm text-gray-400">{row + 1}</td>
+                                {columns.map(col => (
+                                    <td key={col} className="px-4 py-2 whitespace-nowrap text-sm text-gray-500">
+                                        {cells[col] === undefined ? '' : cells[col].toFixed(4)}
+                                    </td>
+                                ))}
+                            </tr>
+                        ))}
+                    </tbody>
+                </table>
+            </div>
+        </div>
+    );
+};
+
+export default LiveResults;
@@ -1,4 +1,5 @@
-import React, { useMemo } from 'react';
+import React, { useEffect, useMemo, useState } from 'react';
+import axios from 'axios';
 import {
     Chart as ChartJS,
     CategoryScale,
@@ -10,7 +11,7 @@ import {
     Tooltip,
     Legend,
 } from 'chart.js';
-import { Scatter } from 'react-chartjs-2';
+import { Bar, Scatter } from 'react-chartjs-2';
 
 ChartJS.register(
     CategoryScale,
@@ -23,45 +24,73 @@ ChartJS.register(
     Legend
 );
 
-const ResultsVisualization = ({ results, filename }) => {
-    if (!results || results.length === 0) return null;
+const PAGE_SIZE = 50;
+
+const ResultsVisualization = ({ apiUrl, job, filename }) => {
+    // Only what is displayed is fetched: the precomputed summary of every score
+    // column, a downsampled series per chart and one page of table rows
+    const [summary, setSummary] = useState(null);
+    const [series, setSeries] = useState({});
+    const [page, setPage] = useState({ rows: [], matching_rows: 0 });
+    const [offset, setOffset] = useState(0);
+    const [sort, setSort] = useState({ column: null, order: 'asc' });
+    const [filter, setFilter] = useState({ column: '', min: '', max: '' });
+    const [appliedFilter, setAppliedFilter] = useState(null);
+
+    useEffect(() => {
+        if (!job) return;
+        const load = async () => {
+            const { data } = await axios.get(`${apiUrl}/jobs/${job.id}/summary`);
+            setSummary(data);
+            const fetched = {};
+            for (const col of data.score_columns) {
+                const { data: points } = await axios.get(`${apiUrl}/jobs/${job.id}/series`, { params: { column: col, points: 1000 } });
+                fetched[col] = points;
+            }
+            setSeries(fetched);
+        };
+        load().catch(error => console.error("Loading results failed", error));
+    }, [apiUrl, job]);
+
+    useEffect(() => {
+        if (!job) return;
+        const params = new URLSearchParams({ offset, limit: PAGE_SIZE });
+        if (sort.column) {
+            params.append('sort', sort.column);
+            params.append('order', sort.order);
+        }
+        if (appliedFilter) {
+            params.append('filter', `${appliedFilter.column}:${appliedFilter.min}:${appliedFilter.max}`);
+        }
+        axios.get(`${apiUrl}/jobs/${job.id}/results`, { params })
+            .then(({ data }) => setPage(data))
+            .catch(error => console.error("Loading rows failed", error));
+    }, [apiUrl, job, offset, sort, appliedFilter]);
 
-    // Helper to identify and prepare chart data for each metric column
     const chartsData = useMemo(() => {
-        if (results.length === 0) return [];
-        const firstRow = results[0];
-        const allKeys = Object.keys(firstRow);
-
-        // Identify metric columns
-        const metricColumns = allKeys.filter(key =>
-            key.startsWith('ter_') ||
-            key.startsWith('bertscore_') ||
-            key.startsWith('sacrebleu_') ||
-            key.startsWith('chrf_') ||
-            key.includes('wmt22-cometkiwi-da') ||
-            key.includes('wmt22-comet-da') ||
-            key.includes('monotransquest')
-        );
-
-        const preparedData = metricColumns.map(col => {
-            // Calculate Average
-            const values = results.map(row => parseFloat(row[col]) || 0);
-            const sum = values.reduce((acc, val) => acc + val, 0);
-            const average = sum / values.length;
-
-            // Scatter Data (Points)
-            const scatterData = values.map((val, i) => ({ x: i + 1, y: val }));
+        if (!summary) return [];
+        return summary.score_columns.filter(col => series[col] && summary.aggregates[col].count > 0).map(col => {
+            const stats = summary.aggregates[col];
+            const average = stats.mean;
+
+            // Scatter Data (Points): evenly spaced rows of the whole job
+            const scatterData = series[col].rows
+                .map((row, i) => ({ x: row + 1, y: series[col].values[i] }))
+                .filter(point => point.y !== null);
 
             // Average Line Data (Line)
             // We create a line from x=0 to x=totalRows+1 to span the whole chart
             const averageLineData = [
                 { x: 0, y: average },
-                { x: values.length + 1, y: average }
+                { x: summary.total_rows + 1, y: average }
             ];
 
+            const { edges, counts } = stats.histogram;
             return {
                 title: col,
                 average: average,
+                stats: stats,
+                sampled: scatterData.length < stats.count,
                 chartData: {
                     datasets: [
                         {
@@ -84,20 +113,41 @@ const ResultsVisualization = ({ results, filename }) => {
                             fill: false,
                         }
                     ]
+                },
+                histogramData: {
+                    labels: counts.map((_, i) => `${edges[i].toFixed(2)}–${edges[i + 1].toFixed(2)}`),
+                    datasets: [
+                        {
+                            label: 'Segments',
+                            data: counts,
+                            backgroundColor: 'rgba(53, 162, 235, 0.6)',
+                        }
+                    ]
                 }
             };
         });
+    }, [summary, series]);
 
-        return preparedData;
-    }, [results]);
+    if (!job || !summary) return null;
 
-    const downloadExcel = () => {
-        if (!filename) {
-            alert("Filename not found.");
-            return;
-        }
-        const resultFilename = `results_${filename}`;
-        const downloadUrl = `http://localhost:8000/download/${resultFilename}`;
+    const toggleSort = (column) => {
+        setOffset(0);
+        setSort(current => current.column === column
+            ? { column, order: current.order === 'asc' ? 'desc' : 'asc' }
+            : { column, order: 'asc' });
+    };
+
+    const applyFilter = () => {
+        setOffset(0);
+        setAppliedFilter(filter.column && (filter.min !== '' || filter.max !== '') ? { ...filter } : null);
+    };
+
+    const columns = page.rows.length > 0 ? Object.keys(page.rows[0]).filter(key => key !== '_row') : summary.columns;
+
+    const downloadResults = (extension) => {
+        // Results are stored per job; the file is named results_<upload name> for the browser
+        const resultFilename = `results_${(filename || 'evaluation').replace(/\.(xlsx|csv|parquet)$/i, '')}.${extension}`;
+        const downloadUrl = `${apiUrl}/jobs/${job.id}/download?format=${extension}`;
 
         // Trigger download
         const link = document.createElement('a');
@@ -131,7 +181,7 @@ const ResultsVisualization = ({ results, filename }) => {
                                                 text: 'Sentence Index'
                                             },
                                             min: 0,
-                                            suggestedMax: results.length + 1
+                                            suggestedMax: summary.total_rows + 1
                                         },
                                         y: {
                                             title: {
@@ -156,55 +206,132 @@ const ResultsVisualization = ({ results, filename }) => {
                                 }}
                             />
                         </div>
+                        <div className="mt-4 text-sm text-gray-500 text-center">
+                            Mean {data.stats.mean.toFixed(4)} · Median {data.stats.percentiles['50'].toFixed(4)} · Std {data.stats.std.toFixed(4)} · Min {data.stats.min.toFixed(4)} · Max {data.stats.max.toFixed(4)}
+                            {data.sampled && ` · ${data.chartData.datasets[0].data.length} of ${data.stats.count} segments plotted`}
+                        </div>
+                        <div className="h-64 w-full mt-4">
+                            <Bar
+                                data={data.histogramData}
+                                options={{
+                                    responsive: true,
+                                    maintainAspectRatio: false,
+                                    plugins: { legend: { display: false } },
+                                    scales: {
+                                        x: { title: { display: true, text: 'Score' } },
+                                        y: { title: { display: true, text: 'Segments' }, beginAtZero: true }
+                                    }
+                                }}
+                            />
+                        </div>
                     </div>
                 ))}
             </div>
 
             <div className="bg-white p-6 rounded-xl shadow-sm border border-gray-200 overflow-hidden">
                 <h4 className="text-2xl font-semibold text-gray-700 border-b pb-2 mb-4">Data Preview</h4>
+                <div className="flex flex-wrap items-end gap-4 mb-4 text-sm">
+                    <select
+                        className="border border-gray-300 rounded-md px-2 py-1"
+                        value={filter.column}
+                        onChange={(e) => setFilter({ ...filter, column: e.target.value })}
+                    >
+                        <option value="">Filter by score...</option>
+                        {summary.score_columns.map(col => <option key={col} value={col}>{col}</option>)}
+                    </select>
+                    <input
+                        type="number" step="any" placeholder="Min"
+                        className="border border-gray-300 rounded-md px-2 py-1 w-28"
+                        value={filter.min}
+                        onChange={(e) => setFilter({ ...filter, min: e.target.value })}
+                    />
+                    <input
+                        type="number" step="any" placeholder="Max"
+                        className="border border-gray-300 rounded-md px-2 py-1 w-28"
+                        value={filter.max}
+                        onChange={(e) => setFilter({ ...filter, max: e.target.value })}
+                    />
+                    <button className="bg-blue-600 hover:bg-blue-700 text-white font-medium py-1 px-4 rounded-md" onClick={applyFilter}>
+                        Apply
+                    </button>
+                </div>
                 <div className="overflow-x-auto">
                     <div className="max-h-96 overflow-y-auto">
                         <table className="min-w-full divide-y divide-gray-200">
                             <thead className="bg-gray-50 sticky top-0">
                                 <tr>
-                                    {results.length > 0 && Object.keys(results[0]).map((header) => (
-                                        <th key={header} scope="col" className="px-6 py-3 text-left text-xs font-medium text-gray-500 uppercase tracking-wider whitespace-nowrap">
-                                            {header}
+                                    <th scope="col" className="px-6 py-3 text-left text-xs font-medium text-gray-500 uppercase tracking-wider whitespace-nowrap">#</th>
+                                    {columns.map((header) => (
+                                        <th
+                                            key={header}
+                                            scope="col"
+                                            className="px-6 py-3 text-left text-xs font-medium text-gray-500 uppercase tracking-wider whitespace-nowrap cursor-pointer hover:text-gray-700"
+                                            onClick={() => toggleSort(header)}
+                                        >
+                                            {header}{sort.column === header ? (sort.order === 'asc' ? ' ▲' : ' ▼') : ''}
                                         </th>
                                     ))}
                                 </tr>
                             </thead>
                             <tbody className="bg-white divide-y divide-gray-200">
-                                {results.slice(0, 100).map((row, rowIndex) => (
-                                    <tr key={rowIndex}>
-                                        {Object.values(row).map((cell, cellIndex) => (
-                                            <td key={cellIndex} className="px-6 py-4 whitespace-nowrap text-sm text-gray-500">
-                                                {typeof cell === 'number' ? cell.toFixed(4) : String(cell).substring(0, 50) + (String(cell).length > 50 ? '...' : '')}
-                                            </td>
-                                        ))}
+                                {page.rows.map((row) => (
+                                    <tr key={row._row}>
+                                        <td className="px-6 py-4 whitespace-nowrap text-sm text-gray-400">{row._row + 1}</td>
+                                        {columns.map((col) => {
+                                            const cell = row[col];
+                                            return (
+                                                <td key={col} className="px-6 py-4 whitespace-nowrap text-sm text-gray-500">
+                                                    {cell === null || cell === undefined ? '' : typeof cell === 'number' ? cell.toFixed(4) : String(cell).substring(0, 50) + (String(cell).length > 50 ? '...' : '')}
+                                                </td>
+                                            );
+                                        })}
                                     </tr>
                                 ))}
                             </tbody>
                         </table>
                     </div>
-                    {results.length > 100 && (
-                        <div className="text-center py-2 text-sm text-gray-500 bg-gray-50">
-                            Showing first 100 rows of {results.length}
-                        </div>
-                    )}
+                    <div className="flex justify-between items-center py-2 px-2 text-sm text-gray-500 bg-gray-50">
+                        <button
+                            className="px-3 py-1 rounded-md border border-gray-300 disabled:opacity-50"
+                            disabled={offset === 0}
+                            onClick={() => setOffset(Math.max(0, offset - PAGE_SIZE))}
+                        >
+                            Previous
+                        </button>
+                        <span>
+                            {page.matching_rows === 0 ? 'No rows' : `Rows ${offset + 1}–${Math.min(offset + PAGE_SIZE, page.matching_rows)} of ${page.matching_rows}`}
+                            {page.matching_rows !== summary.total_rows && ` (filtered from ${summary.total_rows})`}
+                        </span>
+                        <button
+                            className="px-3 py-1 rounded-md border border-gray-300 disabled:opacity-50"
+                            disabled={offset + PAGE_SIZE >= page.matching_rows}
+                            onClick={() => setOffset(offset + PAGE_SIZE)}
+                        >
+                            Next
+                        </button>
+                    </div>
                 </div>
             </div>
 
-            <div className="flex justify-center pt-8">
+            <div className="flex justify-center pt-8 space-x-4">
                 <button
                     className="bg-green-600 hover:bg-green-700 text-white font-bold py-3 px-8 rounded-lg transition-colors shadow-lg flex items-center"
-                    onClick={downloadExcel}
+                    onClick={() => downloadResults('xlsx')}
                 >
                     <svg className="w-5 h-5 mr-2" fill="none" stroke="currentColor" viewBox="0 0 24 24">
                         <path strokeLinecap="round" strokeLinejoin="round" strokeWidth="2" d="M4 16v1a3 3 0 003 3h10a3 3 0 003-3v-1m-4-4l-4 4m0 0l-4-4m4 4V4" />
                     </svg>
                     Download Results (.xlsx)
                 </button>
+                <button
+                    className="bg-white hover:bg-gray-50 text-green-700 border border-green-600 font-bold py-3 px-8 rounded-lg transition-colors shadow-lg flex items-center"
+                    onClick={() => downloadResults('csv')}
+                >
+                    <svg className="w-5 h-5 mr-2" fill="none" stroke="currentColor" viewBox="0 0 24 24">
+                        <path strokeLinecap="round" strokeLinejoin="round" strokeWidth="2" d="M4 16v1a3 3 0 003 3h10a3 3 0 003-3v-1m-4-4l-4 4m0 0l-4-4m4 4V4" />
+                    </svg>
+                    .csv
+                </button>
             </div>
         </div>
     );
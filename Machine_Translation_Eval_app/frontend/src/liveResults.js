@@ -0,0 +1,38 @@
+// Points kept per score column while a job runs, and rows kept for the table;
+// memory stays the same however large the job is
+export const LIVE_POINTS = 1000;
+export const LIVE_ROWS = 20;
+
+// Streamed score chunks of the running job: every score column's running mean,
+// an evenly spaced sample of its scores for the chart and the latest rows
+export const emptyLiveResults = (totalRows) => ({
+    stride: Math.max(1, Math.ceil(totalRows / LIVE_POINTS)),
+    series: {},
+    rows: new Map(),
+});
+
+export const addChunk = (live, chunk) => {
+    // Score columns are named as in the finished results: <model>_<target column>
+    const column = `${chunk.model}_${chunk.column}`;
+    const series = live.series[column] || (live.series[column] = { points: [], sum: 0, count: 0 });
+    chunk.scores.forEach((score, i) => {
+        const row = chunk.start + i;
+        if (typeof score !== 'number') return;
+        series.sum += score;
+        series.count += 1;
+        if (row % live.stride === 0) series.points.push({ x: row + 1, y: score });
+        if (i < LIVE_ROWS) {
+            const cells = live.rows.get(row) || {};
+            live.rows.delete(row);
+            live.rows.set(row, { ...cells, [column]: score });
+        }
+    });
+    // The most recently scored rows stay
+    while (live.rows.size > LIVE_ROWS) live.rows.delete(live.rows.keys().next().value);
+};
+
+// A copy to render: the chunks keep arriving into `live`
+export const snapshot = (live) => ({
+    series: Object.entries(live.series).map(([column, s]) => ({ column, mean: s.sum / s.count, count: s.count, points: s.points.slice() })),
+    rows: [...live.rows.entries()].sort((a, b) => a[0] - b[0]),
+});